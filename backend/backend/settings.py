@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+from datetime import timedelta
 from pathlib import Path
 import os
 
@@ -49,12 +50,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'properties.middleware.RequestIdMiddleware',
+    'properties.middleware.MetricsMiddleware',
+    'properties.middleware.ProfilingMiddleware',
+    'properties.middleware.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'properties.middleware.IdentityMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -83,13 +89,65 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+# SQLITE_PROFILE=production (the default) tunes SQLite for several
+# concurrent workers: WAL lets readers run alongside the single writer,
+# busy_timeout makes writers queue instead of failing, and connections are
+# kept open between requests. SQLITE_PROFILE=basic is the stock setup.
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'production')
+
+# Database file, SQLITE_PATH overrides it (the benchmarks run on a copy)
+SQLITE_PATH = os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3')
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # in KiB
+    'temp_store': 'MEMORY',
 }
 
+if SQLITE_PROFILE == 'production':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'properties.sqlite3',
+            'NAME': SQLITE_PATH,
+            'OPTIONS': {
+                'init_command': '; '.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+                'timeout': 20,
+            },
+            'CONN_MAX_AGE': 600,
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': SQLITE_PATH,
+        }
+    }
+
+# Read replica for list and detail reads, see properties.db_routers.
+# SQLITE_REPLICA=1 adds a local replica: a copy of db.sqlite3 refreshed
+# with `manage.py refresh_replica --interval 5`.
+DATABASE_REPLICA_ALIAS = 'replica'
+DATABASE_ROUTERS = ['properties.db_routers.PrimaryReplicaRouter']
+
+if os.environ.get('SQLITE_REPLICA'):
+    replica = dict(DATABASES['default'], NAME=BASE_DIR / 'db.replica.sqlite3', TEST={'MIRROR': 'default'})
+    replica['OPTIONS'] = dict(replica.get('OPTIONS', {}))
+    replica['OPTIONS']['init_command'] = '; '.join(
+        filter(None, [replica['OPTIONS'].get('init_command'), 'PRAGMA query_only=ON'])
+    )
+    if replica['ENGINE'] == 'django.db.backends.sqlite3':
+        replica['ENGINE'] = 'properties.sqlite3'
+    DATABASES[DATABASE_REPLICA_ALIAS] = replica
+
+# Retries of write_transaction blocks that could not take the write lock
+WRITE_TRANSACTION_RETRIES = 5
+WRITE_TRANSACTION_BACKOFF = 0.05
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -135,17 +193,37 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Add Custom user model
 AUTH_USER_MODEL = 'properties.CustomUser'
 
+# Authentication mode
+# 'jwt'   - signed access/refresh tokens, checked without a database query
+# 'token' - the previous DRF Token and session authentication
+AUTH_TOKEN_MODE = os.environ.get('AUTH_TOKEN_MODE', 'jwt')
+
+if AUTH_TOKEN_MODE == 'jwt':
+    AUTHENTICATION_CLASSES = [
+        'properties.authentication.StatelessJWTAuthentication',
+    ]
+else:
+    AUTHENTICATION_CLASSES = [
+        'properties.authentication.ProfileTokenAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+    ]
+
 # Add REST Framework settings
 REST_FRAMEWORK = {
-    'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
-        'rest_framework.authentication.SessionAuthentication',
-    ],
+    'DEFAULT_AUTHENTICATION_CLASSES': AUTHENTICATION_CLASSES,
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
 }
 
+SIMPLE_JWT = {
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=15),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
+    # The frontend sends "Token <key>", accept it for signed tokens too
+    'AUTH_HEADER_TYPES': ('Bearer', 'Token'),
+    'UPDATE_LAST_LOGIN': False,
+}
+
 # Add CORS settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",  # Your frontend URL
@@ -165,3 +243,121 @@ CORS_ALLOW_METHODS = [
 # Add Media settings
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Cache settings
+# Every worker process has to see the same cache, or an invalidation only
+# reaches the worker that made the change. Entries are files in CACHE_DIR,
+# shared by the processes of this host; set REDIS_URL to share them between
+# hosts (needs the redis package).
+CACHE_DIR = os.environ.get('CACHE_DIR', os.path.join(BASE_DIR, 'cache'))
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_DIR,
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+# Public showcase (completed properties) response cache, in seconds
+SHOWCASE_CACHE_TIMEOUT = 300
+SHOWCASE_CACHE_LOCK_TIMEOUT = 30
+SHOWCASE_CACHE_LOCK_WAIT = 2
+
+# Property browser facet counts cache, in seconds
+FACETS_CACHE_TIMEOUT = 60
+
+# Uploaded image variants (thumbnails and responsive sizes)
+IMAGE_VARIANT_WIDTHS = (320, 640, 1280)
+IMAGE_VARIANT_WORKERS = 2
+IMAGE_VARIANTS_ASYNC = True
+
+# Resumable upload sessions: chunks are written straight to these files
+UPLOAD_SESSION_ROOT = os.path.join(BASE_DIR, 'upload_sessions')
+UPLOAD_SESSION_MAX_SIZE = 20 * 1024 * 1024
+UPLOAD_CHUNK_MAX_SIZE = 4 * 1024 * 1024
+UPLOAD_SESSION_EXPIRY_HOURS = 24
+# Sessions a user can hold at once, open or committed but not yet used
+UPLOAD_SESSIONS_PER_USER = 50
+
+# Most properties POST /api/properties/bulk_review/ takes at once
+BULK_REVIEW_MAX_ITEMS = 500
+
+# Per-route request metrics, served at /api/_metrics (see properties.metrics).
+# Every worker process writes its own file in METRICS_DIR; empty it on deploy.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(BASE_DIR, 'metrics'))
+METRICS_MAX_SERIES = 512
+# Lets Prometheus scrape with "Authorization: Bearer <token>"; admins can always read the metrics
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Request profiling (see properties.profiling): admins send "X-Profile: 1",
+# and this share of all requests is profiled too. The newest
+# PROFILING_MAX_PROFILES profiles are kept in PROFILING_DIR.
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_INTERVAL = 0.001
+PROFILING_DIR = os.environ.get('PROFILING_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILING_MAX_PROFILES = 50
+
+# Slow query log (see properties.slow_queries): statements slower than this
+# are written with their plan to SLOW_QUERY_LOG_DIR and ranked at
+# /api/_slow_queries. SLOW_QUERY_THRESHOLD_MS=off turns the log off.
+# Every worker process writes and rotates its own file there; the
+# SLOW_QUERY_LOG_MAX_FILES newest files, current or rotated, are kept.
+_slow_query_threshold = os.environ.get('SLOW_QUERY_THRESHOLD_MS', '100')
+SLOW_QUERY_THRESHOLD_MS = None if _slow_query_threshold == 'off' else float(_slow_query_threshold)
+SLOW_QUERY_LOG_DIR = os.environ.get('SLOW_QUERY_LOG_DIR', os.path.join(BASE_DIR, 'slow_queries'))
+SLOW_QUERY_LOG_MAX_BYTES = 5 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 3
+SLOW_QUERY_LOG_MAX_FILES = 64
+
+# Application logs (see properties.logs): JSON lines with the request id,
+# written by a background thread so requests never wait on log I/O.
+# Debug logs, such as request payload summaries, need LOG_LEVEL=DEBUG.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_MAX_FIELD_CHARS = 8192
+LOG_QUEUE_SIZE = 10000
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'properties.logs.JsonFormatter'},
+    },
+    'handlers': {
+        'stderr': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+        },
+        'slow_query_file': {
+            '()': 'properties.logs.WorkerFileHandler',
+            'directory': SLOW_QUERY_LOG_DIR,
+            'max_bytes': SLOW_QUERY_LOG_MAX_BYTES,
+            'backup_count': SLOW_QUERY_LOG_BACKUPS,
+            'max_files': SLOW_QUERY_LOG_MAX_FILES,
+            'formatter': 'json',
+        },
+        'background': {
+            '()': 'properties.logs.BackgroundHandler',
+            'handlers': ['stderr'],
+            'queue_size': LOG_QUEUE_SIZE,
+        },
+        'slow_queries': {
+            '()': 'properties.logs.BackgroundHandler',
+            'handlers': ['slow_query_file'],
+            'queue_size': LOG_QUEUE_SIZE,
+        },
+    },
+    'loggers': {
+        'properties': {'handlers': ['background'], 'level': LOG_LEVEL, 'propagate': False},
+        'properties.slow_queries': {'handlers': ['slow_queries'], 'level': 'WARNING', 'propagate': False},
+    },
+}
@@ -0,0 +1,24 @@
+"""
+Settings for the test suite, which runs in a single process: its cache
+stays in that process rather than in the site's shared cache, and the
+files it writes go to a temporary directory removed when it exits.
+"""
+import atexit
+import os
+import shutil
+import tempfile
+
+from .settings import *  # noqa: F401,F403
+
+TEST_FILES_DIR = tempfile.mkdtemp(prefix='build-saudi-tests-')
+atexit.register(shutil.rmtree, TEST_FILES_DIR, ignore_errors=True)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'build-saudi-tests',
+    }
+}
+METRICS_DIR = os.path.join(TEST_FILES_DIR, 'metrics')
+SLOW_QUERY_LOG_DIR = os.path.join(TEST_FILES_DIR, 'slow_queries')
+LOGGING['handlers']['slow_query_file']['directory'] = SLOW_QUERY_LOG_DIR  # noqa: F405
@@ -15,15 +15,17 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from rest_framework.routers import DefaultRouter
 from properties.views import (
     CustomUserViewSet, PropertyViewSet,
     ContractorViewSet, EvaluationRequestViewSet,
-    signup_view, login_view, logout_view,
+    signup_view, login_view, logout_view, refresh_token_view,
     PriceOfferViewSet, accept_price_offer, reject_price_offer, complete_property_work,
-    mark_property_completed, admin_review_standalone, approve_property
+    mark_property_completed, admin_review_standalone, approve_property,
+    serve_media_blob, UploadSessionViewSet, metrics_view, slow_queries_view
 )
+from properties import async_views
 from django.conf import settings
 from django.conf.urls.static import static
 
@@ -33,17 +35,43 @@ router.register(r'properties', PropertyViewSet)
 router.register(r'contractors', ContractorViewSet)
 router.register(r'evaluation-requests', EvaluationRequestViewSet)
 router.register(r'price-offers', PriceOfferViewSet)
+router.register(r'uploads', UploadSessionViewSet)
+router_views = {url.name: url.callback for url in router.urls}
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    # Async GET paths, ahead of the router routes that serve everything else
+    path('api/properties/', async_views.get_view(
+        async_views.property_list, router_views['property-list']
+    ), name='property-list-async'),
+    path('api/properties/completed-list/', async_views.get_view(
+        async_views.completed_list, router_views['property-completed-list']
+    ), name='property-completed-list-async'),
+    path('api/properties/<int:pk>/', async_views.get_view(
+        async_views.property_detail, router_views['property-detail']
+    ), name='property-detail-async'),
+    path('api/price-offers/', async_views.get_view(
+        async_views.price_offer_list, router_views['priceoffer-list']
+    ), name='priceoffer-list-async'),
     path('api/', include(router.urls)),
     path('api/signup/', signup_view, name='signup'),
     path('api/login/', login_view, name='login'),
     path('api/logout/', logout_view, name='logout'),
+    path('api/token/refresh/', refresh_token_view, name='token-refresh'),
     path('api/price-offers/<int:offer_id>/accept/', accept_price_offer, name='accept-price-offer'),
     path('api/price-offers/<int:offer_id>/reject/', reject_price_offer, name='reject-price-offer'),
     path('api/properties/<int:property_id>/complete/', complete_property_work, name='complete-property-work'),
     path('api/properties/<int:property_id>/mark_completed/', mark_property_completed, name='mark-property-completed'),
     path('api/properties/<int:property_id>/admin_review/', admin_review_standalone, name='admin-review'),
     path('api/properties/<int:property_id>/approve/', approve_property, name='approve-property'),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('api/_metrics', metrics_view, name='metrics'),
+    path('api/_slow_queries', slow_queries_view, name='slow-queries'),
+]
+
+if settings.DEBUG:
+    # Content-addressed uploads never change, let browsers cache them for good
+    urlpatterns += [
+        re_path(r'^media/(?P<path>blobs/.*)$', serve_media_blob, name='media-blob'),
+    ]
+
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class PropertiesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'properties'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from . import metrics, profiling, slow_queries
+
+        connection_created.connect(metrics.install_query_observer, dispatch_uid='properties.metrics')
+        connection_created.connect(profiling.install_query_observer, dispatch_uid='properties.profiling')
+        connection_created.connect(slow_queries.install_query_observer, dispatch_uid='properties.slow_queries')
@@ -0,0 +1,243 @@
+"""
+Async implementations of the hottest read endpoints, served natively when
+the site runs under ASGI (uvicorn backend.asgi:application).
+
+DRF views are synchronous, so these are plain Django async views. Each one
+sets up the matching viewset without dispatching it and reuses its
+queryset building, scoping, serializers and pagination. Rows are fetched
+with QuerySet.aiterator()/aget() and serialized once everything they read
+is loaded, so serializing never touches the database.
+
+get_view() puts one of them in front of the router's view for the same
+URL: other methods, and the GET requests it does not handle (other roles
+or filters), go to the router's view unchanged.
+"""
+from collections import defaultdict
+from contextlib import nullcontext
+
+from asgiref.sync import sync_to_async
+from django.db.models import Prefetch, prefetch_related_objects
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.fields.related_descriptors import (
+    ManyToManyDescriptor, ReverseManyToOneDescriptor
+)
+from django.http import Http404
+from rest_framework.response import Response
+
+from .caching import acached_showcase_response
+from .db_routers import replica_reads
+from .identity import Identity
+from .models import Property
+
+
+def async_csrf_exempt(view):
+    # django.views.decorators.csrf.csrf_exempt only keeps coroutine
+    # functions async from Django 5.0 on
+    view.csrf_exempt = True
+    return view
+
+
+async def aprefetch_related_objects(instances, *lookups):
+    """
+    prefetch_related_objects() for async code. Single level reverse foreign
+    key lookups, which is what the serializers use, are fetched with
+    aiterator(); anything else is handed to Django's implementation.
+    """
+    if not instances:
+        return
+    model = type(instances[0])
+    for lookup in lookups:
+        if not isinstance(lookup, Prefetch):
+            lookup = Prefetch(lookup)
+        descriptor = getattr(model, lookup.prefetch_through, None)
+        if (
+            LOOKUP_SEP in lookup.prefetch_through
+            or not isinstance(descriptor, ReverseManyToOneDescriptor)
+            or isinstance(descriptor, ManyToManyDescriptor)
+        ):
+            await sync_to_async(prefetch_related_objects)(instances, lookup)
+            continue
+
+        field = descriptor.field
+        target = field.target_field.attname
+        queryset = lookup.queryset if lookup.queryset is not None else field.model._default_manager.all()
+        related = await aevaluate(
+            queryset.filter(**{f'{field.name}__in': {getattr(instance, target) for instance in instances}})
+        )
+        grouped = defaultdict(list)
+        for obj in related:
+            grouped[getattr(obj, field.attname)].append(obj)
+
+        for instance in instances:
+            values = grouped[getattr(instance, target)]
+            for obj in values:
+                field.set_cached_value(obj, instance)
+            if lookup.to_attr:
+                setattr(instance, lookup.to_attr, values)
+                continue
+            # Same cache the related manager reads, as prefetch_related() fills it
+            cached = getattr(instance, lookup.prefetch_through).get_queryset()
+            cached._result_cache = values
+            cached._prefetch_done = True
+            instance.__dict__.setdefault('_prefetched_objects_cache', {})[
+                field.remote_field.get_cache_name()
+            ] = cached
+
+
+async def aevaluate(queryset):
+    """
+    list(queryset) for async code. QuerySet.aiterator() refuses querysets
+    with prefetch_related() lookups before Django 5.0, so they are run here.
+    """
+    lookups = queryset._prefetch_related_lookups
+    instances = [instance async for instance in queryset.prefetch_related(None).aiterator()]
+    await aprefetch_related_objects(instances, *lookups)
+    return instances
+
+
+async def aget(queryset, **kwargs):
+    """QuerySet.aget() that also runs the queryset's prefetch_related() lookups"""
+    lookups = queryset._prefetch_related_lookups
+    instance = await queryset.prefetch_related(None).aget(**kwargs)
+    await aprefetch_related_objects([instance], *lookups)
+    return instance
+
+
+def build_view(sync_view, request, **kwargs):
+    """
+    Set up an instance of the viewset behind ``sync_view``, a view returned
+    by ViewSet.as_view(), the way it does for a request, without
+    dispatching it.
+    """
+    view = sync_view.cls(**sync_view.initkwargs)
+    view.action_map = sync_view.actions
+    for method, action in sync_view.actions.items():
+        setattr(view, method, getattr(view, action))
+    view.args, view.kwargs = (), kwargs
+    view.format_kwarg = None
+    view.request = view.initialize_request(request, **kwargs)
+    view.headers = view.default_response_headers
+    return view
+
+
+def initial(view):
+    """
+    APIView.initial(): authentication, permission and throttle checks. The
+    caller's identity is resolved here too, as it may need a query.
+    """
+    request = view.request
+    view.initial(request)
+    identity = Identity(request.user, request.auth)
+    identity.contractor_id  # Load it now rather than lazily from async code
+    request._request.identity = identity
+
+
+async def adispatch(view, handler, fallback):
+    """
+    APIView.dispatch() for the coroutine function ``handler(view)``, which
+    returns a Response, or None to hand the request to the synchronous
+    ``fallback`` view, which authenticates it again.
+    """
+    request = view.request
+    use_replica = view.action in getattr(view, 'replica_actions', ())
+    with replica_reads() if use_replica else nullcontext():
+        try:
+            await sync_to_async(initial)(view)
+            response = await handler(view)
+            if response is None:
+                return await sync_to_async(fallback)(request._request, **view.kwargs)
+        except Exception as exc:
+            response = view.handle_exception(exc)
+    return view.finalize_response(request, response)
+
+
+async def alist(view, queryset):
+    """ListModelMixin.list() for async handlers"""
+    page = await view.paginator.apaginate_queryset(queryset, view.request, view=view, evaluate=aevaluate)
+    if page is not None:
+        return view.get_paginated_response(view.get_serializer(page, many=True).data)
+    return Response(view.get_serializer(await aevaluate(queryset), many=True).data)
+
+
+async def acompleted_list(view):
+    async def build():
+        completed_properties = view.get_base_queryset().filter(
+            status='completed'
+        ).order_by('-completion_date')
+        return (await alist(view, completed_properties)).data
+
+    return await acached_showcase_response(view.request, build)
+
+
+async def aretrieve_property(view):
+    try:
+        instance = await aget(view.filter_queryset(view.get_queryset()), pk=view.kwargs['pk'])
+    except Property.DoesNotExist:
+        raise Http404('Property not found')
+    return Response(view.get_serializer(instance).data)
+
+
+async def aavailable_property_list(view):
+    # Contractors browsing the approved properties they can make offers on
+    if view.request.query_params.get('status') != 'approved' or not view.request.identity.is_contractor:
+        return None
+    return await alist(view, view.filter_queryset(view.get_queryset()))
+
+
+async def ahomeowner_price_offer_list(view):
+    if not view.request.identity.is_homeowner:
+        return None
+    return await alist(view, view.filter_queryset(view.get_queryset()))
+
+
+def get_view(handler, sync_view):
+    """
+    A view serving GET requests with the coroutine function
+    ``handler(request, sync_view, **kwargs)`` and every other method with
+    ``sync_view``, the router's view for the same URL.
+    """
+    @async_csrf_exempt
+    async def view(request, **kwargs):
+        if request.method != 'GET':
+            return await sync_to_async(sync_view)(request, **kwargs)
+        return await handler(request, sync_view, **kwargs)
+
+    view.__name__ = view.__qualname__ = handler.__name__
+    view.__doc__ = handler.__doc__
+    return view
+
+
+async def completed_list(request, sync_view):
+    """
+    Async PropertyViewSet.completed_list
+    URL: /api/properties/completed-list/
+    """
+    view = build_view(sync_view, request)
+    return await adispatch(view, acompleted_list, sync_view)
+
+
+async def property_list(request, sync_view):
+    """
+    Async PropertyViewSet.list for contractors with ?status=approved
+    URL: /api/properties/
+    """
+    view = build_view(sync_view, request)
+    return await adispatch(view, aavailable_property_list, sync_view)
+
+
+async def property_detail(request, sync_view, pk):
+    """
+    Async PropertyViewSet.retrieve
+    URL: /api/properties/<pk>/
+    """
+    view = build_view(sync_view, request, pk=pk)
+    return await adispatch(view, aretrieve_property, sync_view)
+
+
+async def price_offer_list(request, sync_view):
+    """
+    Async PriceOfferViewSet.list for homeowners
+    URL: /api/price-offers/
+    """
+    view = build_view(sync_view, request)
+    return await adispatch(view, ahomeowner_price_offer_list, sync_view)
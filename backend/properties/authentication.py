@@ -0,0 +1,202 @@
+"""
+Signed access/refresh tokens (AUTH_TOKEN_MODE = 'jwt').
+
+Access tokens carry the user id, role and contractor profile id, so a
+request is authenticated without a database query. Tokens revoked on
+logout are recorded in RevokedToken. Whether a token is revoked is cached,
+in the cache every worker shares, until the token expires, so an access
+token is looked up in the table once at most; refresh tokens are checked
+against the table every time.
+"""
+import hmac
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework.authentication import BaseAuthentication, TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from .models import Contractor, CustomUser, RevokedToken
+
+# Claims copied onto the user built for each request, by model field name
+USER_CLAIMS = ('role', 'is_staff', 'is_superuser')
+
+
+def jwt_mode():
+    return settings.AUTH_TOKEN_MODE == 'jwt'
+
+
+def issue_tokens(user):
+    """The token part of the login and signup responses"""
+    if not jwt_mode():
+        token, created = Token.objects.get_or_create(user=user)
+        return {'token': token.key}
+
+    refresh = RefreshToken.for_user(user)
+    for claim, value in user_claims(user).items():
+        refresh[claim] = value
+    # The access token copies the custom claims from the refresh token
+    access = refresh.access_token
+    # A new token is not revoked, checking it needs no query
+    _cache_revoked(access, False)
+    return {'token': str(access), 'refresh': str(refresh)}
+
+
+def user_claims(user):
+    """The custom claims of ``user``'s tokens, as they are now"""
+    claims = {claim: getattr(user, claim) for claim in USER_CLAIMS}
+    claims['contractor_id'] = None
+    if user.role == 'contractor':
+        try:
+            claims['contractor_id'] = user.contractor.pk
+        except Contractor.DoesNotExist:
+            pass
+    return claims
+
+
+def refresh_access_token(raw_refresh):
+    """
+    A new access token for a refresh token. The claims are read again, so a
+    role change or a contractor profile created since the login shows up.
+    """
+    try:
+        refresh = RefreshToken(raw_refresh)
+    except TokenError as e:
+        raise InvalidToken(str(e))
+    if is_revoked(refresh, check_database=True):
+        raise InvalidToken('Token has been revoked')
+    user_id = CustomUser._meta.pk.to_python(refresh[jwt_settings.USER_ID_CLAIM])
+    user = CustomUser.objects.select_related('contractor').filter(pk=user_id, is_active=True).first()
+    if user is None:
+        raise InvalidToken('User not found')
+    access = refresh.access_token
+    for claim, value in user_claims(user).items():
+        access[claim] = value
+    _cache_revoked(access, False)
+    return str(access)
+
+
+def _cache_key(jti):
+    return f'auth:revoked:{jti}'
+
+
+def _seconds_left(token):
+    return int(token['exp'] - timezone.now().timestamp()) + 1
+
+
+def _cache_revoked(token, revoked):
+    """
+    Cache whether ``token`` is revoked until it expires. add(), so a
+    revocation cached in the meantime by another worker is not overwritten.
+    """
+    if _seconds_left(token) > 0:
+        cache.add(_cache_key(token[jwt_settings.JTI_CLAIM]), revoked, _seconds_left(token))
+
+
+def is_revoked(token, check_database=False):
+    """
+    Whether ``token`` was revoked. The table is read when the cache has no
+    answer, for instance after an eviction, and always with check_database.
+    """
+    revoked = cache.get(_cache_key(token.get(jwt_settings.JTI_CLAIM)))
+    if revoked is None or (check_database and not revoked):
+        revoked = RevokedToken.objects.filter(jti=token.get(jwt_settings.JTI_CLAIM)).exists()
+        _cache_revoked(token, revoked)
+    return revoked
+
+
+def revoke_token(token):
+    jti = token[jwt_settings.JTI_CLAIM]
+    expires_at = datetime.fromtimestamp(token['exp'], tz=dt_timezone.utc)
+    RevokedToken.objects.filter(expires_at__lt=timezone.now()).delete()
+    RevokedToken.objects.get_or_create(jti=jti, defaults={'expires_at': expires_at})
+    if _seconds_left(token) > 0:
+        cache.set(_cache_key(jti), True, _seconds_left(token))
+
+
+def revoke_request_tokens(request):
+    """Log out: revoke the access token used and the refresh token sent, if any"""
+    if not jwt_mode():
+        Token.objects.filter(user=request.user).delete()
+        return
+
+    if isinstance(request.auth, AccessToken):
+        revoke_token(request.auth)
+    raw_refresh = request.data.get('refresh')
+    if raw_refresh:
+        try:
+            revoke_token(RefreshToken(raw_refresh))
+        except TokenError:
+            pass
+
+
+def token_user(validated_token):
+    """
+    A CustomUser built from the token claims. Fields not carried by the
+    token are deferred and only loaded if something reads them.
+    """
+    values = {claim: validated_token[claim] for claim in USER_CLAIMS if claim in validated_token}
+    # simplejwt stores the id claim as a string
+    values['id'] = CustomUser._meta.pk.to_python(validated_token[jwt_settings.USER_ID_CLAIM])
+    values['is_active'] = True
+    names = [field.attname for field in CustomUser._meta.concrete_fields if field.attname in values]
+    return CustomUser.from_db(None, names, [values[name] for name in names])
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    def get_validated_token(self, raw_token):
+        validated_token = super().get_validated_token(raw_token)
+        if is_revoked(validated_token):
+            raise InvalidToken('Token has been revoked')
+        return validated_token
+
+    def get_user(self, validated_token):
+        if jwt_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken('Token contained no recognizable user identification')
+        return token_user(validated_token)
+
+
+class ProfileTokenAuthentication(TokenAuthentication):
+    """
+    DRF token authentication (AUTH_TOKEN_MODE = 'token') that joins the
+    user's contractor profile into the token lookup, so request.identity
+    does not need a query of its own.
+    """
+    def authenticate_credentials(self, key):
+        try:
+            token = Token.objects.select_related('user', 'user__contractor').get(key=key)
+        except Token.DoesNotExist:
+            raise AuthenticationFailed('Invalid token.')
+        if not token.user.is_active:
+            raise AuthenticationFailed('User inactive or deleted.')
+        return (token.user, token)
+
+
+class MetricsScraper:
+    """request.auth of a request authenticated with settings.METRICS_TOKEN"""
+
+
+class MetricsTokenAuthentication(BaseAuthentication):
+    """
+    Lets a Prometheus server read /api/_metrics with
+    ``Authorization: Bearer <METRICS_TOKEN>`` instead of a user's token.
+    Other credentials are left to the next authentication class.
+    """
+    def authenticate(self, request):
+        expected = getattr(settings, 'METRICS_TOKEN', None)
+        header = get_authorization_header(request).split()
+        if not expected or len(header) != 2 or header[0].lower() != b'bearer':
+            return None
+        if not hmac.compare_digest(header[1], expected.encode()):
+            return None
+        return (AnonymousUser(), MetricsScraper())
+
+    def authenticate_header(self, request):
+        return 'Bearer realm="api"'
@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.http import parse_etags, urlencode
+from rest_framework.renderers import JSONRenderer
+
+
+def _showcase_timeout():
+    return getattr(settings, 'SHOWCASE_CACHE_TIMEOUT', 300)
+
+
+def get_cache_version(namespace):
+    key = f'properties:{namespace}:version'
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so an evicted version never reuses old entries
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_cache_version(namespace):
+    key = f'properties:{namespace}:version'
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), None)
+        version = await cache.aget(key)
+    return version
+
+
+def bump_cache_version(namespace):
+    """Make every entry cached under ``namespace`` unreachable"""
+    key = f'properties:{namespace}:version'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), None)
+
+
+def invalidate_showcase():
+    bump_cache_version('showcase')
+
+
+def invalidate_facets():
+    bump_cache_version('facets')
+
+
+def _request_digest(request, scope=''):
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    return hashlib.sha1(f'{scope}:{request.path}?{query}'.encode('utf-8')).hexdigest()
+
+
+def showcase_cache_key(request):
+    return f"properties:showcase:{get_cache_version('showcase')}:{_request_digest(request)}"
+
+
+def cached_facets(request, scope, build):
+    """
+    Return facet counts for ``scope`` (who is asking) and the request's
+    filters from the cache, computing them with ``build()`` on a miss.
+    """
+    key = f"properties:facets:{get_cache_version('facets')}:{_request_digest(request, scope)}"
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, getattr(settings, 'FACETS_CACHE_TIMEOUT', 60))
+    return data
+
+
+def cached_showcase_response(request, build):
+    """
+    Serve a public showcase response from the cache, rebuilding it with
+    ``build()`` (which returns serializable data) when missing or due for
+    refresh. Entries are refreshed early by a single worker holding a lock
+    while the others keep serving the previous copy.
+    """
+    key = showcase_cache_key(request)
+    entry = cache.get(key)
+    if entry is None or entry['refresh_at'] <= time.time():
+        entry = _rebuild_entry(key, build, stale=entry)
+    return _showcase_response(request, entry)
+
+
+async def acached_showcase_response(request, build):
+    """cached_showcase_response for async views, ``build`` being a coroutine function"""
+    key = f"properties:showcase:{await aget_cache_version('showcase')}:{_request_digest(request)}"
+    entry = await cache.aget(key)
+    if entry is None or entry['refresh_at'] <= time.time():
+        entry = await _arebuild_entry(key, build, stale=entry)
+    return _showcase_response(request, entry)
+
+
+def _showcase_response(request, entry):
+    if entry['etag'] in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(entry['content'], content_type='application/json')
+    response['ETag'] = entry['etag']
+    response['Cache-Control'] = 'public, no-cache'
+    return response
+
+
+def _rebuild_entry(key, build, stale=None):
+    lock_key = f'{key}:lock'
+    lock_timeout = getattr(settings, 'SHOWCASE_CACHE_LOCK_TIMEOUT', 30)
+
+    if not cache.add(lock_key, 1, lock_timeout):
+        # Another worker is rebuilding: serve the stale copy or wait for it
+        if stale is not None:
+            return stale
+        deadline = time.monotonic() + getattr(settings, 'SHOWCASE_CACHE_LOCK_WAIT', 2)
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry
+        return _build_entry(build)
+
+    try:
+        entry = _build_entry(build)
+        # Keep entries around past their refresh time so they can be served stale
+        cache.set(key, entry, _showcase_timeout() * 2)
+        return entry
+    finally:
+        cache.delete(lock_key)
+
+
+async def _arebuild_entry(key, build, stale=None):
+    lock_key = f'{key}:lock'
+    lock_timeout = getattr(settings, 'SHOWCASE_CACHE_LOCK_TIMEOUT', 30)
+
+    if not await cache.aadd(lock_key, 1, lock_timeout):
+        if stale is not None:
+            return stale
+        deadline = time.monotonic() + getattr(settings, 'SHOWCASE_CACHE_LOCK_WAIT', 2)
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            entry = await cache.aget(key)
+            if entry is not None:
+                return entry
+        return _make_entry(await build())
+
+    try:
+        entry = _make_entry(await build())
+        await cache.aset(key, entry, _showcase_timeout() * 2)
+        return entry
+    finally:
+        await cache.adelete(lock_key)
+
+
+def _build_entry(build):
+    return _make_entry(build())
+
+
+def _make_entry(data):
+    content = JSONRenderer().render(data)
+    return {
+        'content': content,
+        'etag': '"%s"' % hashlib.sha256(content).hexdigest(),
+        'refresh_at': time.time() + _showcase_timeout(),
+    }
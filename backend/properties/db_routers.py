@@ -0,0 +1,77 @@
+"""
+Primary/replica routing.
+
+Writes always go to the primary ('default'). Reads go to the replica alias
+(settings.DATABASE_REPLICA_ALIAS) only inside ``replica_reads()`` blocks,
+which ReplicaReadMixin opens around read-only viewset actions, and only
+until the first write in the block: from then on the request sticks to the
+primary so it reads its own writes.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+_replica_state = ContextVar('replica_state', default=None)
+
+
+def replica_alias():
+    alias = getattr(settings, 'DATABASE_REPLICA_ALIAS', 'replica')
+    return alias if alias in settings.DATABASES else None
+
+
+@contextmanager
+def replica_reads():
+    """Send reads in this block to the replica, until something writes"""
+    token = _replica_state.set({'use_replica': replica_alias() is not None})
+    try:
+        yield
+    finally:
+        _replica_state.reset(token)
+
+
+def stick_to_primary():
+    state = _replica_state.get()
+    if state is not None:
+        state['use_replica'] = False
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _replica_state.get()
+        if (
+            state is not None
+            and state['use_replica']
+            # Reads inside a transaction must see its writes
+            and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return replica_alias()
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        stick_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, replica_alias()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is a copy of the primary, never migrated on its own
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaReadMixin:
+    """Serve the read-only actions in ``replica_actions`` from the read replica"""
+    replica_actions = ('list', 'retrieve')
+
+    def dispatch(self, request, *args, **kwargs):
+        action = self.action_map.get(request.method.lower()) if request.method in SAFE_METHODS else None
+        if action not in self.replica_actions:
+            return super().dispatch(request, *args, **kwargs)
+        with replica_reads():
+            return super().dispatch(request, *args, **kwargs)
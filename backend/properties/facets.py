@@ -0,0 +1,54 @@
+from django.db.models import CharField, Count, F, Value
+
+from .models import Property, PropertyWorkArea
+
+# Facet name -> Property field
+PROPERTY_FACETS = {
+    'city': 'city',
+    'district': 'district',
+    'property_type': 'property_type',
+    'condition': 'condition',
+    'status': 'status',
+}
+
+
+def facet_counts(queryset):
+    """
+    Count properties per value of every facet in ``queryset``.
+
+    All facets are computed with a single UNION ALL of grouped aggregates so
+    a filter sidebar costs one database round trip.
+    """
+    queryset = queryset.order_by()
+    grouped = [
+        queryset.values(
+            facet=Value(name, output_field=CharField()),
+            value=F(field)
+        ).annotate(count=Count('id'))
+        for name, field in PROPERTY_FACETS.items()
+    ]
+    grouped.append(
+        PropertyWorkArea.objects.filter(property__in=queryset.values('id')).values(
+            facet=Value('work_areas', output_field=CharField()),
+            value=F('area')
+        ).annotate(count=Count('id'))
+    )
+    rows = grouped[0].union(*grouped[1:], all=True)
+
+    labels = {
+        'property_type': dict(Property.PROPERTY_TYPES),
+        'condition': dict(Property.CONDITION_CHOICES),
+        'status': dict(Property.STATUS_CHOICES),
+        'work_areas': dict(Property.WORK_AREA_CHOICES),
+    }
+    facets = {name: [] for name in list(PROPERTY_FACETS) + ['work_areas']}
+    for row in rows:
+        if row['value'] in (None, ''):
+            continue
+        entry = {'value': row['value'], 'count': row['count']}
+        if row['facet'] in labels:
+            entry['label'] = labels[row['facet']].get(row['value'], row['value'])
+        facets[row['facet']].append(entry)
+    for entries in facets.values():
+        entries.sort(key=lambda entry: (-entry['count'], str(entry['value'])))
+    return facets
@@ -0,0 +1,119 @@
+import math
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from django.db.models import Count
+
+from .geo import bands_between, bounding_box, distance_expression
+from .models import Property, PropertyWorkArea
+from .search import search_queryset
+
+
+class WorkAreaFilterBackend(BaseFilterBackend):
+    """
+    ?work_areas=plumbing,roof  properties needing any of the listed areas
+    ?work_areas_match=all      ... or all of them
+    """
+    work_areas_param = 'work_areas'
+    match_param = 'work_areas_match'
+
+    def filter_queryset(self, request, queryset, view):
+        value = request.query_params.get(self.work_areas_param, '')
+        areas = sorted(set(area.strip() for area in value.split(',') if area.strip()))
+        if not areas:
+            return queryset
+
+        invalid = [area for area in areas if area not in dict(Property.WORK_AREA_CHOICES)]
+        if invalid:
+            raise ValidationError({self.work_areas_param: f"Invalid work areas: {', '.join(invalid)}"})
+        match = request.query_params.get(self.match_param, 'any')
+        if match not in ('any', 'all'):
+            raise ValidationError({self.match_param: "Must be 'any' or 'all'"})
+
+        entries = PropertyWorkArea.objects.filter(area__in=areas)
+        if match == 'all':
+            entries = entries.values('property_id').annotate(
+                matched=Count('area')
+            ).filter(matched=len(areas))
+        return queryset.filter(id__in=entries.values('property_id'))
+
+
+class SearchFilterBackend(BaseFilterBackend):
+    """
+    ?q=  full-text search over title, description, address, district and
+         work details, best matches first (exposes a `search_rank` annotation)
+    """
+    search_param = 'q'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        return search_queryset(queryset, query)
+
+
+class GeoFilterBackend(BaseFilterBackend):
+    """
+    Location filters for properties.
+
+    ?near=lat,lng&radius_km=10  properties within radius_km of a point,
+                                nearest first (exposes a `distance` annotation)
+    ?bbox=min_lng,min_lat,max_lng,max_lat  properties inside a bounding box
+    """
+    default_radius_km = 10
+    max_radius_km = 1000
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+
+        if 'bbox' in params:
+            min_lng, min_lat, max_lng, max_lat = self.parse_floats(params['bbox'], 4, 'bbox')
+            self.check_coordinates(min_lat, min_lng, 'bbox')
+            self.check_coordinates(max_lat, max_lng, 'bbox')
+            if min_lat > max_lat or min_lng > max_lng:
+                raise ValidationError({'bbox': 'Expected min_lng,min_lat,max_lng,max_lat'})
+            queryset = self.within_box(queryset, min_lat, min_lng, max_lat, max_lng)
+
+        if 'near' in params:
+            lat, lng = self.parse_floats(params['near'], 2, 'near')
+            self.check_coordinates(lat, lng, 'near')
+            radius_km = self.parse_radius(params.get('radius_km'))
+            queryset = self.within_box(queryset, *bounding_box(lat, lng, radius_km))
+            queryset = queryset.annotate(
+                distance=distance_expression(lat, lng)
+            ).filter(distance__lte=radius_km).order_by('distance', 'id')
+
+        return queryset
+
+    def within_box(self, queryset, min_lat, min_lng, max_lat, max_lng):
+        return queryset.filter(
+            latitude_band__in=bands_between(min_lat, max_lat),
+            longitude__range=(min_lng, max_lng),
+            latitude__range=(min_lat, max_lat),
+        )
+
+    def parse_floats(self, value, count, param):
+        try:
+            numbers = [float(part) for part in value.split(',')]
+        except ValueError:
+            numbers = []
+        # float() accepts 'nan' and 'inf'
+        if len(numbers) != count or not all(math.isfinite(number) for number in numbers):
+            raise ValidationError({param: f'Expected {count} comma separated numbers'})
+        return numbers
+
+    def check_coordinates(self, lat, lng, param):
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            raise ValidationError({param: 'Coordinates out of range'})
+
+    def parse_radius(self, value):
+        if value is None:
+            return self.default_radius_km
+        try:
+            radius_km = float(value)
+        except ValueError:
+            raise ValidationError({'radius_km': 'A number is required'})
+        if not 0 < radius_km <= self.max_radius_km:
+            raise ValidationError({'radius_km': f'Must be between 0 and {self.max_radius_km}'})
+        return radius_km
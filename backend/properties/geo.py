@@ -0,0 +1,50 @@
+import math
+
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import ASin, Cast, Cos, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0
+
+# Properties are bucketed into latitude bands of this many degrees (~11 km).
+# The (latitude_band, longitude) index turns a bounding box query into one
+# index range seek per band instead of a table scan.
+LATITUDE_BAND_SIZE = 0.1
+
+
+def latitude_band(latitude):
+    return math.floor(float(latitude) / LATITUDE_BAND_SIZE)
+
+
+def bands_between(min_lat, max_lat):
+    return list(range(latitude_band(min_lat), latitude_band(max_lat) + 1))
+
+
+def bounding_box(lat, lng, radius_km):
+    """Return (min_lat, min_lng, max_lat, max_lng) enclosing the circle"""
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    cos_lat = math.cos(math.radians(lat))
+    if cos_lat < 1e-6:
+        dlng = 180.0
+    else:
+        dlng = min(180.0, math.degrees(radius_km / (EARTH_RADIUS_KM * cos_lat)))
+    return (
+        max(-90.0, lat - dlat),
+        max(-180.0, lng - dlng),
+        min(90.0, lat + dlat),
+        min(180.0, lng + dlng),
+    )
+
+
+def distance_expression(lat, lng):
+    """Haversine great-circle distance in km from (lat, lng) to each row"""
+    row_lat = Radians(Cast(F('latitude'), FloatField()))
+    row_lng = Radians(Cast(F('longitude'), FloatField()))
+    origin_lat = math.radians(lat)
+    origin_lng = math.radians(lng)
+
+    a = (
+        Power(Sin((row_lat - Value(origin_lat)) / 2), 2)
+        + Value(math.cos(origin_lat)) * Cos(row_lat)
+        * Power(Sin((row_lng - Value(origin_lng)) / 2), 2)
+    )
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Sqrt(a))
@@ -0,0 +1,90 @@
+from functools import cached_property
+from typing import Optional
+
+from .models import Contractor, CustomUser
+
+
+class Identity:
+    """
+    Who is making a request: the user, their role and contractor profile.
+    IdentityMiddleware attaches one to every request as ``request.identity``
+    so views and permissions never look the contractor profile up twice.
+
+    The contractor profile comes, in order of preference, from the signed
+    token claims, from the row joined in by token authentication, or from a
+    single query on first use.
+    """
+
+    def __init__(self, user: Optional[CustomUser] = None, auth=None):
+        self.user = user if user is not None and user.is_authenticated else None
+        self.auth = auth
+
+    def __repr__(self):
+        return f'<Identity user={self.user.pk if self.user else None} role={self.role}>'
+
+    @property
+    def is_authenticated(self) -> bool:
+        return self.user is not None
+
+    @property
+    def role(self) -> Optional[str]:
+        return self.user.role if self.user is not None else None
+
+    @property
+    def is_admin(self) -> bool:
+        return self.role == 'admin'
+
+    @property
+    def is_contractor(self) -> bool:
+        return self.role == 'contractor'
+
+    @property
+    def is_homeowner(self) -> bool:
+        return self.role == 'user'
+
+    def _claimed_contractor_id(self):
+        # Signed access tokens carry the profile id, see authentication.issue_tokens
+        if hasattr(self.auth, 'payload') and 'contractor_id' in self.auth.payload:
+            return self.auth.payload['contractor_id'], True
+        return None, False
+
+    @cached_property
+    def contractor_id(self) -> Optional[int]:
+        if not self.is_contractor:
+            return None
+        contractor_id, claimed = self._claimed_contractor_id()
+        if claimed:
+            return contractor_id
+        return self.contractor.pk if self.contractor is not None else None
+
+    @cached_property
+    def contractor(self) -> Optional[Contractor]:
+        if not self.is_contractor:
+            return None
+        if CustomUser.contractor.is_cached(self.user):
+            return getattr(self.user, 'contractor', None)
+
+        contractor_id, claimed = self._claimed_contractor_id()
+        if claimed:
+            if contractor_id is None:
+                return None
+            # The token user only has its claims loaded, so load the full
+            # user row in the same query for serializers that read it
+            return Contractor.objects.select_related('user').filter(pk=contractor_id).first()
+
+        contractor = Contractor.objects.filter(user=self.user).first()
+        if contractor is not None:
+            contractor.user = self.user
+        return contractor
+
+    def get_contractor(self) -> Contractor:
+        """The caller's contractor profile, raising Contractor.DoesNotExist if there is none"""
+        if self.contractor is None:
+            raise Contractor.DoesNotExist('Contractor profile not found')
+        return self.contractor
+
+    def get_contractor_id(self) -> int:
+        """Like get_contractor, without loading the profile when the token carries its id"""
+        if self.contractor_id is None:
+            raise Contractor.DoesNotExist('Contractor profile not found')
+        return self.contractor_id
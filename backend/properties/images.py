@@ -0,0 +1,123 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def variant_widths():
+    return getattr(settings, 'IMAGE_VARIANT_WIDTHS', (320, 640, 1280))
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMAGE_VARIANT_WORKERS', 2),
+                thread_name_prefix='image-variants'
+            )
+        return _executor
+
+
+def schedule_image_variants(images):
+    """
+    Queue variant generation for freshly uploaded PropertyImage or
+    CompletionImage rows. Jobs start once the current transaction commits
+    so the worker always sees the rows.
+    """
+    jobs = [(type(image), image.pk) for image in images]
+    if not jobs:
+        return
+
+    def submit():
+        for model, pk in jobs:
+            if getattr(settings, 'IMAGE_VARIANTS_ASYNC', True):
+                get_executor().submit(_run_job, model, pk)
+            else:
+                generate_variants(model, pk)
+
+    transaction.on_commit(submit)
+
+
+def _run_job(model, pk):
+    close_old_connections()
+    try:
+        generate_variants(model, pk)
+    except Exception:
+        logger.exception('Generating image variants failed for %s %s', model.__name__, pk)
+    finally:
+        close_old_connections()
+
+
+def generate_variants(model, pk):
+    """
+    Write resized WebP and JPEG copies of an image, without EXIF data, and
+    record their storage names on the row.
+    """
+    from .caching import invalidate_showcase
+
+    image_obj = model.objects.filter(pk=pk).only('id', 'image').first()
+    if image_obj is None or not image_obj.image:
+        return
+
+    with image_obj.image.open('rb') as source:
+        original = Image.open(source)
+        original.load()
+    # Apply the EXIF orientation before the metadata is dropped
+    original = ImageOps.exif_transpose(original)
+    if original.mode not in ('RGB', 'L'):
+        original = original.convert('RGB')
+
+    base, _ = os.path.splitext(image_obj.image.name)
+    widths = [width for width in variant_widths() if width < original.width] or [original.width]
+
+    variants = {name: {} for name in VARIANT_FORMATS}
+    for width in widths:
+        height = max(1, round(original.height * width / original.width))
+        resized = original.resize((width, height), Image.LANCZOS) if width != original.width else original
+        for name, (pil_format, options) in VARIANT_FORMATS.items():
+            buffer = io.BytesIO()
+            # No exif= argument, so no metadata is written to the variant
+            resized.save(buffer, pil_format, **options)
+            path = f'variants/{base}-{width}w.{name}'
+            if default_storage.exists(path):
+                default_storage.delete(path)
+            variants[name][str(width)] = default_storage.save(path, ContentFile(buffer.getvalue()))
+
+    model.objects.filter(pk=pk).update(variants=variants)
+    invalidate_showcase()
+
+
+def build_srcset(image_obj, request=None):
+    """
+    Map of format -> {width: url} for the generated variants, or the
+    original image under 'original' until they are ready.
+    """
+    def absolute(url):
+        return request.build_absolute_uri(url) if request is not None else url
+
+    if not image_obj.image:
+        return None
+    if not image_obj.variants:
+        return {'original': absolute(image_obj.image.url)}
+    return {
+        name: {width: absolute(default_storage.url(path)) for width, path in widths.items()}
+        for name, widths in image_obj.variants.items()
+    }
@@ -0,0 +1,133 @@
+"""
+Closed-loop HTTP load driver for the benchmark commands.
+
+Each of ``concurrency`` threads keeps one connection open and sends the
+next request as soon as the previous response is read, so throughput and
+latency are measured together, the way a pool of busy clients sees them.
+"""
+import http.client
+import math
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of already sorted ``values``"""
+    if not values:
+        return None
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def latency_summary(latencies):
+    """p50/p95/p99/max of latencies in seconds, reported in milliseconds"""
+    latencies = sorted(latencies)
+    summary = {}
+    for name, fraction in (('p50_ms', 0.50), ('p95_ms', 0.95), ('p99_ms', 0.99), ('max_ms', 1.0)):
+        value = percentile(latencies, fraction)
+        summary[name] = round(value * 1000, 2) if value is not None else None
+    return summary
+
+
+def wait_for_server(base_url, path='/', timeout=30.0):
+    """Poll ``path`` until the server answers, raising TimeoutError otherwise"""
+    url = urlsplit(base_url)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            connection = http.client.HTTPConnection(url.hostname, url.port, timeout=2)
+            try:
+                connection.request('GET', path)
+                connection.getresponse().read()
+                return
+            finally:
+                connection.close()
+        except OSError:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'{base_url} did not start within {timeout} seconds')
+            time.sleep(0.2)
+
+
+def summarize(requests, errors, latencies, duration):
+    return {
+        'requests': requests,
+        'errors': errors,
+        'requests_per_second': round(requests / duration, 1),
+        **latency_summary(latencies),
+    }
+
+
+def run_load(base_url, choose, concurrency=16, duration=10.0, warmup=1.0, seed=0):
+    """
+    Send the requests picked by ``choose(rng)``, which returns
+    ``(endpoint, method, path, headers)``, for ``warmup`` + ``duration``
+    seconds. Each thread has its own ``random.Random`` derived from
+    ``seed``, so a run replays the same sequence of requests.
+
+    Only requests finishing after the warmup are counted. Responses with a
+    4xx/5xx status count as errors and are left out of the latencies.
+    Returns the overall figures and the same figures per endpoint.
+    """
+    url = urlsplit(base_url)
+    start_at = time.monotonic() + warmup
+    stop_at = start_at + duration
+    lock = threading.Lock()
+    # endpoint -> [requests, errors, latencies]
+    stats = {}
+
+    def worker(offset):
+        rng = random.Random(f'{seed}:{offset}')
+        local_stats = {}
+        connection = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+        while True:
+            endpoint, method, path, headers = choose(rng)
+            started = time.monotonic()
+            if started >= stop_at:
+                break
+            try:
+                connection.request(method, path, body=b'' if method != 'GET' else None, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                failed = response.status >= 400
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+                failed = True
+            finished = time.monotonic()
+            if finished < start_at:
+                continue
+            entry = local_stats.setdefault(endpoint, [0, 0, []])
+            entry[0] += 1
+            if failed:
+                entry[1] += 1
+            else:
+                entry[2].append(finished - started)
+        connection.close()
+        with lock:
+            for endpoint, (requests, errors, latencies) in local_stats.items():
+                entry = stats.setdefault(endpoint, [0, 0, []])
+                entry[0] += requests
+                entry[1] += errors
+                entry[2].extend(latencies)
+
+    threads = [threading.Thread(target=worker, args=(offset,)) for offset in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return {
+        'concurrency': concurrency,
+        'duration': duration,
+        'overall': summarize(
+            sum(entry[0] for entry in stats.values()),
+            sum(entry[1] for entry in stats.values()),
+            [latency for entry in stats.values() for latency in entry[2]],
+            duration,
+        ),
+        'endpoints': {
+            endpoint: summarize(requests, errors, latencies, duration)
+            for endpoint, (requests, errors, latencies) in sorted(stats.items())
+        },
+    }
@@ -0,0 +1,242 @@
+"""
+Structured, non-blocking application logs.
+
+JsonFormatter writes each record as one JSON line: the time, level, logger,
+message, the id of the request it was logged from, and any ``extra``
+fields. Strings are cut to LOG_MAX_FIELD_CHARS and lists to
+MAX_LIST_ITEMS, so logging a request payload can not produce a huge line.
+
+BackgroundHandler hands records to a queue and returns; a QueueListener
+thread formats them and does the I/O with the handlers named in its
+``handlers`` option (see settings.LOGGING). When the queue is full, records
+are dropped rather than blocking the request.
+
+WorkerFileHandler is a RotatingFileHandler with a file of its own in each
+process, named after its pid: rotating a file shared by several workers
+would have them rename it under each other and lose records. As recycled
+workers leave their files behind, only the ``max_files`` newest files in
+the directory are kept.
+
+The request id comes from the X-Request-ID header, or is made up, and is
+sent back in the response; see RequestIdMiddleware.
+"""
+import atexit
+import copy
+import datetime
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import uuid
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from django.conf import settings
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+MAX_LIST_ITEMS = 100
+
+_request_id = ContextVar('request_id', default=None)
+_start_lock = threading.Lock()
+# Attributes of every LogRecord, the others were passed in ``extra``
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+def start_request(header_value):
+    """
+    Use the caller's request id when it looks like one, or make one up.
+    Returns the id and a token for finish_request.
+    """
+    request_id = header_value if header_value and REQUEST_ID_RE.match(header_value) else uuid.uuid4().hex
+    return request_id, _request_id.set(request_id)
+
+
+def finish_request(token):
+    _request_id.reset(token)
+
+
+def max_field_chars():
+    return getattr(settings, 'LOG_MAX_FIELD_CHARS', 8192)
+
+
+def capped(value, limit):
+    if isinstance(value, str):
+        return value if len(value) <= limit else f'{value[:limit]}... ({len(value) - limit} more)'
+    if isinstance(value, dict):
+        return {str(key): capped(item, limit) for key, item in list(value.items())[:MAX_LIST_ITEMS]}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [capped(item, limit) for item in list(value)[:MAX_LIST_ITEMS]]
+        if len(value) > MAX_LIST_ITEMS:
+            items.append(f'... ({len(value) - MAX_LIST_ITEMS} more)')
+        return items
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return capped(str(value), limit)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', None) or current_request_id(),
+            'message': record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in RECORD_ATTRIBUTES and name not in entry:
+                entry[name] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(capped(entry, max_field_chars()))
+
+
+def handler_by_name(name):
+    # logging.getHandlerByName is new in Python 3.12
+    get_handler = getattr(logging, 'getHandlerByName', None)
+    handler = get_handler(name) if get_handler else logging._handlers.get(name)
+    if handler is None:
+        raise ValueError(f'No logging handler named {name!r}')
+    return handler
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Queue records for a listener thread that passes them to the handlers
+    named in ``handlers``. The thread is started on the first record of each
+    process, so workers forked after logging was configured get their own.
+    """
+
+    def __init__(self, handlers, queue_size=10000):
+        super().__init__(queue.Queue(queue_size))
+        self.handler_names = handlers
+        self.listener = None
+        self.pid = None
+        self.dropped = 0
+
+    def start(self):
+        with _start_lock:
+            if self.pid == os.getpid():
+                return
+            # A queue inherited through fork may hold another process's records
+            self.queue = queue.Queue(self.queue.maxsize)
+            handlers = [handler_by_name(name) for name in self.handler_names]
+            self.listener = QueueListener(self.queue, *handlers, respect_handler_level=True)
+            self.listener.start()
+            self.pid = os.getpid()
+            atexit.register(self.stop)
+
+    def stop(self):
+        if self.listener is not None and self.pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+            self.pid = None
+
+    def emit(self, record):
+        if self.pid != os.getpid():
+            self.start()
+        super().emit(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        """
+        Render what depends on the request thread: the message, which may
+        refer to mutable objects, the traceback and the request id.
+        """
+        record = copy.copy(record)
+        record.msg = capped(record.getMessage(), max_field_chars())
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if getattr(record, 'request_id', None) is None:
+            record.request_id = current_request_id()
+        return record
+
+    def close(self):
+        self.stop()
+        super().close()
+
+
+def worker_log_path(directory, pid=None):
+    return os.path.join(directory, f'worker-{os.getpid() if pid is None else pid}.log')
+
+
+class WorkerFileHandler(RotatingFileHandler):
+    """
+    Write to worker-<pid>.log in ``directory`` and rotate it there. Only
+    this process writes to or rotates its file; a process forked after
+    logging was configured switches to a file of its own on its first
+    record. When it opens or rotates its file, the oldest files of other
+    workers beyond ``max_files`` are deleted.
+    """
+
+    def __init__(self, directory, max_bytes=0, backup_count=0, max_files=None):
+        self.directory = str(directory)
+        self.max_files = max_files
+        self.pid = os.getpid()
+        super().__init__(worker_log_path(self.directory), maxBytes=max_bytes, backupCount=backup_count, delay=True)
+
+    def emit(self, record):
+        if self.pid != os.getpid():
+            self.acquire()
+            try:
+                if self.pid != os.getpid():
+                    # The inherited stream is the parent's file, leave it to the parent
+                    self.stream = None
+                    self.baseFilename = os.path.abspath(worker_log_path(self.directory))
+                    self.pid = os.getpid()
+            finally:
+                self.release()
+        opening = self.stream is None
+        if opening:
+            os.makedirs(self.directory, exist_ok=True)
+        super().emit(record)
+        if opening:
+            self.prune()
+
+    def doRollover(self):
+        super().doRollover()
+        # Opened now rather than on the next write, so it is counted
+        if self.stream is None:
+            self.stream = self._open()
+        self.prune()
+
+    def prune(self):
+        if self.max_files is None:
+            return
+        own_files = os.path.basename(self.baseFilename)
+        paths = []
+        for name in os.listdir(self.directory):
+            if not name.startswith('worker-') or '.log' not in name:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                modified = os.stat(path).st_mtime
+            except FileNotFoundError:
+                # Another worker pruned it first
+                continue
+            # This process's files count towards the cap but are kept
+            paths.append((name.startswith(own_files), modified, path))
+        paths.sort(reverse=True)
+        for own, _, path in paths[self.max_files:]:
+            if own:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
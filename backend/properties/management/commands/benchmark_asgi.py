@@ -0,0 +1,164 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from properties.authentication import issue_tokens
+from properties.loadtest import run_load, wait_for_server
+from properties.models import CompletionImage, Contractor, CustomUser, PriceOffer, Property, PropertyImage
+
+from .benchmark_sqlite import copy_database, use_database
+
+# (name, path, who is asking) for the endpoints served by properties.async_views
+ENDPOINTS = (
+    ('completed_list', '/api/properties/completed-list/?page_size=20', None),
+    ('property_detail', '/api/properties/{property_id}/', None),
+    ('available_properties', '/api/properties/?status=approved&page_size=20', 'contractor'),
+    ('price_offers', '/api/price-offers/?page_size=20', 'homeowner'),
+)
+
+
+def server_command(server, port, workers, threads):
+    if server == 'wsgi':
+        return [
+            sys.executable, '-m', 'gunicorn', 'backend.wsgi:application',
+            '--bind', f'127.0.0.1:{port}', '--workers', str(workers), '--threads', str(threads),
+            '--log-level', 'warning',
+        ]
+    return [
+        sys.executable, '-m', 'uvicorn', 'backend.asgi:application',
+        '--host', '127.0.0.1', '--port', str(port), '--workers', str(workers),
+        '--log-level', 'warning', '--no-access-log',
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Compare requests/sec and latency of the async read endpoints under uvicorn (ASGI) and gunicorn (WSGI)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Server worker processes')
+        parser.add_argument('--threads', type=int, default=4, help='Threads per gunicorn worker')
+        parser.add_argument('--concurrency', type=int, default=32, help='Concurrent client connections')
+        parser.add_argument('--duration', type=float, default=5, help='Seconds to load each endpoint')
+        parser.add_argument('--properties', type=int, default=40, help='Properties to seed the copy with')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        source = connections['default']
+        if source.vendor != 'sqlite':
+            raise CommandError('The default database is not SQLite')
+        original = dict(connections.settings['default'])
+
+        results = []
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            name = os.path.join(tmp_dir, 'benchmark.sqlite3')
+            copy_database(source, name)
+            try:
+                use_database(dict(original, NAME=name))
+                call_command('migrate', verbosity=0, interactive=False)
+                targets = self.seed(options['properties'])
+            finally:
+                use_database(original)
+
+            for server in ('wsgi', 'asgi'):
+                results.extend(self.run_server(server, name, targets, options))
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(
+            f"{'server':<8}{'endpoint':<22}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}"
+        )
+        for result in results:
+            self.stdout.write(
+                f"{result['server']:<8}{result['endpoint']:<22}{result['requests_per_second']:>9.1f}"
+                f"{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}{result['errors']:>8}"
+            )
+
+    def run_server(self, server, name, targets, options):
+        # The servers' files go next to the database, removed with it
+        env = dict(
+            os.environ, DJANGO_SETTINGS_MODULE='backend.settings', SQLITE_PATH=name,
+            METRICS_DIR=os.path.join(os.path.dirname(name), 'metrics'),
+            SLOW_QUERY_LOG_DIR=os.path.join(os.path.dirname(name), 'slow_queries'),
+        )
+        env.pop('SQLITE_REPLICA', None)
+        base_url = f"http://127.0.0.1:{options['port']}"
+        process = subprocess.Popen(
+            server_command(server, options['port'], options['workers'], options['threads']),
+            cwd=settings.BASE_DIR, env=env
+        )
+        try:
+            wait_for_server(base_url, '/api/properties/completed-list/')
+            results = []
+            for endpoint, path, headers in targets:
+                result = run_load(
+                    base_url,
+                    lambda rng, request=(endpoint, 'GET', path, headers): request,
+                    concurrency=options['concurrency'],
+                    duration=options['duration'],
+                )
+                results.append({
+                    'server': server, 'endpoint': endpoint, 'workers': options['workers'], **result['overall']
+                })
+            return results
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    def seed(self, count):
+        """Give the copy properties, offers and users to request them as, and return the targets"""
+        owner, created = CustomUser.objects.get_or_create(
+            username='benchmark-owner',
+            defaults={'email': 'benchmark-owner@example.com', 'role': 'user'}
+        )
+        contractor_user, created = CustomUser.objects.get_or_create(
+            username='benchmark-contractor',
+            defaults={'email': 'benchmark-contractor@example.com', 'role': 'contractor'}
+        )
+        contractor, created = Contractor.objects.get_or_create(
+            user=contractor_user,
+            defaults={'specialization': 'General', 'experience_years': 1, 'license_number': 'BENCH'}
+        )
+
+        existing = Property.objects.filter(homeowner=owner).count()
+        for index in range(existing, count):
+            status = 'completed' if index % 2 else 'approved'
+            property_obj = Property.objects.create(
+                homeowner=owner,
+                title=f'Benchmark property {index}',
+                description='Benchmark',
+                address='King Fahd Road',
+                city='Riyadh',
+                latitude=Decimal('24.713600'),
+                longitude=Decimal('46.675300'),
+                plot_number='1',
+                property_type='house',
+                size=Decimal('250.00'),
+                condition='FAIR',
+                status=status,
+                assigned_contractor=contractor if status == 'completed' else None,
+            )
+            PropertyImage.objects.create(property=property_obj, image='properties/benchmark.jpg', is_thumbnail=True)
+            PriceOffer.objects.create(property=property_obj, contractor=contractor, amount=Decimal('1000'))
+            if status == 'completed':
+                CompletionImage.objects.create(property=property_obj, image='completion_images/benchmark.jpg')
+
+        property_id = Property.objects.filter(homeowner=owner, status='approved').values_list('id', flat=True).first()
+        headers = {
+            'contractor': {'Authorization': f"Token {issue_tokens(contractor_user)['token']}"},
+            'homeowner': {'Authorization': f"Token {issue_tokens(owner)['token']}"},
+            None: {},
+        }
+        return [
+            (endpoint, path.format(property_id=property_id), headers[who])
+            for endpoint, path, who in ENDPOINTS
+        ]
@@ -0,0 +1,179 @@
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+
+from properties.models import Contractor, CustomUser, PriceOffer, Property
+from properties.serializers import PropertySerializer
+from properties.transactions import is_lock_error, write_transaction
+
+
+def profile_settings(profile, name):
+    if profile == 'basic':
+        return {'ENGINE': 'django.db.backends.sqlite3', 'NAME': name}
+    return {
+        'ENGINE': 'properties.sqlite3',
+        'NAME': name,
+        'OPTIONS': {
+            'init_command': '; '.join(f'PRAGMA {key}={value}' for key, value in settings.SQLITE_PRAGMAS.items()),
+            'timeout': 20,
+        },
+        'CONN_MAX_AGE': None,
+    }
+
+
+def use_database(db_settings):
+    """Point the default alias at another database for this process"""
+    connections.close_all()
+    connections.settings['default'] = connections.configure_settings({'default': db_settings})['default']
+    del connections['default']
+
+
+def copy_database(source, name, journal_mode='WAL'):
+    # The online backup API gives a consistent copy while the site runs
+    source.ensure_connection()
+    destination = sqlite3.connect(name)
+    try:
+        source.connection.backup(destination)
+        destination.execute(f'PRAGMA journal_mode={journal_mode}')
+    finally:
+        destination.close()
+
+
+def read_properties():
+    list(PropertySerializer.setup_eager_loading(Property.objects.all()).order_by('-id')[:20])
+
+
+def write_offer(property_id, contractor_id):
+    property_obj = Property.objects.get(pk=property_id)
+    PriceOffer.objects.create(property=property_obj, contractor_id=contractor_id, amount=Decimal('1000'))
+    property_obj.status = 'price_proposed' if property_obj.status == 'approved' else 'approved'
+    property_obj.save(update_fields=['status'])
+
+
+def run_worker(args):
+    profile, db_settings, property_ids, contractor_id, duration, write_ratio, seed = args
+    use_database(db_settings)
+    rng = random.Random(seed)
+    write = write_transaction(write_offer) if profile == 'production' else transaction.atomic()(write_offer)
+    counts = {'reads': 0, 'writes': 0, 'lock_errors': 0}
+
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        try:
+            if rng.random() < write_ratio:
+                write(rng.choice(property_ids), contractor_id)
+                counts['writes'] += 1
+            else:
+                read_properties()
+                counts['reads'] += 1
+        except OperationalError as e:
+            if not is_lock_error(e):
+                raise
+            counts['lock_errors'] += 1
+        finally:
+            if profile == 'basic':
+                # CONN_MAX_AGE = 0: a new connection for every request
+                connections['default'].close()
+    connections.close_all()
+    return counts
+
+
+class Command(BaseCommand):
+    help = 'Compare mixed read/write throughput of the basic and production SQLite profiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent worker processes')
+        parser.add_argument('--duration', type=float, default=5, help='Seconds to run each profile')
+        parser.add_argument('--write-ratio', type=float, default=0.2, help='Share of operations that write')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        source = connections['default']
+        if source.vendor != 'sqlite':
+            raise CommandError('The default database is not SQLite')
+        original = dict(connections.settings['default'])
+
+        results = []
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                for profile in ('basic', 'production'):
+                    name = os.path.join(tmp_dir, f'{profile}.sqlite3')
+                    copy_database(source, name, journal_mode='DELETE' if profile == 'basic' else 'WAL')
+                    results.append(self.run_profile(profile, profile_settings(profile, name), options))
+        finally:
+            use_database(original)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'profile':<12}{'reads/s':>10}{'writes/s':>10}{'ops/s':>10}{'lock errors':>13}")
+        for result in results:
+            self.stdout.write(
+                f"{result['profile']:<12}{result['reads_per_second']:>10.1f}{result['writes_per_second']:>10.1f}"
+                f"{result['ops_per_second']:>10.1f}{result['lock_errors']:>13}"
+            )
+
+    def run_profile(self, profile, db_settings, options):
+        use_database(db_settings)
+        property_ids, contractor_id = self.seed()
+        connections.close_all()
+
+        jobs = [
+            (profile, db_settings, property_ids, contractor_id, options['duration'], options['write_ratio'], seed)
+            for seed in range(options['workers'])
+        ]
+        with multiprocessing.get_context('fork').Pool(options['workers']) as pool:
+            counts = pool.map(run_worker, jobs)
+
+        reads = sum(count['reads'] for count in counts)
+        writes = sum(count['writes'] for count in counts)
+        return {
+            'profile': profile,
+            'workers': options['workers'],
+            'duration': options['duration'],
+            'reads_per_second': reads / options['duration'],
+            'writes_per_second': writes / options['duration'],
+            'ops_per_second': (reads + writes) / options['duration'],
+            'lock_errors': sum(count['lock_errors'] for count in counts),
+        }
+
+    def seed(self):
+        """Make sure the copy has properties and a contractor to write offers for"""
+        user, created = CustomUser.objects.get_or_create(
+            username='benchmark-contractor',
+            defaults={'email': 'benchmark-contractor@example.com', 'role': 'contractor'}
+        )
+        contractor, created = Contractor.objects.get_or_create(
+            user=user,
+            defaults={'specialization': 'General', 'experience_years': 1, 'license_number': 'BENCH'}
+        )
+        owner, created = CustomUser.objects.get_or_create(
+            username='benchmark-owner',
+            defaults={'email': 'benchmark-owner@example.com', 'role': 'user'}
+        )
+        property_ids = list(Property.objects.filter(homeowner=owner).values_list('id', flat=True))
+        for index in range(10 - len(property_ids)):
+            property_ids.append(Property.objects.create(
+                homeowner=owner,
+                title=f'Benchmark property {index}',
+                description='Benchmark',
+                address='King Fahd Road',
+                city='Riyadh',
+                latitude=Decimal('24.713600'),
+                longitude=Decimal('46.675300'),
+                plot_number='1',
+                property_type='house',
+                size=Decimal('250.00'),
+                condition='FAIR',
+                status='approved',
+            ).pk)
+        return property_ids, contractor.pk
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from properties.models import UploadSession
+from properties.uploads import discard_session
+
+
+class Command(BaseCommand):
+    help = 'Delete upload sessions that have not been used for UPLOAD_SESSION_EXPIRY_HOURS'
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=settings.UPLOAD_SESSION_EXPIRY_HOURS)
+        count = 0
+        for session in UploadSession.objects.filter(updated_at__lt=cutoff).iterator():
+            discard_session(session)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Deleted {count} expired upload sessions'))
@@ -0,0 +1,275 @@
+import io
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from properties.models import (
+    CompletionImage, Contractor, CustomUser, EvaluationRequest, PriceOffer, Property, PropertyImage
+)
+from properties.storage import image_storage
+
+# Every generated user's username starts with this, see --clear
+USERNAME_PREFIX = 'load-'
+
+# The cities of frontend/src/data/saudiCities.js: (name, latitude, longitude,
+# weight), the weight roughly following population
+SAUDI_CITIES = (
+    ('الرياض', 24.7136, 46.6753, 30),
+    ('جدة', 21.4858, 39.1925, 20),
+    ('مكة المكرمة', 21.3891, 39.8579, 10),
+    ('المدينة المنورة', 24.5247, 39.5692, 8),
+    ('الدمام', 26.4207, 50.0888, 8),
+    ('الخبر', 26.2172, 50.1971, 4),
+    ('تبوك', 28.3835, 36.5662, 3),
+    ('خميس مشيط', 18.3000, 42.7333, 3),
+    ('بريدة', 26.3260, 43.9750, 3),
+    ('الجبيل', 27.0046, 49.6460, 2),
+    ('الطائف', 21.2703, 40.4158, 4),
+    ('حائل', 27.5114, 41.7208, 2),
+    ('نجران', 17.4933, 44.1277, 2),
+    ('جازان', 16.8892, 42.5511, 2),
+    ('ينبع', 24.0895, 38.0618, 2),
+    ('أبها', 18.2164, 42.5053, 2),
+    ('الخرج', 24.1556, 47.3120, 2),
+    ('القطيف', 26.5196, 50.0115, 2),
+    ('الأحساء', 25.3647, 49.5856, 3),
+    ('صبيا', 17.1495, 42.6254, 1),
+    ('الباحة', 20.0129, 41.4677, 1),
+    ('سكاكا', 29.9697, 40.2064, 1),
+    ('عرعر', 30.9753, 41.0381, 1),
+    ('الرس', 25.8694, 43.4973, 1),
+    ('عنيزة', 26.0843, 43.9935, 1),
+    ('القريات', 31.3318, 37.3428, 1),
+    ('الظهران', 26.2361, 50.0393, 1),
+    ('حفر الباطن', 28.4328, 45.9708, 1),
+    ('الجوف', 29.8117, 39.8689, 1),
+    ('بيشة', 20.0005, 42.6052, 1),
+    ('الزلفي', 26.2994, 44.8155, 1),
+    ('الدوادمي', 24.5077, 44.3924, 1),
+    ('المجمعة', 25.9039, 45.3456, 1),
+)
+
+# Degrees a property may lie from its city centre (~9 km)
+CITY_SPREAD = 0.08
+
+STATUS_WEIGHTS = (
+    ('pending', 15),
+    ('approved', 35),
+    ('price_proposed', 15),
+    ('in_progress', 10),
+    ('completed', 20),
+    ('rejected', 5),
+)
+
+DISTRICTS = ('النرجس', 'الملقا', 'العليا', 'الروضة', 'الشاطئ', 'الصفا', 'الفيصلية', 'النزهة', 'السلامة', 'الربوة')
+STREETS = ('طريق الملك فهد', 'شارع الأمير سلطان', 'طريق الملك عبدالعزيز', 'شارع التحلية', 'طريق الدائري')
+PROPERTY_TYPE_LABELS = {'house': 'فيلا', 'apartment': 'شقة'}
+WORK_DETAILS = (
+    'تسريب في المواسير ويحتاج إلى تغيير',
+    'تشققات في الجدران وإعادة دهان',
+    'تغيير البلاط وتجديد الأرضيات',
+    'صيانة شاملة للتمديدات الكهربائية',
+    'عزل السطح ضد الحرارة والمياه',
+    'تجديد المطبخ بالكامل مع الخزائن',
+)
+SPECIALIZATIONS = ('سباكة', 'كهرباء', 'ترميم عام', 'دهانات', 'عزل وأسطح', 'تشطيبات')
+FIRST_NAMES = ('محمد', 'عبدالله', 'فهد', 'سارة', 'نورة', 'خالد', 'ريم', 'سلطان', 'هيا', 'فيصل')
+LAST_NAMES = ('العتيبي', 'القحطاني', 'الشمري', 'الدوسري', 'الحربي', 'الزهراني', 'الغامدي', 'المطيري')
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic Saudi property dataset with bulk inserts, for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--homeowners', type=int, default=500)
+        parser.add_argument('--contractors', type=int, default=100)
+        parser.add_argument('--admins', type=int, default=5)
+        parser.add_argument('--properties', type=int, default=5000)
+        parser.add_argument('--images', type=int, default=3, help='Images per property')
+        parser.add_argument('--offers', type=int, default=3, help='Most price offers per property')
+        parser.add_argument('--evaluations', type=float, default=0.3,
+                            help='Share of assigned properties with an evaluation request')
+        parser.add_argument('--password', default='load-test-password', help='Password of every generated user')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed, the same seed gives the same data')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--clear', action='store_true', help='Delete previously generated data first')
+
+    def handle(self, *args, **options):
+        if options['homeowners'] < 1 or options['contractors'] < 1:
+            raise CommandError('At least one homeowner and one contractor are needed')
+        if CustomUser.objects.filter(username__startswith=USERNAME_PREFIX).exists():
+            if not options['clear']:
+                raise CommandError('Generated data already exists, pass --clear to replace it')
+            self.clear()
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        password = make_password(options['password'])
+
+        with transaction.atomic():
+            self.create_users('admin', options['admins'], password)
+            homeowners = self.create_users('user', options['homeowners'], password)
+            contractors = self.create_contractors(options['contractors'], password)
+            properties = self.create_properties(options['properties'], homeowners, contractors)
+            images = self.create_images(properties, options['images'])
+            offers = self.create_offers(properties, contractors, options['offers'])
+            evaluations = self.create_evaluations(properties, options['evaluations'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {options['admins']} admins, {len(homeowners)} homeowners, {len(contractors)} contractors, "
+            f"{len(properties)} properties, {images} images, {offers} price offers "
+            f"and {evaluations} evaluation requests"
+        ))
+
+    def clear(self):
+        # Deleting the users cascades to their properties, offers and images
+        users = CustomUser.objects.filter(username__startswith=USERNAME_PREFIX)
+        count = users.count()
+        users.delete()
+        self.stdout.write(f'Deleted {count} generated users and their data')
+
+    def full_name(self):
+        return self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+
+    def create_users(self, role, count, password):
+        users = []
+        for index in range(count):
+            first_name, last_name = self.full_name()
+            username = f'{USERNAME_PREFIX}{role}-{index}'
+            users.append(CustomUser(
+                username=username,
+                email=f'{username}@example.com',
+                password=password,
+                first_name=first_name,
+                last_name=last_name,
+                role=role,
+                phone=f'05{self.rng.randrange(10 ** 8):08d}',
+            ))
+        return CustomUser.objects.bulk_create(users, batch_size=self.batch_size)
+
+    def create_contractors(self, count, password):
+        users = self.create_users('contractor', count, password)
+        return Contractor.objects.bulk_create([
+            Contractor(
+                user=user,
+                specialization=self.rng.choice(SPECIALIZATIONS),
+                experience_years=self.rng.randint(1, 30),
+                license_number=f'LIC-{user.pk:06d}',
+            )
+            for user in users
+        ], batch_size=self.batch_size)
+
+    def create_properties(self, count, homeowners, contractors):
+        cities = [city[:3] for city in SAUDI_CITIES]
+        city_weights = [city[3] for city in SAUDI_CITIES]
+        statuses = [status for status, weight in STATUS_WEIGHTS]
+        status_weights = [weight for status, weight in STATUS_WEIGHTS]
+        work_areas = [area for area, label in Property.WORK_AREA_CHOICES]
+        now = timezone.now()
+
+        properties = []
+        for index in range(count):
+            city, latitude, longitude = self.rng.choices(cities, city_weights)[0]
+            status = self.rng.choices(statuses, status_weights)[0]
+            property_type = self.rng.choice(('house', 'apartment'))
+            district = self.rng.choice(DISTRICTS)
+            areas = self.rng.sample(work_areas, self.rng.randint(1, 3))
+            assigned = status in ('price_proposed', 'in_progress', 'completed')
+            properties.append(Property(
+                homeowner=self.rng.choice(homeowners),
+                title=f'{PROPERTY_TYPE_LABELS[property_type]} في حي {district} - {city}',
+                description=f'{PROPERTY_TYPE_LABELS[property_type]} بحاجة إلى صيانة في {city}، حي {district}',
+                address=f'{self.rng.choice(STREETS)}، حي {district}',
+                city=city,
+                district=district,
+                latitude=self.coordinate(latitude),
+                longitude=self.coordinate(longitude),
+                plot_number=str(self.rng.randint(1, 9999)),
+                property_type=property_type,
+                size=Decimal(self.rng.randint(80, 900)),
+                number_of_rooms=self.rng.randint(1, 8),
+                number_of_floors=self.rng.randint(1, 3) if property_type == 'house' else 1,
+                condition=self.rng.choice([key for key, label in Property.CONDITION_CHOICES]),
+                status=status,
+                assigned_contractor=self.rng.choice(contractors) if assigned else None,
+                rating=round(self.rng.uniform(1, 5), 1) if status == 'completed' else None,
+                completion_note='تم إنجاز العمل' if status == 'completed' else None,
+                completion_date=now - timedelta(days=self.rng.randint(0, 365)) if status == 'completed' else None,
+                work_areas=areas,
+                work_details=self.rng.choice(WORK_DETAILS),
+            ))
+        # Property.objects.bulk_create also fills the work area and search indexes
+        return Property.objects.bulk_create(properties, batch_size=self.batch_size)
+
+    def coordinate(self, centre):
+        return Decimal(f'{centre + self.rng.uniform(-CITY_SPREAD, CITY_SPREAD):.6f}')
+
+    def placeholder_images(self, count=4):
+        """A few small JPEGs in image storage, shared by every generated image row"""
+        names = []
+        for index in range(count):
+            buffer = io.BytesIO()
+            colour = tuple(self.rng.randrange(256) for channel in range(3))
+            Image.new('RGB', (640, 480), colour).save(buffer, 'JPEG')
+            names.append(image_storage.save(f'load-{index}.jpg', ContentFile(buffer.getvalue())))
+        return names
+
+    def create_images(self, properties, per_property):
+        names = self.placeholder_images()
+        images = [
+            PropertyImage(property=property_obj, image=self.rng.choice(names), is_thumbnail=(order == 0), order=order)
+            for property_obj in properties
+            for order in range(per_property)
+        ]
+        completion_images = [
+            CompletionImage(property=property_obj, image=self.rng.choice(names), description='بعد الصيانة')
+            for property_obj in properties
+            if property_obj.status == 'completed'
+        ]
+        PropertyImage.objects.bulk_create(images, batch_size=self.batch_size)
+        CompletionImage.objects.bulk_create(completion_images, batch_size=self.batch_size)
+        return len(images) + len(completion_images)
+
+    def create_offers(self, properties, contractors, most):
+        """
+        Offers consistent with each property's status: the assigned
+        contractor's offer is pending or accepted, competing ones rejected.
+        """
+        offers = []
+        for property_obj in properties:
+            if property_obj.assigned_contractor is None or most < 1:
+                continue
+            winning_status = 'pending' if property_obj.status == 'price_proposed' else 'accepted'
+            offers.append(self.offer(property_obj, property_obj.assigned_contractor, winning_status))
+            for contractor in self.rng.sample(contractors, min(len(contractors), self.rng.randint(0, most - 1))):
+                if contractor != property_obj.assigned_contractor:
+                    offers.append(self.offer(property_obj, contractor, 'rejected'))
+        return len(PriceOffer.objects.bulk_create(offers, batch_size=self.batch_size))
+
+    def offer(self, property_obj, contractor, status):
+        return PriceOffer(
+            property=property_obj,
+            contractor=contractor,
+            amount=Decimal(self.rng.randrange(5000, 250000, 500)),
+            description='يشمل العرض المواد والعمالة',
+            status=status,
+        )
+
+    def create_evaluations(self, properties, share):
+        evaluations = [
+            EvaluationRequest(
+                property=property_obj,
+                contractor=property_obj.assigned_contractor,
+                completed=property_obj.status in ('in_progress', 'completed'),
+            )
+            for property_obj in properties
+            if property_obj.assigned_contractor is not None and self.rng.random() < share
+        ]
+        return len(EvaluationRequest.objects.bulk_create(evaluations, batch_size=self.batch_size))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from properties.images import generate_variants
+from properties.models import CompletionImage, PropertyImage
+
+
+class Command(BaseCommand):
+    help = 'Generate resized variants for property and completion images'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Regenerate variants for every image, not only the ones missing them'
+        )
+
+    def handle(self, *args, **options):
+        for model in (PropertyImage, CompletionImage):
+            images = model.objects.order_by('id')
+            if not options['all']:
+                images = images.filter(variants={})
+            count = 0
+            for pk in images.values_list('id', flat=True).iterator():
+                try:
+                    generate_variants(model, pk)
+                    count += 1
+                except (OSError, ValueError) as e:
+                    self.stderr.write(f'{model.__name__} {pk}: {e}')
+            self.stdout.write(self.style.SUCCESS(f'Processed {count} {model._meta.verbose_name_plural}'))
@@ -0,0 +1,163 @@
+import json
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from properties.authentication import issue_tokens
+from properties.loadtest import run_load
+from properties.models import CustomUser, PriceOffer, Property
+
+# The calls the frontend pages make: (endpoint, role, method, path, weight).
+# The weights approximate how often each page is used.
+REQUEST_MIX = (
+    ('completed_list', None, 'GET', '/api/properties/completed-list/', 20),           # Home
+    ('property_detail', None, 'GET', '/api/properties/{property_id}/', 15),           # PropertyDetails
+    ('available_properties', 'contractor', 'GET', '/api/properties/?status=approved', 15),  # ContractorAvailableProperties
+    ('contractor_properties', 'contractor', 'GET', '/api/properties/', 5),            # ContractorProperties
+    ('contractor_offers', 'contractor', 'GET', '/api/price-offers/', 5),              # ContractorOffers
+    ('my_properties', 'user', 'GET', '/api/properties/', 10),                         # MyProperties
+    ('homeowner_offers', 'user', 'GET', '/api/price-offers/', 10),                    # HomeownerPendingOffers
+    # Each call gets a pending offer of its own, see OfferPool
+    ('offer_accept', 'user', 'POST', '/api/price-offers/{offer_id}/accept/', 3),
+    ('offer_reject', 'user', 'POST', '/api/price-offers/{offer_id}/reject/', 3),
+    ('admin_requests', 'admin', 'GET', '/api/properties/admin_requests/', 5),         # AdminRequests
+)
+
+
+class OfferPool:
+    """
+    The pending offers of properties awaiting their owner's answer, shared
+    by the load threads. Accepting or rejecting an offer settles its
+    property, so each property is handed out once: replaying the call on
+    a settled one would only measure an error response.
+    """
+
+    def __init__(self, offers):
+        # property id -> [(offer id, owner's headers)]
+        self.offers = offers
+        self.available = len(offers)
+        self.lock = threading.Lock()
+
+    def take(self, rng):
+        """An (offer id, headers) pair, or None once every property is used"""
+        with self.lock:
+            if not self.offers:
+                return None
+            property_id = rng.choice(list(self.offers))
+            return rng.choice(self.offers.pop(property_id))
+
+    @property
+    def used(self):
+        with self.lock:
+            return self.available - len(self.offers)
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay the mix of API calls the frontend makes against a running server and report '
+        'throughput and p50/p95/p99 latency per endpoint as JSON. Use generate_dataset first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--concurrency', type=int, default=16, help='Concurrent client connections')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to measure for')
+        parser.add_argument('--warmup', type=float, default=3, help='Seconds of unmeasured load first')
+        parser.add_argument('--users', type=int, default=50, help='Users per role to spread the load over')
+        parser.add_argument('--page-size', type=int,
+                            help='Paginate list calls; by default they are sent as the frontend sends them')
+        parser.add_argument('--seed', type=int, default=1, help='Seed for the sequence of requests')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        sessions, offers = self.build_sessions(options['users'])
+        property_ids = list(Property.objects.order_by('id').values_list('id', flat=True)[:1000])
+        if not property_ids:
+            raise CommandError('There are no properties, run generate_dataset first')
+
+        mix = []
+        for entry in REQUEST_MIX:
+            endpoint, role, method, template = entry[:4]
+            if role is not None and not sessions[role]:
+                self.stderr.write(f'Skipping {endpoint}: no {role} users')
+                continue
+            if '{offer_id}' in template and not offers.available:
+                self.stderr.write(f'Skipping {endpoint}: no pending offers')
+                continue
+            mix.append(entry)
+        weights = [entry[4] for entry in mix]
+        # Drawn from instead once the pending offers are used up
+        others = [entry for entry in mix if '{offer_id}' not in entry[3]]
+        other_weights = [entry[4] for entry in others]
+
+        def choose(rng):
+            endpoint, role, method, template, weight = rng.choices(mix, weights)[0]
+            offer_id = None
+            if '{offer_id}' in template:
+                offer = offers.take(rng)
+                if offer is None:
+                    endpoint, role, method, template, weight = rng.choices(others, other_weights)[0]
+                else:
+                    offer_id, headers = offer
+            if offer_id is None:
+                headers = rng.choice(sessions[role]) if role else {}
+            path = template.format(property_id=rng.choice(property_ids), offer_id=offer_id)
+            if method == 'GET' and '{' not in template and options['page_size']:
+                # A list endpoint
+                path += f"{'&' if '?' in path else '?'}page_size={options['page_size']}"
+            return endpoint, method, path, headers
+
+        result = run_load(
+            options['base_url'],
+            choose,
+            concurrency=options['concurrency'],
+            duration=options['duration'],
+            warmup=options['warmup'],
+            seed=options['seed'],
+        )
+        report = {
+            'started_at': timezone.now().isoformat(),
+            'base_url': options['base_url'],
+            'seed': options['seed'],
+            'page_size': options['page_size'],
+            'mix': {endpoint: {'method': method, 'path': path, 'weight': weight}
+                    for endpoint, role, method, path, weight in mix},
+            # Once every property with pending offers is used, the offer calls stop
+            'pending_offers': {'properties': offers.available, 'used': offers.used},
+            **result,
+        }
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    def build_sessions(self, count):
+        """
+        Authorization headers for up to ``count`` users of each role, and an
+        OfferPool of the pending offers on those homeowners' properties.
+        """
+        sessions = {'user': [], 'contractor': [], 'admin': []}
+        homeowners = list(CustomUser.objects.filter(
+            role='user', properties__isnull=False
+        ).distinct().order_by('id')[:count])
+        users = homeowners + [
+            user
+            for role in ('contractor', 'admin')
+            for user in CustomUser.objects.filter(role=role).order_by('id')[:count]
+        ]
+        headers = {}
+        for user in users:
+            headers[user.pk] = {'Authorization': f"Token {issue_tokens(user)['token']}"}
+            sessions[user.role].append(headers[user.pk])
+
+        offers = {}
+        for offer_id, property_id, homeowner_id in PriceOffer.objects.filter(
+            status='pending', property__status='price_proposed', property__homeowner__in=homeowners
+        ).order_by('id').values_list('id', 'property_id', 'property__homeowner_id'):
+            offers.setdefault(property_id, []).append((offer_id, headers[homeowner_id]))
+        return sessions, OfferPool(offers)
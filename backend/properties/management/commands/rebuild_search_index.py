@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from properties import search
+from properties.models import Property
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for properties'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not search.search_enabled():
+            raise CommandError('Full-text search index requires SQLite')
+        search.create_index()
+        total = search.rebuild_index(Property.objects.order_by('id'), batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} properties'))
@@ -0,0 +1,44 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from properties.db_routers import replica_alias
+
+
+class Command(BaseCommand):
+    help = 'Copy the primary SQLite database over the local read replica with the online backup API'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float,
+            help='Keep refreshing the replica every INTERVAL seconds'
+        )
+
+    def handle(self, *args, **options):
+        alias = replica_alias()
+        if alias is None:
+            raise CommandError('No replica database is configured, see DATABASE_REPLICA_ALIAS')
+        source = connections[DEFAULT_DB_ALIAS]
+        if source.vendor != 'sqlite' or connections[alias].vendor != 'sqlite':
+            raise CommandError('refresh_replica only copies SQLite databases')
+
+        while True:
+            started = time.monotonic()
+            self.copy(source, str(connections[alias].settings_dict['NAME']))
+            self.stdout.write(f'Replica refreshed in {time.monotonic() - started:.2f}s')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def copy(self, source, name):
+        # Copied in place: replica connections kept open see the new pages,
+        # and readers get either the old or the new copy, never a mix
+        source.ensure_connection()
+        destination = sqlite3.connect(name)
+        try:
+            source.connection.backup(destination)
+        finally:
+            destination.close()
+        source.close()
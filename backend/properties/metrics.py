@@ -0,0 +1,361 @@
+"""
+Per-route request metrics, shared by every worker process.
+
+MetricsMiddleware records, for each resolved route name and method, a
+latency histogram, the number and time of database queries, the response
+bytes and the count of each status code. Each process adds its figures to
+its own memory-mapped file in METRICS_DIR, so recording a request takes no
+lock shared with other processes; the /api/_metrics view sums the files of
+every worker, including ones that have exited, and renders them in the
+Prometheus text format.
+
+Each file is an array of 64-bit words: a header, then up to
+METRICS_MAX_SERIES slots of one series (route and method) each. Only the
+owning process writes to a file. The files of exited workers are added
+into one, exited.metrics, when the metrics are collected, so the
+directory does not grow as workers are recycled. Whether a worker has
+exited is told by its pid, so METRICS_DIR must not be shared between
+hosts or containers. Empty it when deploying, as prometheus_client's
+multiprocess mode requires of its directory.
+"""
+import fcntl
+import glob
+import math
+import mmap
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf)
+METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+# Series beyond METRICS_MAX_SERIES are added up under this route
+OVERFLOW_ROUTE = '<other>'
+OVERFLOW_KEY = f' {OVERFLOW_ROUTE}'.encode()
+UNMATCHED_ROUTE = '<unmatched>'
+
+MAGIC = 0x4253_4d45_5452_4331  # "BSMETRC1"
+HEADER_WORDS = 4  # magic, slots in use, two spare
+KEY_BYTES = 128
+# Slot layout, in words
+KEY_WORDS = KEY_BYTES // 8
+BUCKETS_AT = KEY_WORDS
+LATENCY_SUM_AT = BUCKETS_AT + len(LATENCY_BUCKETS)
+QUERIES_AT = LATENCY_SUM_AT + 1
+QUERY_SECONDS_AT = QUERIES_AT + 1
+RESPONSE_BYTES_AT = QUERY_SECONDS_AT + 1
+STATUS_AT = RESPONSE_BYTES_AT + 1
+STATUS_CODES = range(100, 600)
+SLOT_WORDS = STATUS_AT + len(STATUS_CODES)
+
+_request_stats = ContextVar('request_stats', default=None)
+
+
+def metrics_enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+class RequestStats:
+    """Database work done while handling one request"""
+    __slots__ = ('queries', 'query_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+def observe_query(execute, sql, params, many, context):
+    """Connection execute wrapper adding each query to the current request's stats"""
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_seconds += time.perf_counter() - started
+
+
+def install_query_observer(sender, connection, **kwargs):
+    """connection_created receiver, see PropertiesConfig.ready"""
+    if observe_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, observe_query)
+
+
+def start_request():
+    """Start counting queries for the current request, returns a token for finish_request"""
+    stats = RequestStats()
+    return stats, _request_stats.set(stats)
+
+
+def finish_request(token):
+    stats, context_token = token
+    _request_stats.reset(context_token)
+    return stats
+
+
+def series_key(route, method):
+    method = method if method in METHODS else 'OTHER'
+    return f'{method} {route}'.encode('utf-8')[:KEY_BYTES - 1]
+
+
+class MetricsFile:
+    """The memory-mapped metrics file of the current process"""
+
+    def __init__(self, path, max_series):
+        self.path = path
+        self.max_series = max_series
+        self.lock = threading.Lock()
+        size = (HEADER_WORDS + max_series * SLOT_WORDS) * 8
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.ints = memoryview(self.map).cast('q')
+        self.floats = memoryview(self.map).cast('d')
+        if self.ints[0] != MAGIC:
+            self.ints[0] = MAGIC
+            self.ints[1] = 0
+        # A file left by an earlier process with the same pid is added to
+        self.slots = {key: index for index, key in enumerate(iter_keys(self.map, self.ints[1]))}
+
+    def slot(self, key):
+        index = self.slots.get(key)
+        if index is None:
+            # Keep room for an overflow series per method
+            reserved = len(METHODS) + 1
+            if len(self.slots) >= self.max_series - reserved and not key.endswith(OVERFLOW_KEY):
+                return self.slot(series_key(OVERFLOW_ROUTE, key.split(b' ', 1)[0].decode()))
+            index = len(self.slots)
+            start = (HEADER_WORDS + index * SLOT_WORDS) * 8
+            self.map[start:start + KEY_BYTES] = key.ljust(KEY_BYTES, b'\0')
+            self.slots[key] = index
+            # Published last, readers only look at slots below this count
+            self.ints[1] = len(self.slots)
+        return HEADER_WORDS + index * SLOT_WORDS
+
+    def record(self, route, method, status, seconds, queries, query_seconds, response_bytes):
+        ints, floats = self.ints, self.floats
+        with self.lock:
+            base = self.slot(series_key(route, method))
+            for offset, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    ints[base + BUCKETS_AT + offset] += 1
+                    break
+            floats[base + LATENCY_SUM_AT] += seconds
+            ints[base + QUERIES_AT] += queries
+            floats[base + QUERY_SECONDS_AT] += query_seconds
+            ints[base + RESPONSE_BYTES_AT] += response_bytes
+            if status in STATUS_CODES:
+                ints[base + STATUS_AT + status - STATUS_CODES.start] += 1
+
+
+def iter_keys(buffer, count):
+    for index in range(count):
+        start = (HEADER_WORDS + index * SLOT_WORDS) * 8
+        yield bytes(buffer[start:start + KEY_BYTES]).rstrip(b'\0')
+
+
+_file = None
+_file_lock = threading.Lock()
+
+
+def metrics_dir():
+    return str(getattr(settings, 'METRICS_DIR', os.path.join(settings.BASE_DIR, 'metrics')))
+
+
+def get_metrics_file():
+    """This process's MetricsFile, opened again after a fork"""
+    global _file
+    path = os.path.join(metrics_dir(), f'worker-{os.getpid()}.metrics')
+    if _file is None or _file.path != path:
+        with _file_lock:
+            if _file is None or _file.path != path:
+                _file = MetricsFile(path, getattr(settings, 'METRICS_MAX_SERIES', 512))
+    return _file
+
+
+def record_request(route, method, status, seconds, stats, response_bytes):
+    get_metrics_file().record(
+        route, method, status, seconds, stats.queries, stats.query_seconds, response_bytes
+    )
+
+
+def new_series():
+    return {
+        'buckets': [0] * len(LATENCY_BUCKETS), 'latency_sum': 0.0, 'queries': 0,
+        'query_seconds': 0.0, 'response_bytes': 0, 'status': {},
+    }
+
+
+def read_file(path, series):
+    """Add the series of one metrics file to ``series``"""
+    try:
+        with open(path, 'rb') as metrics_file:
+            data = metrics_file.read()
+    except FileNotFoundError:
+        # Merged into exited.metrics since the directory was listed
+        return
+    if len(data) < HEADER_WORDS * 8:
+        return
+    ints = memoryview(data).cast('q')
+    floats = memoryview(data).cast('d')
+    if ints[0] != MAGIC:
+        return
+    count = min(ints[1], (len(ints) - HEADER_WORDS) // SLOT_WORDS)
+    for index, key in enumerate(iter_keys(data, count)):
+        base = HEADER_WORDS + index * SLOT_WORDS
+        method, route = key.decode('utf-8', 'replace').split(' ', 1)
+        entry = series.setdefault((method, route), new_series())
+        for offset in range(len(LATENCY_BUCKETS)):
+            entry['buckets'][offset] += ints[base + BUCKETS_AT + offset]
+        entry['latency_sum'] += floats[base + LATENCY_SUM_AT]
+        entry['queries'] += ints[base + QUERIES_AT]
+        entry['query_seconds'] += floats[base + QUERY_SECONDS_AT]
+        entry['response_bytes'] += ints[base + RESPONSE_BYTES_AT]
+        statuses = ints[base + STATUS_AT:base + STATUS_AT + len(STATUS_CODES)]
+        for offset, value in enumerate(statuses):
+            if value:
+                code = STATUS_CODES.start + offset
+                entry['status'][code] = entry['status'].get(code, 0) + value
+
+
+def write_file(path, series):
+    """Write ``series`` to a new metrics file at ``path``, replacing it at once"""
+    data = bytearray((HEADER_WORDS + len(series) * SLOT_WORDS) * 8)
+    ints = memoryview(data).cast('q')
+    floats = memoryview(data).cast('d')
+    ints[0] = MAGIC
+    ints[1] = len(series)
+    for index, ((method, route), entry) in enumerate(sorted(series.items())):
+        base = HEADER_WORDS + index * SLOT_WORDS
+        data[base * 8:base * 8 + KEY_BYTES] = series_key(route, method).ljust(KEY_BYTES, b'\0')
+        for offset, count in enumerate(entry['buckets']):
+            ints[base + BUCKETS_AT + offset] = count
+        floats[base + LATENCY_SUM_AT] = entry['latency_sum']
+        ints[base + QUERIES_AT] = entry['queries']
+        floats[base + QUERY_SECONDS_AT] = entry['query_seconds']
+        ints[base + RESPONSE_BYTES_AT] = entry['response_bytes']
+        for code, count in entry['status'].items():
+            ints[base + STATUS_AT + code - STATUS_CODES.start] = count
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as metrics_file:
+        metrics_file.write(data)
+    os.replace(tmp_path, path)
+
+
+def worker_pid(path):
+    name = os.path.basename(path)
+    try:
+        return int(name[len('worker-'):-len('.metrics')])
+    except ValueError:
+        return None
+
+
+def has_exited(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        # Alive, under another user
+        return False
+    return False
+
+
+def merge_exited_workers(directory):
+    """
+    Add the files of workers that have exited into exited.metrics and
+    remove them. Collectors take turns on a lock file, so a file is never
+    added twice.
+    """
+    exited = [
+        path for path in glob.glob(os.path.join(directory, 'worker-*.metrics'))
+        if worker_pid(path) not in (None, os.getpid()) and has_exited(worker_pid(path))
+    ]
+    if not exited:
+        return
+    with open(os.path.join(directory, 'merge.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        exited = [path for path in exited if os.path.exists(path)]
+        if not exited:
+            return
+        archive = os.path.join(directory, 'exited.metrics')
+        series = {}
+        for path in [archive] + exited:
+            read_file(path, series)
+        write_file(archive, series)
+        for path in exited:
+            os.remove(path)
+
+
+def collect():
+    """
+    Add up the files of every worker. Returns {(method, route): series}
+    where a series has 'buckets' (not cumulative), 'latency_sum', 'queries',
+    'query_seconds', 'response_bytes' and 'status' ({code: count}).
+    """
+    directory = metrics_dir()
+    if os.path.isdir(directory):
+        merge_exited_workers(directory)
+    series = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.metrics'))):
+        read_file(path, series)
+    return series
+
+
+def _label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render_prometheus(series):
+    """The collected series in the Prometheus text exposition format"""
+    families = {
+        'http_request_duration_seconds': ('histogram', 'Time to handle a request, by route and method', []),
+        'http_requests_total': ('counter', 'Responses by route, method and status code', []),
+        'http_request_db_queries_total': ('counter', 'Database queries run by requests', []),
+        'http_request_db_seconds_total': ('counter', 'Time spent in database queries by requests', []),
+        'http_response_size_bytes_total': ('counter', 'Bytes of response bodies', []),
+    }
+    for (method, route), entry in sorted(series.items(), key=lambda item: (item[0][1], item[0][0])):
+        labels = f'route="{_label(route)}",method="{_label(method)}"'
+        histogram = families['http_request_duration_seconds'][2]
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, entry['buckets']):
+            cumulative += count
+            histogram.append(f'http_request_duration_seconds_bucket{{{labels},le="{_number(bound)}"}} {cumulative}')
+        histogram.append(f'http_request_duration_seconds_sum{{{labels}}} {_number(entry["latency_sum"])}')
+        histogram.append(f'http_request_duration_seconds_count{{{labels}}} {cumulative}')
+        for code, count in sorted(entry['status'].items()):
+            families['http_requests_total'][2].append(f'http_requests_total{{{labels},status="{code}"}} {count}')
+        families['http_request_db_queries_total'][2].append(
+            f'http_request_db_queries_total{{{labels}}} {entry["queries"]}'
+        )
+        families['http_request_db_seconds_total'][2].append(
+            f'http_request_db_seconds_total{{{labels}}} {_number(entry["query_seconds"])}'
+        )
+        families['http_response_size_bytes_total'][2].append(
+            f'http_response_size_bytes_total{{{labels}}} {entry["response_bytes"]}'
+        )
+
+    lines = []
+    for name, (kind, help_text, samples) in families.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
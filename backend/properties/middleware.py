@@ -0,0 +1,210 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.utils.functional import SimpleLazyObject
+
+from . import logs, metrics, profiling, slow_queries
+from .identity import Identity
+
+
+class IdentityMiddleware:
+    """
+    Attach ``request.identity``. It is resolved on first access, which for
+    API views is after DRF has authenticated the request (DRF copies the
+    authenticated user and token back onto the Django request).
+
+    The middleware is async-capable so that under ASGI the async views in
+    async_views.py are not pushed back onto a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.attach(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        self.attach(request)
+        return await self.get_response(request)
+
+    def attach(self, request):
+        request.identity = SimpleLazyObject(
+            lambda: Identity(getattr(request, 'user', None), getattr(request, 'auth', None))
+        )
+
+
+class RequestIdMiddleware:
+    """
+    Give every request an id, taken from its X-Request-ID header when it
+    has a usable one, which every log record of the request carries and
+    the response returns. See logs.py.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.id, token = logs.start_request(request.headers.get(logs.REQUEST_ID_HEADER))
+        try:
+            response = self.get_response(request)
+        finally:
+            logs.finish_request(token)
+        response[logs.REQUEST_ID_HEADER] = request.id
+        return response
+
+    async def __acall__(self, request):
+        request.id, token = logs.start_request(request.headers.get(logs.REQUEST_ID_HEADER))
+        try:
+            response = await self.get_response(request)
+        finally:
+            logs.finish_request(token)
+        response[logs.REQUEST_ID_HEADER] = request.id
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Record the latency, database queries, response size and status code of
+    every request under its resolved route name and method, see metrics.py.
+    Put it first in MIDDLEWARE so the time of the other middleware counts.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = metrics.metrics_enabled()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        started = time.perf_counter()
+        token = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            stats = metrics.finish_request(token)
+        self.record(request, response, time.perf_counter() - started, stats)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        started = time.perf_counter()
+        token = metrics.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            stats = metrics.finish_request(token)
+        self.record(request, response, time.perf_counter() - started, stats)
+        return response
+
+    def record(self, request, response, seconds, stats):
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            route = metrics.UNMATCHED_ROUTE
+        else:
+            # Unnamed patterns are reported by their pattern, not the path
+            route = match.view_name if match.url_name else match.route
+        # Streamed responses (media files) are left out of the byte count
+        size = 0 if response.streaming else len(response.content)
+        metrics.record_request(route, request.method, response.status_code, seconds, stats, size)
+
+
+class ProfilingMiddleware:
+    """
+    Profile the requests chosen by profiling.wants_profile: those with an
+    ``X-Profile`` header from an admin, and a PROFILING_SAMPLE_RATE share
+    of all requests. See profiling.py.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        reason = profiling.wants_profile(request)
+        if reason is None or (reason == 'header' and not profiling.is_admin_request(request)):
+            return self.get_response(request)
+
+        profile = profiling.Profile(request, reason)
+        profile.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profile.stop()
+        profile.save(response)
+        return self.tag(response, profile)
+
+    async def __acall__(self, request):
+        reason = profiling.wants_profile(request)
+        if reason is None or (
+            reason == 'header' and not await sync_to_async(profiling.is_admin_request)(request)
+        ):
+            return await self.get_response(request)
+
+        profile = profiling.Profile(request, reason)
+        profile.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profile.stop()
+        await sync_to_async(profile.save)(response)
+        return self.tag(response, profile)
+
+    def tag(self, response, profile):
+        if profile.reason == 'header':
+            response[profiling.PROFILE_ID_HEADER] = profile.id
+        return response
+
+
+class SlowQueryMiddleware:
+    """
+    Let the slow query log name the route of the request that ran a
+    statement, see slow_queries.py.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = slow_queries.start_request(request)
+        try:
+            return self.get_response(request)
+        finally:
+            slow_queries.finish_request(token)
+
+    async def __acall__(self, request):
+        token = slow_queries.start_request(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            slow_queries.finish_request(token)
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0008_property_work_areas_property_work_details'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='evaluationrequest',
+            index=models.Index(fields=['property', 'contractor'], name='evalrequest_property_contr_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='priceoffer',
+            index=models.Index(fields=['property', 'status'], name='priceoffer_property_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='priceoffer',
+            index=models.Index(fields=['contractor', '-proposed_at'], name='priceoffer_contractor_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='priceoffer',
+            index=models.Index(fields=['-proposed_at', '-id'], name='priceoffer_proposed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(fields=['status', '-completion_date'], name='property_status_completed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(fields=['homeowner', 'status'], name='property_owner_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(fields=['assigned_contractor', 'status'], name='property_contractor_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['-id'], name='property_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='propertyimage',
+            index=models.Index(condition=models.Q(('is_thumbnail', True)), fields=['property'], name='propertyimage_thumbnail_idx'),
+        ),
+    ]
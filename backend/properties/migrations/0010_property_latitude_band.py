@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:16
+
+import math
+
+from django.db import migrations, models
+
+
+def populate_latitude_band(apps, schema_editor):
+    Property = apps.get_model('properties', 'Property')
+    properties = list(Property.objects.only('id', 'latitude'))
+    for property_obj in properties:
+        property_obj.latitude_band = math.floor(float(property_obj.latitude) / 0.1)
+    Property.objects.bulk_update(properties, ['latitude_band'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0009_workflow_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='latitude_band',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(fields=['latitude_band', 'longitude'], name='property_location_idx'),
+        ),
+        migrations.RunPython(populate_latitude_band, migrations.RunPython.noop),
+    ]
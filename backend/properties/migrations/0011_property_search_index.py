@@ -0,0 +1,68 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:18
+
+import re
+
+from django.db import migrations
+
+# A frozen copy of the index definition and of properties.search's
+# normalizer as they were when this migration was written, so that later
+# changes to that module do not change what this migration does.
+FTS_TABLE = 'properties_property_fts'
+SEARCH_FIELDS = ('title', 'description', 'address', 'district', 'work_details')
+ARABIC_DIACRITICS_RE = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed]')
+TATWEEL = '\u0640'
+ARABIC_LETTER_MAP = str.maketrans({
+    'أ': 'ا',  # alef with hamza above -> alef
+    'إ': 'ا',  # alef with hamza below -> alef
+    'آ': 'ا',  # alef with madda -> alef
+    'ٱ': 'ا',  # alef wasla -> alef
+    'ى': 'ي',  # alef maqsura -> yaa
+    'ة': 'ه',  # taa marbuta -> haa
+})
+
+
+def normalize_arabic(text):
+    if not text:
+        return ''
+    text = ARABIC_DIACRITICS_RE.sub('', text)
+    text = text.replace(TATWEEL, '')
+    return text.translate(ARABIC_LETTER_MAP).lower()
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Property = apps.get_model('properties', 'Property')
+    columns = ', '.join(SEARCH_FIELDS)
+    placeholders = ', '.join(['%s'] * (len(SEARCH_FIELDS) + 1))
+    rows = (
+        [property_obj.pk] + [normalize_arabic(getattr(property_obj, name)) for name in SEARCH_FIELDS]
+        for property_obj in Property.objects.using(schema_editor.connection.alias)
+        .only('pk', *SEARCH_FIELDS).iterator(chunk_size=1000)
+    )
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+            f"USING fts5({columns}, tokenize='unicode61 remove_diacritics 2')"
+        )
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, {columns}) VALUES ({placeholders})', rows)
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0010_property_latitude_band'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
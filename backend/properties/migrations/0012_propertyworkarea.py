@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_work_areas(apps, schema_editor):
+    Property = apps.get_model('properties', 'Property')
+    PropertyWorkArea = apps.get_model('properties', 'PropertyWorkArea')
+    entries = []
+    for property_id, work_areas in Property.objects.values_list('id', 'work_areas').iterator():
+        if isinstance(work_areas, str):
+            work_areas = work_areas.split(',')
+        for area in sorted(set(area.strip() for area in work_areas or [] if area.strip())):
+            entries.append(PropertyWorkArea(property_id=property_id, area=area))
+    PropertyWorkArea.objects.bulk_create(entries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0011_property_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PropertyWorkArea',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('area', models.CharField(choices=[('kitchen', 'مطبخ'), ('bathroom', 'حمام'), ('bedroom', 'غرفة نوم'), ('living_room', 'غرفة معيشة'), ('full_house', 'المنزل بالكامل'), ('exterior', 'خارجي'), ('roof', 'سقف'), ('plumbing', 'سباكة'), ('electrical', 'كهرباء'), ('other', 'أخرى')], max_length=20)),
+                ('property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='work_area_entries', to='properties.property')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['area', 'property'], name='workarea_area_property_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='propertyworkarea',
+            constraint=models.UniqueConstraint(fields=('property', 'area'), name='unique_property_work_area'),
+        ),
+        migrations.RunPython(populate_work_areas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:23
+
+from django.db import migrations, models
+import properties.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0013_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='completionimage',
+            name='image',
+            field=models.ImageField(db_index=True, storage=properties.storage.ContentAddressedStorage(), upload_to='completion_images/'),
+        ),
+        migrations.AlterField(
+            model_name='propertyimage',
+            name='image',
+            field=models.ImageField(db_index=True, storage=properties.storage.ContentAddressedStorage(), upload_to='properties/'),
+        ),
+    ]
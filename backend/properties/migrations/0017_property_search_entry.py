@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+import properties.search
+
+# Frozen copies of properties.search.FTS_TABLE and RANK_FUNCTION
+FTS_TABLE = 'properties_property_fts'
+RANK_FUNCTION = 'bm25(10.0, 1.0, 3.0, 3.0, 1.0)'
+
+
+def configure_rank(function):
+    def configure(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rank) VALUES ('rank', %s)", [function])
+    return configure
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0016_revokedtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PropertySearchEntry',
+            fields=[
+                ('property', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='properties.property')),
+                ('document', properties.search.FullTextField(db_column='properties_property_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'properties_property_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(configure_rank(RANK_FUNCTION), configure_rank('bm25()')),
+    ]
@@ -1,7 +1,16 @@
-from django.db import models
+import os
+import uuid
+
+from django.conf import settings
+from django.db import connections, models
+from django.db.models import Q
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MaxValueValidator, MinValueValidator
 from multiselectfield import MultiSelectField
+from . import search
+from .caching import invalidate_facets, invalidate_showcase
+from .geo import latitude_band
+from .storage import ensure_blob, image_storage, uncommitted_content
 
 # Create your models here.
 
@@ -45,6 +54,31 @@ class CustomUser(AbstractUser):
             self.username = self.email
         super().save(*args, **kwargs)
 
+class PropertyQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        bulk_create() neither calls save() nor sends post_save, so derive
+        latitude_band here and bring the work area and search indexes and
+        the caches up to date the way the signal handlers would.
+        """
+        objs = list(objs)
+        for obj in objs:
+            if obj.latitude is not None:
+                obj.latitude_band = latitude_band(obj.latitude)
+        objs = super().bulk_create(objs, *args, **kwargs)
+
+        to_python = self.model._meta.get_field('work_areas').to_python
+        PropertyWorkArea.objects.using(self.db).bulk_create([
+            PropertyWorkArea(property=obj, area=area)
+            for obj in objs
+            for area in sorted(set(to_python(obj.work_areas)))
+        ], batch_size=kwargs.get('batch_size'))
+        search.index_properties(objs, connections[self.db])
+        invalidate_facets()
+        if any(obj.status == 'completed' for obj in objs):
+            invalidate_showcase()
+        return objs
+
 class Property(models.Model):
     PROPERTY_TYPES = (
         ('house', 'House'),
@@ -101,6 +135,8 @@ class Property(models.Model):
             MaxValueValidator(180)
         ]
     )
+    # Spatial bucket derived from latitude, see geo.LATITUDE_BAND_SIZE
+    latitude_band = models.IntegerField(null=True, blank=True, editable=False)
     plot_number = models.CharField(max_length=50)
     property_type = models.CharField(max_length=20, choices=PROPERTY_TYPES)
     size = models.DecimalField(max_digits=10, decimal_places=2)
@@ -145,22 +181,110 @@ class Property(models.Model):
         help_text="قدم وصفاً مفصلاً للعمل المطلوب لكل منطقة"
     )
 
+    objects = PropertyQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', '-completion_date'], name='property_status_completed_idx'),
+            models.Index(fields=['homeowner', 'status'], name='property_owner_status_idx'),
+            models.Index(fields=['assigned_contractor', 'status'], name='property_contractor_status_idx'),
+            # Admin review queue
+            models.Index(fields=['-id'], condition=Q(status='pending'), name='property_pending_idx'),
+            models.Index(fields=['latitude_band', 'longitude'], name='property_location_idx'),
+        ]
+
     def __str__(self):
         return f"{self.title} - {self.city}"
 
+    def save(self, *args, **kwargs):
+        if self.latitude is not None:
+            self.latitude_band = latitude_band(self.latitude)
+        super().save(*args, **kwargs)
+
+    def sync_work_areas(self):
+        """Bring the PropertyWorkArea rows in line with work_areas"""
+        areas = set(self._meta.get_field('work_areas').to_python(self.work_areas))
+        entries = PropertyWorkArea.objects.filter(property=self)
+        entries.exclude(area__in=areas).delete()
+        existing = set(entries.values_list('area', flat=True))
+        PropertyWorkArea.objects.bulk_create([
+            PropertyWorkArea(property=self, area=area) for area in sorted(areas - existing)
+        ])
+
     @property
     def completion_images_count(self):
+        # Annotated by PropertySerializer.setup_eager_loading on list querysets
+        if hasattr(self, 'completion_images_total'):
+            return self.completion_images_total
         return self.completion_images.count()
 
+class PropertyWorkArea(models.Model):
+    """
+    Normalized copy of Property.work_areas, one row per area, so that work
+    area filters and counts can use an index instead of substring matching.
+    Kept in sync by the Property post_save signal.
+    """
+    property = models.ForeignKey(Property, related_name='work_area_entries', on_delete=models.CASCADE)
+    area = models.CharField(max_length=20, choices=Property.WORK_AREA_CHOICES)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['property', 'area'], name='unique_property_work_area'),
+        ]
+        indexes = [
+            models.Index(fields=['area', 'property'], name='workarea_area_property_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.area} for property {self.property_id}"
+
+class PropertySearchEntry(models.Model):
+    """
+    A row of the FTS5 full-text index over a property's text, keyed by the
+    property id, so that searches join the index instead of querying it once
+    per property. The table is created and kept in sync by search.py.
+    """
+    property = models.OneToOneField(
+        Property, primary_key=True, db_column='rowid', related_name='search_entry',
+        on_delete=models.DO_NOTHING, db_constraint=False
+    )
+    document = search.FullTextField(db_column=search.FTS_TABLE)
+    # The row's search.RANK_FUNCTION score for the MATCH of its query
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = search.FTS_TABLE
+
+class ImageQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        bulk_create() sends no post_save, so check the blobs of the new rows
+        here the way the image_saved signal handler would.
+        """
+        objs = list(objs)
+        contents = [uncommitted_content(obj.image) for obj in objs]
+        objs = super().bulk_create(objs, *args, **kwargs)
+        for obj, content in zip(objs, contents):
+            ensure_blob(obj.image.name, content)
+        return objs
+
 class PropertyImage(models.Model):
     property = models.ForeignKey(Property, related_name='images', on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='properties/')
+    image = models.ImageField(upload_to='properties/', storage=image_storage, db_index=True)
     is_thumbnail = models.BooleanField(default=False)
     order = models.PositiveIntegerField(default=0)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    # Resized copies written by images.generate_variants
+    variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    objects = ImageQuerySet.as_manager()
 
     class Meta:
         ordering = ['order']
+        indexes = [
+            models.Index(fields=['property'], condition=Q(is_thumbnail=True), name='propertyimage_thumbnail_idx'),
+        ]
 
     def __str__(self):
         return f"Image for {self.property.title} ({'Thumbnail' if self.is_thumbnail else 'Gallery'})"
@@ -180,6 +304,11 @@ class EvaluationRequest(models.Model):
     assigned_date = models.DateTimeField(auto_now_add=True)
     completed = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['property', 'contractor'], name='evalrequest_property_contr_idx'),
+        ]
+
 class PriceOffer(models.Model):
     property = models.ForeignKey(Property, related_name='price_offers', on_delete=models.CASCADE)
     contractor = models.ForeignKey(Contractor, related_name='price_offers', on_delete=models.CASCADE)
@@ -198,6 +327,11 @@ class PriceOffer(models.Model):
     
     class Meta:
         ordering = ['-proposed_at']
+        indexes = [
+            models.Index(fields=['property', 'status'], name='priceoffer_property_status_idx'),
+            models.Index(fields=['contractor', '-proposed_at'], name='priceoffer_contractor_date_idx'),
+            models.Index(fields=['-proposed_at', '-id'], name='priceoffer_proposed_idx'),
+        ]
         
     def __str__(self):
         return f"Offer for {self.property.title} by {self.contractor.user.first_name}"
@@ -208,9 +342,52 @@ class CompletionImage(models.Model):
         on_delete=models.CASCADE,
         related_name='completion_images'
     )
-    image = models.ImageField(upload_to='completion_images/')
+    image = models.ImageField(upload_to='completion_images/', storage=image_storage, db_index=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     description = models.TextField(blank=True)
+    # Resized copies written by images.generate_variants
+    variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    objects = ImageQuerySet.as_manager()
 
     class Meta:
         ordering = ['uploaded_at']
+
+class UploadSession(models.Model):
+    """
+    A resumable upload: the client opens a session, sends the file in
+    chunks at increasing offsets, then commits it. Committed sessions can be
+    passed by id to the property create and mark_completed endpoints.
+    """
+    STATUS_CHOICES = (
+        ('open', 'Open'),
+        ('committed', 'Committed'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey('CustomUser', on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField(null=True, blank=True)
+    received = models.PositiveBigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='open')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Upload {self.id} ({self.filename})"
+
+    @property
+    def path(self):
+        return os.path.join(settings.UPLOAD_SESSION_ROOT, f'{self.id}.part')
+
+class RevokedToken(models.Model):
+    """
+    A signed token revoked before its expiry (on logout). Rows past
+    ``expires_at`` are useless, since the signature check rejects the token.
+    """
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+    revoked_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Revoked token {self.jti}"
@@ -0,0 +1,194 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, FieldError, ValidationError
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination over a compound sort key.
+
+    Each page is fetched with a ``WHERE (key) < (last key)`` style filter
+    instead of an OFFSET, so the cost of a page does not grow with the table.
+    The last column of the ordering must be unique (normally ``id``) to make
+    the order total. NULL keys always sort last.
+
+    Pagination is opt-in: the full list is returned unless the client sends
+    ``cursor`` or ``page_size``, which keeps the existing frontend working.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    total_query_param = 'with_total'
+    page_size = 20
+    max_page_size = 100
+    ordering = ('-id',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_queryset = self.get_page_queryset(queryset, request, view)
+        if page_queryset is None:
+            return None
+        if self.with_total:
+            self.total = queryset.count()
+        return self.set_page(list(page_queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None, evaluate=None):
+        """
+        paginate_queryset for async views. ``evaluate`` is a coroutine
+        function turning the page queryset into a list, by default by
+        collecting QuerySet.aiterator().
+        """
+        page_queryset = self.get_page_queryset(queryset, request, view)
+        if page_queryset is None:
+            return None
+        if self.with_total:
+            self.total = await queryset.acount()
+        if evaluate is None:
+            rows = [row async for row in page_queryset.aiterator()]
+        else:
+            rows = await evaluate(page_queryset)
+        return self.set_page(rows)
+
+    def get_page_queryset(self, queryset, request, view=None):
+        """The rows of the requested page plus one, or None when not paginating"""
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+
+        self.request = request
+        self.ordering = self.get_ordering(view)
+        self.page_size = self.get_page_size(request)
+        self.with_total = params.get(self.total_query_param) in ('1', 'true')
+        self.total = None
+
+        queryset = queryset.order_by(*[self._order_expression(key) for key in self.ordering])
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            cursor = self.convert_cursor(cursor, queryset)
+            queryset = queryset.filter(self._after(cursor, queryset.model))
+
+        # Fetch one extra row to know whether there is a next page
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, rows):
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        payload = OrderedDict([('next', self.get_next_link())])
+        if self.total is not None:
+            payload['total'] = self.total
+        payload['results'] = data
+        return Response(payload)
+
+    def get_ordering(self, view):
+        if view is not None and hasattr(view, 'get_cursor_ordering'):
+            return tuple(view.get_cursor_ordering())
+        return tuple(self.ordering)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        values = [getattr(last, key.lstrip('-')) for key in self.ordering]
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(values))
+
+    def encode_cursor(self, values):
+        data = json.dumps(values, default=str, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def convert_cursor(self, values, queryset):
+        """
+        Turn the decoded JSON values into the Python values of their ordering
+        fields, so a tampered cursor is rejected here instead of failing in
+        the query.
+        """
+        converted = []
+        for key, value in zip(self.ordering, values):
+            field = self._field(queryset, key.lstrip('-'))
+            if value is None or field is None:
+                converted.append(value)
+                continue
+            if isinstance(value, (dict, list)):
+                raise NotFound(self.invalid_cursor_message)
+            try:
+                converted.append(field.to_python(value))
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+        return converted
+
+    def _field(self, queryset, name):
+        try:
+            return queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # Annotations such as a computed distance
+            annotation = queryset.query.annotations.get(name)
+            try:
+                return annotation.output_field if annotation is not None else None
+            except FieldError:
+                return None
+
+    def _order_expression(self, key):
+        if key.startswith('-'):
+            return F(key[1:]).desc(nulls_last=True)
+        return F(key).asc(nulls_last=True)
+
+    def _nullable(self, model, field):
+        try:
+            return model._meta.get_field(field).null
+        except FieldDoesNotExist:
+            # Annotations such as a computed distance
+            return False
+
+    def _after(self, values, model):
+        """
+        Build the lexicographic "comes after" filter for the cursor values:
+        (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ...
+        """
+        condition = None
+        equal = Q()
+        for key, value in zip(self.ordering, values):
+            field = key.lstrip('-')
+            if value is None:
+                # NULLs sort last, so nothing comes after them within this key
+                equal &= Q(**{f'{field}__isnull': True})
+                continue
+            lookup = 'lt' if key.startswith('-') else 'gt'
+            after = Q(**{f'{field}__{lookup}': value})
+            if self._nullable(model, field):
+                after |= Q(**{f'{field}__isnull': True})
+            term = equal & after
+            condition = term if condition is None else condition | term
+            equal &= Q(**{field: value})
+        return condition if condition is not None else Q(pk__in=[])
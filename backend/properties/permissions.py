@@ -1,8 +1,24 @@
 from rest_framework.permissions import BasePermission
 
+from .authentication import MetricsScraper
+
 class IsContractor(BasePermission):
     """
     Custom permission to only allow contractors to access the view.
     """
     def has_permission(self, request, view):
-        return request.user and request.user.is_authenticated and request.user.role == 'contractor' 
\ No newline at end of file
+        return request.identity.is_contractor 
+
+class IsAdmin(BasePermission):
+    """
+    Only admins
+    """
+    def has_permission(self, request, view):
+        return request.identity.is_admin
+
+class CanReadMetrics(BasePermission):
+    """
+    Admins, or the Prometheus server authenticated by MetricsTokenAuthentication
+    """
+    def has_permission(self, request, view):
+        return isinstance(request.auth, MetricsScraper) or request.identity.is_admin
@@ -0,0 +1,252 @@
+"""
+On-demand profiling of single requests.
+
+A request is profiled when an admin sends ``X-Profile: 1``, or at random
+with probability PROFILING_SAMPLE_RATE. While it runs, a sampling thread
+records the call stack every PROFILING_INTERVAL seconds, and every SQL
+statement is recorded with its duration and the project code that ran it.
+
+Each profile is written to PROFILING_DIR as two files named after the
+profile id, which the response carries in ``X-Profile-Id``:
+
+- ``<id>.folded``: collapsed stacks, one ``frame;frame;... count`` line per
+  stack, for flamegraph.pl, speedscope or inferno.
+- ``<id>.json``: the request, its timings, the hottest functions and the
+  SQL statements.
+
+Only the PROFILING_MAX_PROFILES newest profiles are kept. When a request is
+not profiled the cost is a header lookup, a random number and a context
+variable read per query.
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+# Statements kept in the summary; the totals cover all of them
+MAX_RECORDED_QUERIES = 500
+TOP_FUNCTIONS = 30
+
+_active_profile = ContextVar('active_profile', default=None)
+_switch_lock = threading.Lock()
+_switch_users = 0
+_switch_interval = None
+
+
+def project_frames(frame, limit=5):
+    """
+    The innermost ``limit`` frames of project code (under BASE_DIR, outside
+    installed packages, other than the query observers) from ``frame``
+    outwards, as ``path:line in Class.function``.
+    """
+    base_dir = str(settings.BASE_DIR)
+    origins = []
+    while frame is not None and len(origins) < limit:
+        filename = frame.f_code.co_filename
+        # The connection execute wrappers of the query observers are skipped
+        if (filename.startswith(base_dir) and 'site-packages' not in filename
+                and frame.f_code.co_name != 'observe_query'):
+            origins.append(f'{os.path.relpath(filename, base_dir)}:{frame.f_lineno} in {frame.f_code.co_qualname}')
+        frame = frame.f_back
+    return origins
+
+
+def wants_profile(request):
+    """Cheap check run on every request; is_admin_request confirms a header request"""
+    if PROFILE_HEADER in request.headers:
+        return 'header'
+    rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+    if rate and random.random() < rate:
+        return 'sampled'
+    return None
+
+
+def is_admin_request(request):
+    """
+    Whether the request carries an admin's credentials. Runs the API
+    authentication classes without touching the request, since the view
+    has not authenticated it yet.
+    """
+    drf_request = Request(request)
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        try:
+            result = authentication_class().authenticate(drf_request)
+        except APIException:
+            return False
+        if result is not None:
+            return getattr(result[0], 'role', None) == 'admin'
+    return False
+
+
+def _lower_switch_interval():
+    # The sampler only runs when it gets the GIL, which a busy request
+    # thread hands over every sys.getswitchinterval() seconds
+    global _switch_users, _switch_interval
+    with _switch_lock:
+        if _switch_users == 0:
+            _switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(min(_switch_interval, getattr(settings, 'PROFILING_INTERVAL', 0.001) / 2))
+        _switch_users += 1
+
+
+def _restore_switch_interval():
+    global _switch_users
+    with _switch_lock:
+        _switch_users -= 1
+        if _switch_users == 0:
+            sys.setswitchinterval(_switch_interval)
+
+
+def frame_name(frame):
+    code = frame.f_code
+    name = f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+    return name.replace(';', ':')
+
+
+class Sampler(threading.Thread):
+    """
+    Record the stack of every other thread each ``interval`` seconds until
+    stopped. A request can run on more than one thread (async views run on
+    an event loop thread, their queries on another), so all of them are
+    sampled; each stack starts with its thread's name, which keeps other
+    requests on a threaded worker apart in the flamegraph.
+    """
+
+    def __init__(self, interval):
+        super().__init__(name='request-profiler', daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self.functions = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_name(frame))
+                    frame = frame.f_back
+                stack.append(f"thread {names.get(thread_id, thread_id)}".replace(';', ':'))
+                stack.reverse()
+                self.stacks[';'.join(stack)] += 1
+                self.functions[stack[-1]] += 1
+            self.samples += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class Profile:
+    def __init__(self, request, reason):
+        self.started_at = timezone.now()
+        # Sorts by start time, see prune()
+        self.id = f"{self.started_at.strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+        self.request = request
+        self.reason = reason
+        self.queries = []
+        self.query_count = 0
+        self.query_seconds = 0.0
+        self.interval = getattr(settings, 'PROFILING_INTERVAL', 0.001)
+        self.sampler = Sampler(self.interval)
+
+    def start(self):
+        _lower_switch_interval()
+        self.token = _active_profile.set(self)
+        self.started = time.perf_counter()
+        self.sampler.start()
+
+    def stop(self):
+        self.duration = time.perf_counter() - self.started
+        self.sampler.stop()
+        _active_profile.reset(self.token)
+        _restore_switch_interval()
+
+    def add_query(self, sql, seconds, origin):
+        self.query_count += 1
+        self.query_seconds += seconds
+        if len(self.queries) < MAX_RECORDED_QUERIES:
+            self.queries.append({'sql': sql, 'ms': round(seconds * 1000, 3), 'origin': origin})
+
+    def summary(self, response):
+        match = getattr(self.request, 'resolver_match', None)
+        return {
+            'id': self.id,
+            'reason': self.reason,
+            'started_at': self.started_at.isoformat(),
+            'method': self.request.method,
+            'path': self.request.get_full_path(),
+            'route': match.view_name if match is not None else None,
+            'status': response.status_code,
+            'duration_ms': round(self.duration * 1000, 3),
+            'sampling_interval_ms': self.interval * 1000,
+            'samples': self.sampler.samples,
+            'top_functions': [
+                {'function': name, 'samples': count}
+                for name, count in self.sampler.functions.most_common(TOP_FUNCTIONS)
+            ],
+            'sql': {
+                'count': self.query_count,
+                'total_ms': round(self.query_seconds * 1000, 3),
+                'queries': self.queries,
+            },
+            'flamegraph': f'{self.id}.folded',
+        }
+
+    def save(self, response):
+        directory = str(getattr(settings, 'PROFILING_DIR', os.path.join(settings.BASE_DIR, 'profiles')))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f'{self.id}.folded'), 'w') as folded:
+            for stack, count in self.sampler.stacks.most_common():
+                folded.write(f'{stack} {count}\n')
+        with open(os.path.join(directory, f'{self.id}.json'), 'w') as summary:
+            json.dump(self.summary(response), summary, indent=2)
+        prune(directory, getattr(settings, 'PROFILING_MAX_PROFILES', 50))
+
+
+def prune(directory, keep):
+    """Delete all but the ``keep`` newest profiles; ids sort by time"""
+    ids = sorted(name[:-len('.json')] for name in os.listdir(directory) if name.endswith('.json'))
+    for profile_id in ids[:max(len(ids) - keep, 0)]:
+        for extension in ('.json', '.folded'):
+            try:
+                os.remove(os.path.join(directory, profile_id + extension))
+            except FileNotFoundError:
+                # Another worker pruned it first
+                pass
+
+
+def observe_query(execute, sql, params, many, context):
+    """Connection execute wrapper adding each query to the active profile"""
+    profile = _active_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.add_query(sql, time.perf_counter() - started, project_frames(sys._getframe(1)))
+
+
+def install_query_observer(sender, connection, **kwargs):
+    """connection_created receiver, see PropertiesConfig.ready"""
+    if observe_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, observe_query)
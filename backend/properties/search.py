@@ -0,0 +1,162 @@
+import re
+
+from django.db import connection, connections
+from django.db.models import F, FloatField, Lookup, Q, TextField, Value
+
+FTS_TABLE = 'properties_property_fts'
+SEARCH_FIELDS = ('title', 'description', 'address', 'district', 'work_details')
+# bm25 column weights, in SEARCH_FIELDS order
+SEARCH_WEIGHTS = (10.0, 1.0, 3.0, 3.0, 1.0)
+# What the index's ``rank`` column holds for the rows a MATCH returns
+RANK_FUNCTION = f"bm25({', '.join(str(weight) for weight in SEARCH_WEIGHTS)})"
+
+# Harakat, tanween, shadda, sukun, superscript alef and Quranic marks
+ARABIC_DIACRITICS_RE = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed]')
+TATWEEL = '\u0640'
+ARABIC_LETTER_MAP = str.maketrans({
+    'أ': 'ا',  # alef with hamza above -> alef
+    'إ': 'ا',  # alef with hamza below -> alef
+    'آ': 'ا',  # alef with madda -> alef
+    'ٱ': 'ا',  # alef wasla -> alef
+    'ى': 'ي',  # alef maqsura -> yaa
+    'ة': 'ه',  # taa marbuta -> haa
+})
+TOKEN_RE = re.compile(r'\w+')
+
+
+def normalize_arabic(text):
+    """Normalize Arabic spelling variants so that they match each other"""
+    if not text:
+        return ''
+    text = ARABIC_DIACRITICS_RE.sub('', text)
+    text = text.replace(TATWEEL, '')
+    return text.translate(ARABIC_LETTER_MAP).lower()
+
+
+class Match(Lookup):
+    """``<FullTextField>__match=query``: an FTS5 MATCH on the whole index row"""
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+class FullTextField(TextField):
+    """
+    The hidden column an FTS5 table has under its own name. It is the left
+    side of a MATCH over every column and the first argument of bm25().
+    """
+
+
+FullTextField.register_lookup(Match)
+
+
+def search_enabled():
+    return connection.vendor == 'sqlite'
+
+
+def create_index(db_connection=connection):
+    columns = ', '.join(SEARCH_FIELDS)
+    with db_connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+            f"USING fts5({columns}, tokenize='unicode61 remove_diacritics 2')"
+        )
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rank) VALUES ('rank', %s)", [RANK_FUNCTION])
+
+
+def drop_index(db_connection=connection):
+    with db_connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def _row(property_obj):
+    return [property_obj.pk] + [normalize_arabic(getattr(property_obj, name)) for name in SEARCH_FIELDS]
+
+
+def index_property(property_obj):
+    if not search_enabled():
+        return
+    placeholders = ', '.join(['%s'] * (len(SEARCH_FIELDS) + 1))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [property_obj.pk])
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(SEARCH_FIELDS)}) VALUES ({placeholders})",
+            _row(property_obj)
+        )
+
+
+def index_properties(properties, db_connection=connection):
+    """index_property for many new properties at once, e.g. after bulk_create()"""
+    if db_connection.vendor != 'sqlite':
+        return
+    placeholders = ', '.join(['%s'] * (len(SEARCH_FIELDS) + 1))
+    with db_connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT OR REPLACE INTO {FTS_TABLE} (rowid, {', '.join(SEARCH_FIELDS)}) VALUES ({placeholders})",
+            [_row(property_obj) for property_obj in properties]
+        )
+
+
+def remove_property(property_id):
+    if not search_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [property_id])
+
+
+def rebuild_index(queryset, batch_size=1000):
+    """Rebuild the whole index from ``queryset``, returns the number of rows indexed"""
+    placeholders = ', '.join(['%s'] * (len(SEARCH_FIELDS) + 1))
+    insert = f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(SEARCH_FIELDS)}) VALUES ({placeholders})"
+    total = 0
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        batch = []
+        for property_obj in queryset.only('pk', *SEARCH_FIELDS).iterator(chunk_size=batch_size):
+            batch.append(_row(property_obj))
+            if len(batch) >= batch_size:
+                cursor.executemany(insert, batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(insert, batch)
+            total += len(batch)
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    return total
+
+
+def build_match_query(query):
+    """Turn free text into an FTS5 query matching every word as a prefix"""
+    tokens = TOKEN_RE.findall(normalize_arabic(query))
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_queryset(queryset, query):
+    """
+    Restrict ``queryset`` to properties matching ``query``, annotated with a
+    bm25 ``search_rank`` (lower is better) and ordered by it.
+    """
+    match = build_match_query(query)
+    if not match:
+        return queryset.none()
+
+    if not search_enabled():
+        condition = Q()
+        for token in TOKEN_RE.findall(query):
+            token_condition = Q()
+            for name in SEARCH_FIELDS:
+                token_condition |= Q(**{f'{name}__icontains': token})
+            condition &= token_condition
+        return queryset.filter(condition).annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        ).order_by('search_rank', 'id')
+
+    # Join the index once: FTS5 runs the MATCH a single time and scores the
+    # rows it returns. The rank column, unlike a bm25() call, can also be
+    # read by queries that GROUP BY.
+    return queryset.filter(search_entry__document__match=match).annotate(
+        search_rank=F('search_entry__rank')
+    ).order_by('search_rank', 'id')
@@ -1,6 +1,47 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth import authenticate
-from .models import CustomUser, Property, Contractor, EvaluationRequest, PropertyImage, PriceOffer, CompletionImage
+from django.db.models import Count, Prefetch
+from .models import (
+    CustomUser, Property, Contractor, EvaluationRequest, PropertyImage, PriceOffer, CompletionImage,
+    UploadSession
+)
+from .images import build_srcset, schedule_image_variants
+from .storage import ensure_blob, release_blobs, store_blobs
+from .transactions import write_transaction
+
+
+class WorkAreasField(serializers.Field):
+    """
+    Work areas as a comma separated string of choice keys. Accepts either a
+    string or a list on input and returns a validated list.
+    """
+    default_error_messages = {
+        'invalid': 'Expected a comma separated string or a list of work areas.',
+        'invalid_choice': 'Invalid work areas: {areas}',
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            data = data.split(',')
+        elif not isinstance(data, (list, tuple)):
+            self.fail('invalid')
+        areas = []
+        for area in data:
+            area = str(area).strip()
+            if area and area not in areas:
+                areas.append(area)
+        choices = dict(Property.WORK_AREA_CHOICES)
+        invalid = [area for area in areas if area not in choices]
+        if invalid:
+            self.fail('invalid_choice', areas=', '.join(invalid))
+        return areas
+
+    def to_representation(self, value):
+        if isinstance(value, str):
+            return value
+        return ','.join(value)
+
 
 class CustomUserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -38,14 +79,24 @@ class ContractorSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 class PropertyImageSerializer(serializers.ModelSerializer):
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = PropertyImage
-        fields = ('id', 'image', 'is_thumbnail', 'order', 'uploaded_at')
+        fields = ('id', 'image', 'srcset', 'is_thumbnail', 'order', 'uploaded_at')
+
+    def get_srcset(self, obj):
+        return build_srcset(obj, self.context.get('request'))
 
 class CompletionImageSerializer(serializers.ModelSerializer):
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = CompletionImage
-        fields = ('id', 'image', 'description', 'uploaded_at')
+        fields = ('id', 'image', 'srcset', 'description', 'uploaded_at')
+
+    def get_srcset(self, obj):
+        return build_srcset(obj, self.context.get('request'))
 
 class PropertySerializer(serializers.ModelSerializer):
     images = PropertyImageSerializer(many=True, read_only=True)
@@ -55,8 +106,11 @@ class PropertySerializer(serializers.ModelSerializer):
     status_display = serializers.SerializerMethodField()
     current_price_offer = serializers.SerializerMethodField()
     completion_images = CompletionImageSerializer(many=True, read_only=True)
-    work_areas = serializers.CharField(required=False)
+    work_areas = WorkAreasField(required=False)
     work_areas_display = serializers.SerializerMethodField()
+    uploaded_images = serializers.ListField(
+        child=serializers.ImageField(), write_only=True, required=False
+    )
 
     class Meta:
         model = Property
@@ -74,8 +128,30 @@ class PropertySerializer(serializers.ModelSerializer):
             'work_areas',
             'work_areas_display',
             'work_details',
+            'uploaded_images',
         ]
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Preload every relation read while serializing a property so that
+        list endpoints run a fixed number of queries regardless of row count.
+        """
+        return queryset.select_related(
+            'homeowner',
+            'assigned_contractor__user',
+        ).prefetch_related(
+            'images',
+            'completion_images',
+            Prefetch(
+                'price_offers',
+                queryset=PriceOffer.objects.filter(status='pending').select_related('contractor__user'),
+                to_attr='pending_price_offers'
+            ),
+        ).annotate(
+            completion_images_total=Count('completion_images', distinct=True)
+        )
+
     def get_homeowner(self, obj):
         return {
             'name': obj.homeowner.get_full_name() or obj.homeowner.email,
@@ -114,7 +190,11 @@ class PropertySerializer(serializers.ModelSerializer):
 
     def get_current_price_offer(self, obj):
         if obj.status == 'price_proposed':
-            offer = obj.price_offers.filter(status='pending').first()
+            # Use the pending offers prefetched by setup_eager_loading when available
+            if hasattr(obj, 'pending_price_offers'):
+                offer = obj.pending_price_offers[0] if obj.pending_price_offers else None
+            else:
+                offer = obj.price_offers.filter(status='pending').first()
             if offer:
                 return PriceOfferSerializer(offer).data
         return None
@@ -123,48 +203,156 @@ class PropertySerializer(serializers.ModelSerializer):
         return [dict(Property.WORK_AREA_CHOICES).get(area, area) for area in obj.work_areas]
 
     def create(self, validated_data):
-        # Handle work_areas if it comes as a string
-        if 'work_areas' in validated_data and isinstance(validated_data['work_areas'], str):
-            work_areas = validated_data['work_areas'].split(',')
-            validated_data['work_areas'] = work_areas
+        uploaded_images = validated_data.pop('uploaded_images', [])
+
+        @write_transaction
+        def write(blobs):
+            property = Property.objects.create(**validated_data)
+            self.add_images(property, uploaded_images, blobs)
+            return property
 
+        return self.write_with_images(write, uploaded_images)
+
+    def update(self, instance, validated_data):
         uploaded_images = validated_data.pop('uploaded_images', [])
-        property = Property.objects.create(**validated_data)
-        
-        for index, image in enumerate(uploaded_images):
-            PropertyImage.objects.create(
+
+        @write_transaction
+        def write(blobs):
+            # Update property instance
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            instance.save()
+            self.add_images(instance, uploaded_images, blobs, start=instance.images.count())
+            return instance
+
+        return self.write_with_images(write, uploaded_images)
+
+    @staticmethod
+    def write_with_images(write, uploaded_images):
+        """
+        Store the image files, then ``write(blobs)`` the rows in one write
+        transaction. The blobs are released again if the rows are not written.
+        """
+        # Hash and store the files before taking the write lock
+        blobs = store_blobs(uploaded_images)
+        try:
+            return write(blobs)
+        except BaseException:
+            release_blobs(blobs)
+            raise
+
+    @staticmethod
+    def add_images(property, uploaded_images, blobs, start=0):
+        """
+        Insert the images, already stored as ``blobs``, in one statement.
+        The first image becomes the thumbnail when the property has none yet.
+        """
+        images = PropertyImage.objects.bulk_create([
+            PropertyImage(
                 property=property,
-                image=image,
-                is_thumbnail=(index == 0),  # First image is thumbnail
-                order=index
+                image=name,
+                is_thumbnail=(start + index == 0),
+                order=start + index
             )
-        
-        return property
+            for index, name in enumerate(blobs)
+        ])
+        for name, image in zip(blobs, uploaded_images):
+            ensure_blob(name, image)
+        schedule_image_variants(images)
+        return images
 
-    def update(self, instance, validated_data):
-        # Handle work_areas if it comes as a string
-        if 'work_areas' in validated_data and isinstance(validated_data['work_areas'], str):
-            work_areas = validated_data['work_areas'].split(',')
-            validated_data['work_areas'] = work_areas
+class PropertyListSerializer(PropertySerializer):
+    """
+    Compact property representation for list pages and cards.
 
-        uploaded_images = validated_data.pop('uploaded_images', [])
-        
-        # Update property instance
-        for attr, value in validated_data.items():
-            setattr(instance, attr, value)
-        instance.save()
-        
-        # Add new images if provided
-        current_count = instance.images.count()
-        for index, image in enumerate(uploaded_images):
-            PropertyImage.objects.create(
-                property=instance,
-                image=image,
-                is_thumbnail=(index == 0 and current_count == 0),  # First image is thumbnail only if no existing images
-                order=current_count + index
+    Only the thumbnail image is included by default. ``fields`` restricts
+    the top level fields and ``expand`` opts in to nested relations; the
+    relations that are not requested are neither serialized nor queried.
+    """
+    EXPANDABLE_FIELDS = (
+        'homeowner', 'images', 'completion_images',
+        'assigned_contractor', 'current_price_offer',
+    )
+    # Large text columns only loaded when explicitly requested
+    DEFERRABLE_FIELDS = ('description', 'evaluation_report', 'work_details', 'completion_note')
+
+    thumbnail = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Property
+        fields = [
+            'id', 'title', 'address', 'city', 'district',
+            'size', 'property_type', 'number_of_rooms', 'number_of_floors',
+            'condition', 'condition_display', 'status', 'status_display',
+            'rating', 'completion_date', 'completion_images_count',
+            'thumbnail',
+            'homeowner', 'images', 'completion_images',
+            'assigned_contractor', 'current_price_offer',
+        ]
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in self.get_excluded_fields(fields, expand):
+            self.fields.pop(name, None)
+
+    @classmethod
+    def get_selected_fields(cls, fields=None, expand=None):
+        expand = set(expand or ()) & set(cls.EXPANDABLE_FIELDS)
+        selected = [
+            name for name in cls.Meta.fields
+            if name not in cls.EXPANDABLE_FIELDS or name in expand
+        ]
+        if fields:
+            selected = [name for name in selected if name in fields or name in expand]
+        return selected
+
+    @classmethod
+    def get_excluded_fields(cls, fields=None, expand=None):
+        selected = cls.get_selected_fields(fields, expand)
+        return [name for name in cls.Meta.fields if name not in selected]
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, fields=None, expand=None):
+        selected = cls.get_selected_fields(fields, expand)
+
+        deferred = [name for name in cls.DEFERRABLE_FIELDS if name not in selected]
+        if deferred:
+            queryset = queryset.defer(*deferred)
+
+        if 'homeowner' in selected:
+            queryset = queryset.select_related('homeowner')
+        if 'assigned_contractor' in selected:
+            queryset = queryset.select_related('assigned_contractor__user')
+        if 'thumbnail' in selected:
+            queryset = queryset.prefetch_related(Prefetch(
+                'images',
+                queryset=PropertyImage.objects.filter(is_thumbnail=True),
+                to_attr='thumbnail_images'
+            ))
+        if 'images' in selected:
+            queryset = queryset.prefetch_related('images')
+        if 'completion_images' in selected:
+            queryset = queryset.prefetch_related('completion_images')
+        if 'current_price_offer' in selected:
+            queryset = queryset.prefetch_related(Prefetch(
+                'price_offers',
+                queryset=PriceOffer.objects.filter(status='pending').select_related('contractor__user'),
+                to_attr='pending_price_offers'
+            ))
+        if 'completion_images_count' in selected:
+            queryset = queryset.annotate(
+                completion_images_total=Count('completion_images', distinct=True)
             )
-        
-        return instance
+        return queryset
+
+    def get_thumbnail(self, obj):
+        if hasattr(obj, 'thumbnail_images'):
+            thumbnail = obj.thumbnail_images[0] if obj.thumbnail_images else None
+        else:
+            thumbnail = obj.images.filter(is_thumbnail=True).first()
+        if thumbnail is None:
+            return None
+        return PropertyImageSerializer(thumbnail, context=self.context).data
 
 class EvaluationRequestSerializer(serializers.ModelSerializer):
     class Meta:
@@ -247,6 +435,11 @@ class PriceOfferSerializer(serializers.ModelSerializer):
             'contractor_phone'
         ]
         read_only_fields = ['status', 'proposed_at']
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Join the property and contractor read by the method fields"""
+        return queryset.select_related('property', 'contractor__user')
     
     def get_property_title(self, obj):
         return obj.property.title if obj.property else None
@@ -281,8 +474,7 @@ class PropertyCompletionSerializer(serializers.Serializer):
                 'required': 'Please provide at least one image'
             }
         ),
-        required=True,
-        min_length=1,
+        required=False,
         error_messages={
             'required': 'Please provide at least one image',
             'min_length': 'Please provide at least one image',
@@ -292,4 +484,37 @@ class PropertyCompletionSerializer(serializers.Serializer):
     image_descriptions = serializers.ListField(
         child=serializers.CharField(allow_blank=True),
         required=False
-    ) 
\ No newline at end of file
+    ) 
+    upload_ids = serializers.ListField(
+        child=serializers.UUIDField(),
+        required=False
+    )
+
+    def validate(self, data):
+        if not data.get('images') and not data.get('upload_ids'):
+            raise serializers.ValidationError({'images': 'Please provide at least one image'})
+        return data
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ('id', 'filename', 'size', 'received', 'status', 'created_at')
+        read_only_fields = ('id', 'received', 'status', 'created_at')
+
+
+class BulkReviewItemSerializer(serializers.Serializer):
+    id = serializers.IntegerField(min_value=1)
+    action = serializers.ChoiceField(choices=('approve', 'reject'))
+
+
+class BulkReviewSerializer(serializers.Serializer):
+    reviews = BulkReviewItemSerializer(many=True, allow_empty=False)
+
+    def validate_reviews(self, reviews):
+        limit = getattr(settings, 'BULK_REVIEW_MAX_ITEMS', 500)
+        if len(reviews) > limit:
+            raise serializers.ValidationError(f'At most {limit} properties can be reviewed at once')
+        ids = [review['id'] for review in reviews]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError('Each property can only be reviewed once')
+        return reviews
@@ -0,0 +1,71 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from . import search
+from .caching import invalidate_facets, invalidate_showcase
+from .models import CompletionImage, Property, PropertyImage
+from .storage import ensure_blob, release_blob, uncommitted_content
+
+
+@receiver(post_init, sender=Property)
+def remember_loaded_values(sender, instance, **kwargs):
+    # Read from __dict__ so deferred fields are not loaded
+    instance._loaded_status = instance.__dict__.get('status')
+    instance._loaded_work_areas = instance.__dict__.get('work_areas')
+
+
+@receiver(post_save, sender=Property)
+def property_saved(sender, instance, **kwargs):
+    # Only once readers can see the change, or one of them could cache the
+    # old rows again under the new version
+    transaction.on_commit(invalidate_facets)
+    if 'completed' in (instance._loaded_status, instance.status):
+        transaction.on_commit(invalidate_showcase)
+    instance._loaded_status = instance.status
+
+    if 'work_areas' in instance.__dict__:
+        to_python = Property._meta.get_field('work_areas').to_python
+        loaded = [] if kwargs.get('created') else to_python(instance._loaded_work_areas)
+        if set(to_python(instance.work_areas)) != set(loaded):
+            instance.sync_work_areas()
+        instance._loaded_work_areas = instance.work_areas
+
+    update_fields = kwargs.get('update_fields')
+    if update_fields is None or set(update_fields) & set(search.SEARCH_FIELDS):
+        search.index_property(instance)
+
+
+@receiver(post_delete, sender=Property)
+def property_deleted(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_facets)
+    if instance._loaded_status == 'completed':
+        transaction.on_commit(invalidate_showcase)
+    search.remove_property(instance.pk)
+
+
+@receiver(post_save, sender=CompletionImage)
+@receiver(post_delete, sender=CompletionImage)
+def completion_image_changed(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_showcase)
+
+
+@receiver(post_delete, sender=PropertyImage)
+@receiver(post_delete, sender=CompletionImage)
+def image_deleted(sender, instance, **kwargs):
+    name, variants = instance.image.name, instance.variants
+    transaction.on_commit(lambda: release_blob(name, variants))
+
+
+@receiver(pre_save, sender=PropertyImage)
+@receiver(pre_save, sender=CompletionImage)
+def remember_image_content(sender, instance, **kwargs):
+    # Saving the row stores the file and forgets it, keep it for image_saved
+    instance._image_content = uncommitted_content(instance.image)
+
+
+@receiver(post_save, sender=PropertyImage)
+@receiver(post_save, sender=CompletionImage)
+def image_saved(sender, instance, **kwargs):
+    ensure_blob(instance.image.name, instance._image_content)
+    instance._image_content = None
@@ -0,0 +1,198 @@
+"""
+Slow query log.
+
+Every statement that takes longer than SLOW_QUERY_THRESHOLD_MS is logged
+to the ``properties.slow_queries`` logger, which settings.LOGGING writes to
+SLOW_QUERY_LOG_DIR, one JSON object per line. Each worker process writes
+and rotates a file of its own there (see logs.WorkerFileHandler).
+An entry has the route and id of the request that ran the statement, the
+project code that ran it (``call_site`` and the outer ``stack``), the SQL
+with its parameters and the database's plan for it (EXPLAIN QUERY PLAN on
+SQLite).
+
+Only numbers, booleans, dates and NULLs are logged as they are; strings
+and bytes are replaced by their length, so passwords, tokens and personal
+data stay out of the log. The plan is taken with the real parameters.
+
+The /api/_slow_queries view reads the files of every worker back, including
+ones that have exited, and ranks the statements by the total time they
+took, see top_offenders().
+"""
+import datetime
+import decimal
+import glob
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from .profiling import project_frames
+
+logger = logging.getLogger('properties.slow_queries')
+
+# Statements the database can plan without running them
+EXPLAINABLE = ('select', 'with', 'update', 'delete')
+PLAIN_PARAM_TYPES = (
+    bool, int, float, decimal.Decimal, datetime.date, datetime.time, datetime.timedelta, uuid.UUID
+)
+
+_current_request = ContextVar('slow_query_request', default=None)
+
+
+def threshold():
+    """The threshold in seconds, or None when the log is off"""
+    milliseconds = getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', None)
+    return None if milliseconds is None else milliseconds / 1000
+
+
+def start_request(request):
+    return _current_request.set(request)
+
+
+def finish_request(token):
+    _current_request.reset(token)
+
+
+def redact(params):
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {name: redact_value(value) for name, value in params.items()}
+    return [redact_value(value) for value in params]
+
+
+def redact_value(value):
+    if value is None or isinstance(value, PLAIN_PARAM_TYPES):
+        return value if isinstance(value, (bool, int, float)) else str(value)
+    if isinstance(value, (str, bytes, bytearray, memoryview)):
+        return f'<{type(value).__name__}: {len(value)}>'
+    return f'<{type(value).__name__}>'
+
+
+def explain(connection, sql, params):
+    """
+    The plan of ``sql`` as a list of lines, or None. Runs on a cursor of its
+    own, since the caller has not read the results of its statement yet, and
+    one that skips the execute wrappers so the EXPLAIN is not observed.
+    """
+    if not sql.lstrip().lower().startswith(EXPLAINABLE):
+        return None
+    cursor = connection.create_cursor()
+    try:
+        cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+        # The last column holds the description on SQLite and PostgreSQL
+        return [str(row[-1]) for row in cursor.fetchall()]
+    except DatabaseError:
+        return None
+    finally:
+        cursor.close()
+
+
+def request_route(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    # Named the way MetricsMiddleware names routes
+    return match.view_name if match.url_name else match.route
+
+
+def observe_query(execute, sql, params, many, context):
+    """Connection execute wrapper logging the statements over the threshold"""
+    limit = threshold()
+    if limit is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    result = execute(sql, params, many, context)
+    seconds = time.perf_counter() - started
+    if seconds >= limit:
+        log_query(sql, params, many, context['connection'], seconds, sys._getframe(1))
+    return result
+
+
+def log_query(sql, params, many, connection, seconds, frame):
+    request = _current_request.get()
+    stack = project_frames(frame)
+    entry = {
+        'duration_ms': round(seconds * 1000, 3),
+        'database': connection.alias,
+        'route': request_route(request) if request is not None else None,
+        'method': request.method if request is not None else None,
+        'call_site': stack[0].split(' in ', 1)[-1] if stack else None,
+        'stack': stack,
+        'sql': sql,
+        'many': many,
+        # executemany() parameters are a list of rows, only the first is kept
+        'params': redact(next(iter(params), None) if many else params),
+        'plan': None if many else explain(connection, sql, params),
+    }
+    logger.warning('slow query', extra=entry)
+
+
+def install_query_observer(sender, connection, **kwargs):
+    """connection_created receiver, see PropertiesConfig.ready"""
+    if observe_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, observe_query)
+
+
+def log_dir():
+    return str(getattr(settings, 'SLOW_QUERY_LOG_DIR', os.path.join(settings.BASE_DIR, 'slow_queries')))
+
+
+def log_files():
+    """The current file and the rotated backups of every worker"""
+    return sorted(glob.glob(os.path.join(log_dir(), 'worker-*.log*')))
+
+
+def read_entries():
+    for path in log_files():
+        try:
+            log_file = open(path)
+        except FileNotFoundError:
+            continue
+        with log_file:
+            for line in log_file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # A line cut short by a rotation
+                    continue
+
+
+def top_offenders(limit=20):
+    """
+    The logged statements grouped by SQL and call site, the ones that took
+    the most time in total first. Each carries the plan and parameters of
+    its latest run.
+    """
+    groups = {}
+    for entry in read_entries():
+        key = (entry.get('sql'), entry.get('call_site'))
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {
+                'sql': entry.get('sql'), 'call_site': entry.get('call_site'), 'count': 0,
+                'total_ms': 0.0, 'max_ms': 0.0, 'routes': {}, 'last_seen': None,
+            }
+        duration = entry.get('duration_ms', 0.0)
+        group['count'] += 1
+        group['total_ms'] += duration
+        group['max_ms'] = max(group['max_ms'], duration)
+        route = entry.get('route') or '<no request>'
+        group['routes'][route] = group['routes'].get(route, 0) + 1
+        if group['last_seen'] is None or entry.get('time', '') >= group['last_seen']:
+            group['last_seen'] = entry.get('time')
+            group['stack'] = entry.get('stack')
+            group['params'] = entry.get('params')
+            group['plan'] = entry.get('plan')
+
+    offenders = sorted(groups.values(), key=lambda group: group['total_ms'], reverse=True)[:limit]
+    for group in offenders:
+        group['total_ms'] = round(group['total_ms'], 3)
+        group['mean_ms'] = round(group['total_ms'] / group['count'], 3)
+    return offenders
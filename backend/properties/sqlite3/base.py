@@ -0,0 +1,54 @@
+"""
+SQLite backend with per-connection setup and a configurable transaction
+mode, the ``init_command`` and ``transaction_mode`` options Django 5.1 adds
+to its own SQLite backend.
+
+    'ENGINE': 'properties.sqlite3',
+    'OPTIONS': {
+        'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+        'transaction_mode': 'DEFERRED',
+    }
+
+``transactions.write_transaction`` asks for an IMMEDIATE transaction for a
+single atomic block, whatever the configured mode.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.init_commands = []
+        self.transaction_mode = None
+        # Mode for the next transaction only, see transactions.write_transaction
+        self.next_transaction_mode = None
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        self.init_commands = [
+            command.strip()
+            for command in (kwargs.pop('init_command', None) or '').split(';')
+            if command.strip()
+        ]
+        transaction_mode = kwargs.pop('transaction_mode', None)
+        if transaction_mode is not None and transaction_mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f"settings.DATABASES['{self.alias}']['OPTIONS']['transaction_mode'] must be one of "
+                f"{', '.join(TRANSACTION_MODES)}"
+            )
+        self.transaction_mode = transaction_mode.upper() if transaction_mode else None
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for command in self.init_commands:
+            conn.execute(command)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.next_transaction_mode or self.transaction_mode
+        self.next_transaction_mode = None
+        self.cursor().execute(f'BEGIN {mode}' if mode else 'BEGIN')
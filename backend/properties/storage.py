@@ -0,0 +1,134 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils.deconstruct import deconstructible
+
+from .transactions import write_transaction
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Store every upload once, named after the SHA-256 of its bytes:
+    ``blobs/ab/cd/<sha256><ext>``. The two levels of 256 shard directories
+    keep directory sizes bounded, and identical uploads share one file.
+
+    Since a blob's content never changes its URL can be cached forever.
+    Blobs are removed by ``release_blob`` once no row references them.
+    """
+    blob_prefix = 'blobs'
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is derived from the content in _save
+        return name
+
+    def _save(self, name, content):
+        extension = os.path.splitext(name)[1].lower()
+        tmp_dir = self.path(f'{self.blob_prefix}/tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        # Hash while streaming to a temporary file so large uploads never
+        # have to be held in memory or read twice
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    tmp_file.write(chunk)
+
+            sha256 = digest.hexdigest()
+            blob_name = f'{self.blob_prefix}/{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}'
+            full_path = self.path(blob_name)
+            if os.path.exists(full_path):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(tmp_path, self.file_permissions_mode)
+                os.replace(tmp_path, full_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return blob_name
+
+    def is_blob(self, name):
+        return bool(name) and name.startswith(f'{self.blob_prefix}/')
+
+
+image_storage = ContentAddressedStorage()
+
+
+def blob_reference_count(name):
+    from .models import CompletionImage, PropertyImage
+
+    return (
+        PropertyImage.objects.filter(image=name).count()
+        + CompletionImage.objects.filter(image=name).count()
+    )
+
+
+@write_transaction
+def release_blob(name, variants=None):
+    """
+    Drop one reference to a blob: delete it, and its resized variants, when
+    no PropertyImage or CompletionImage row uses it any more.
+
+    The count and the delete hold the database write lock, so a row added
+    by another request is either counted or written after the delete, in
+    which case ensure_blob puts the blob back.
+    """
+    if not image_storage.is_blob(name) or blob_reference_count(name):
+        return False
+    image_storage.delete(name)
+    for widths in (variants or {}).values():
+        for path in widths.values():
+            default_storage.delete(path)
+    return True
+
+
+def release_blobs(names):
+    """Release blobs stored for rows that were not written after all"""
+    for name in dict.fromkeys(names):
+        release_blob(name)
+
+
+def store_blobs(files):
+    """
+    Hash and store ``files`` ahead of the transaction that writes their
+    rows, so the write lock is not held during the file I/O. Returns the
+    blob names: pass each, with its file, to ensure_blob once its row is
+    written, and all of them to release_blobs if the rows are not.
+    """
+    names = []
+    try:
+        for file in files:
+            names.append(image_storage.save(file.name, file))
+    except BaseException:
+        release_blobs(names)
+        raise
+    return names
+
+
+def uncommitted_content(field_file):
+    """The file assigned to ``field_file`` that saving the row will store, or None"""
+    if not field_file or field_file._committed:
+        return None
+    return field_file.file
+
+
+def ensure_blob(name, content):
+    """
+    Put a blob back once the row referencing it is written. _save returns
+    an existing blob without writing it, and release_blob may delete that
+    blob before the row that now uses it is there to be counted.
+    """
+    if content is None or not image_storage.is_blob(name) or image_storage.exists(name):
+        return False
+    image_storage.save(name, content)
+    return True
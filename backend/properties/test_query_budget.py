@@ -0,0 +1,474 @@
+"""
+Query budget for every API route.
+
+Each route in backend/urls.py and properties/urls.py is called as every
+role, once against a small dataset and once after it has grown, with
+targets that have more images, offers and completion images. A route
+passes when it runs the same number of queries both times, so it has no
+N+1 pattern, and no more than its budget. Failures list the statements
+grouped by the line of project code that issued them.
+
+Run with ``pytest`` from the backend directory.
+"""
+import io
+import itertools
+import os
+import re
+import traceback
+import uuid
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+from decimal import Decimal
+from typing import Callable, NamedTuple, Optional, Union
+
+import pytest
+from django.conf import settings
+from django.db import connections
+from django.urls import Resolver404, URLPattern, URLResolver, get_resolver, resolve
+from PIL import Image
+from rest_framework.test import APIClient
+
+from .authentication import issue_tokens
+from .caching import invalidate_facets, invalidate_showcase
+from .models import (
+    CompletionImage, Contractor, CustomUser, EvaluationRequest, PriceOffer, Property, PropertyImage,
+    UploadSession
+)
+
+SMALL, LARGE = 2, 6
+
+SAVEPOINT_RE = re.compile(r'^(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT) ')
+
+ROLES = ('anonymous', 'user', 'contractor', 'admin')
+EVERYONE = ROLES
+SIGNED_IN = ('user', 'contractor', 'admin')
+
+# urlconf -> the path it serves the API under
+URLCONFS = {
+    'backend.urls': '/api/',
+    'properties.urls': '/',
+}
+
+
+class Route(NamedTuple):
+    method: str
+    # Relative to the API root, with {placeholders} for the targets of Dataset.grow
+    path: str
+    # Most queries a call may run, whoever makes it
+    budget: int
+    # Roles for which the call must succeed
+    succeeds_for: tuple = ()
+    # Request body, or a function of the targets returning it
+    data: Union[dict, bytes, Callable, None] = None
+    # Extra keyword arguments for the test client
+    options: Optional[dict] = None
+
+
+def property_data(targets):
+    return {
+        'title': f"Villa {targets['serial']}",
+        'description': 'Two floors with a garden',
+        'address': 'King Fahd Road',
+        'city': 'Riyadh',
+        'latitude': '24.713600',
+        'longitude': '46.675300',
+        'plot_number': '12',
+        'property_type': 'house',
+        'size': '300.00',
+        'condition': 'FAIR',
+        'work_areas': ['kitchen'],
+    }
+
+
+def user_data(targets):
+    email = f"new-{targets['serial']}@example.com"
+    return {'username': email, 'email': email, 'password': 'Secret-123', 'role': 'user'}
+
+
+def offer_data(targets):
+    return {'property': targets['approved'], 'amount': '1500.00', 'description': 'Full repaint'}
+
+
+ROUTES = (
+    Route('get', '', 0, SIGNED_IN),
+    # Users
+    Route('get', 'users/', 1, SIGNED_IN),
+    Route('post', 'users/', 3, SIGNED_IN, user_data),
+    Route('get', 'users/{user}/', 1, SIGNED_IN),
+    Route('put', 'users/{user}/', 4, SIGNED_IN, user_data),
+    Route('patch', 'users/{user}/', 2, SIGNED_IN, {'first_name': 'Sara'}),
+    Route('delete', 'users/{user}/', 10, SIGNED_IN),
+    # Properties
+    Route('get', 'properties/', 4, SIGNED_IN),
+    Route('get', 'properties/?status=completed', 4, EVERYONE),
+    Route('get', 'properties/?status=approved', 4, EVERYONE),
+    Route('get', 'properties/?view=compact', 2, SIGNED_IN),
+    Route('post', 'properties/', 13, ('user',), property_data),
+    Route('get', 'properties/{approved}/', 4, EVERYONE),
+    Route('put', 'properties/{pending}/', 11, ('user', 'admin'), property_data),
+    Route('patch', 'properties/{pending}/', 9, ('user', 'admin'), {'title': 'Renamed'}),
+    Route('delete', 'properties/{rejected}/', 12, ('user', 'admin')),
+    Route('get', 'properties/admin_requests/', 4, ('admin',)),
+    Route('get', 'properties/completed-list/', 4, EVERYONE),
+    Route('get', 'properties/completed/', 4, SIGNED_IN),
+    Route('get', 'properties/facets/', 1, EVERYONE),
+    Route('get', 'properties/work-area-counts/', 1, EVERYONE),
+    Route('post', 'properties/{pending}/admin_review/', 7, ('admin',), {'action': 'approve'}),
+    Route('post', 'properties/{approved}/assign_contractor/', 10, ('admin',),
+          lambda targets: {'contractor_id': targets['contractor']}),
+    Route('post', 'properties/{approved}/contractor_review/', 7, ('contractor',),
+          {'evaluation_report': 'Sound structure', 'rating': 4, 'status': 'approved'}),
+    Route('post', 'properties/bulk_review/', 2, ('admin',),
+          lambda targets: {'reviews': [{'id': targets['pending'], 'action': 'approve'},
+                                       {'id': targets['approved'], 'action': 'reject'}]}),
+    Route('post', 'properties/{in_progress}/mark_completed/', 10, ('contractor',),
+          lambda targets: {'completion_note': 'Done', 'upload_ids': [targets['committed_upload']]},
+          {'format': 'multipart'}),
+    # Contractors
+    Route('get', 'contractors/', 1, SIGNED_IN),
+    Route('post', 'contractors/', 0, (), {}),
+    Route('get', 'contractors/{contractor}/', 1, SIGNED_IN),
+    Route('put', 'contractors/{contractor}/', 1, (), {}),
+    Route('patch', 'contractors/{contractor}/', 2, SIGNED_IN, {'specialization': 'Plumbing'}),
+    Route('delete', 'contractors/{contractor}/', 5, SIGNED_IN),
+    Route('post', 'contractors/{contractor}/submit_evaluation/', 12, ('contractor',),
+          lambda targets: {'property_id': targets['in_progress'], 'evaluation_report': 'Sound', 'rating': 4}),
+    # Evaluation requests
+    Route('get', 'evaluation-requests/', 1, SIGNED_IN),
+    Route('post', 'evaluation-requests/', 3, SIGNED_IN,
+          lambda targets: {'property': targets['approved'], 'contractor': targets['contractor']}),
+    Route('get', 'evaluation-requests/{evaluation}/', 1, ('contractor', 'admin')),
+    Route('put', 'evaluation-requests/{evaluation}/', 4, ('contractor', 'admin'),
+          lambda targets: {'property': targets['approved'], 'contractor': targets['contractor'],
+                           'completed': True}),
+    Route('patch', 'evaluation-requests/{evaluation}/', 2, ('contractor', 'admin'), {'completed': True}),
+    Route('delete', 'evaluation-requests/{evaluation}/', 2, ('contractor', 'admin')),
+    # Price offers
+    Route('get', 'price-offers/', 1, SIGNED_IN),
+    Route('post', 'price-offers/', 6, ('contractor',), offer_data),
+    Route('get', 'price-offers/{offer}/', 1, SIGNED_IN),
+    Route('put', 'price-offers/{offer}/', 3, SIGNED_IN, offer_data),
+    Route('patch', 'price-offers/{offer}/', 2, SIGNED_IN, {'amount': '1750.00'}),
+    Route('delete', 'price-offers/{offer}/', 2, SIGNED_IN),
+    Route('post', 'price-offers/{offer}/accept/', 9, ('user',)),
+    Route('post', 'price-offers/{offer}/reject/', 6, ('user',)),
+    # Resumable uploads
+    Route('post', 'uploads/', 2, SIGNED_IN, {'filename': 'photo.jpg', 'size': 4}),
+    Route('get', 'uploads/{upload}/', 1, SIGNED_IN),
+    Route('put', 'uploads/{upload}/', 3, SIGNED_IN, b'\xff\xd8\xff\xe0',
+          {'content_type': 'application/octet-stream', 'HTTP_CONTENT_RANGE': 'bytes 0-3/4'}),
+    Route('delete', 'uploads/{upload}/', 2, SIGNED_IN),
+    Route('post', 'uploads/{committed_upload}/commit/', 1, SIGNED_IN),
+    # Accounts
+    Route('post', 'signup/', 3, EVERYONE, user_data),
+    Route('post', 'login/', 2, EVERYONE, lambda targets: {'email': targets['email'], 'password': 'password'}),
+    Route('post', 'logout/', 3, SIGNED_IN),
+    Route('post', 'token/refresh/', 2, SIGNED_IN, lambda targets: {'refresh': targets['refresh']}),
+    # Function views for the property workflow
+    Route('post', 'properties/{in_progress}/complete/', 4, ('contractor',)),
+    Route('post', 'properties/{pending}/approve/', 4, ('admin',), {'action': 'approve'}),
+    # Monitoring
+    Route('get', '_metrics', 0, ('admin',)),
+    Route('get', '_slow_queries', 0, ('admin',)),
+)
+
+# Patterns that can not be reached because an earlier pattern serves the
+# same paths. The router's property and price offer routes are taken over
+# by properties.async_views; the router's detail actions come before the
+# standalone function views of the same name.
+SHADOWED = {
+    'backend.urls': {
+        'api/properties/$',
+        'api/properties/completed-list/$',
+        'api/properties/(?P<pk>[^/.]+)/$',
+        'api/price-offers/$',
+        'api/properties/<int:property_id>/mark_completed/',
+        'api/properties/<int:property_id>/admin_review/',
+    },
+    'properties.urls': {
+        'properties/<int:property_id>/mark_completed/',
+        'properties/<int:property_id>/admin_review/',
+    },
+}
+
+# Placeholder values that let every route template resolve
+SAMPLE_TARGETS = defaultdict(lambda: '1', upload=str(uuid.uuid4()), committed_upload=str(uuid.uuid4()))
+
+
+def route_path(urlconf, route, targets):
+    return URLCONFS[urlconf] + route.path.format_map(targets)
+
+
+def resolved_route(urlconf, route):
+    """The pattern serving ``route`` in ``urlconf``, or None if it has none"""
+    path = route_path(urlconf, route, SAMPLE_TARGETS).split('?')[0]
+    try:
+        return resolve(path, urlconf).route
+    except Resolver404:
+        return None
+
+
+def iter_patterns(urlconf):
+    """Every API pattern of ``urlconf``, as ResolverMatch.route spells it"""
+    def walk(patterns, prefix):
+        for pattern in patterns:
+            route = URLResolver._join_route(prefix, str(pattern.pattern))
+            if isinstance(pattern, URLResolver):
+                if route != 'admin/':
+                    yield from walk(pattern.url_patterns, route)
+            elif isinstance(pattern, URLPattern):
+                # Format suffix variants serve the same views
+                if 'format>' not in route and not route.startswith(('^media/', 'media/')):
+                    yield route
+
+    yield from walk(get_resolver(urlconf).url_patterns, '')
+
+
+CASES = [
+    pytest.param(urlconf, route, role, id=f'{urlconf}:{route.method.upper()} {route.path or "/"}:{role}')
+    for urlconf in URLCONFS
+    for route in ROUTES
+    if resolved_route(urlconf, route) is not None
+    for role in ROLES
+]
+
+
+def call_site():
+    """
+    The innermost frame of project code (outside this module and the query
+    observers' execute wrappers) on the stack, or else of code outside
+    django.db, as ``path:line in function``.
+    """
+    frames = traceback.extract_stack()[:-2]
+    base_dir = str(settings.BASE_DIR)
+    fallback = None
+    for frame in reversed(frames):
+        if frame.filename == __file__ or frame.name == 'observe_query':
+            continue
+        if frame.filename.startswith(base_dir) and 'site-packages' not in frame.filename:
+            return f'{os.path.relpath(frame.filename, base_dir)}:{frame.lineno} in {frame.name}'
+        if fallback is None and f'{os.sep}django{os.sep}db{os.sep}' not in frame.filename:
+            fallback = f'{frame.filename}:{frame.lineno} in {frame.name}'
+    return fallback
+
+
+@contextmanager
+def capture_queries():
+    """
+    Record (call site, sql) for each statement run on any database. Savepoint
+    statements are left out: they only appear because each test runs in a
+    transaction, where the views' atomic blocks become savepoints.
+    """
+    queries = []
+
+    def record(execute, sql, params, many, context):
+        if not SAVEPOINT_RE.match(sql):
+            queries.append((call_site(), sql))
+        return execute(sql, params, many, context)
+
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(record))
+        yield queries
+
+
+def by_call_site(queries):
+    grouped = defaultdict(list)
+    for site, sql in queries:
+        grouped[site].append(sql)
+    return grouped
+
+
+def format_queries(queries, sites=None):
+    """The statements grouped by call site, the busiest site first"""
+    grouped = by_call_site(queries)
+    lines = []
+    for site, statements in sorted(grouped.items(), key=lambda item: -len(item[1])):
+        if sites is not None and site not in sites:
+            continue
+        lines.append(f'  {site}: {len(statements)} queries')
+        lines.extend(f'      {sql}' for sql in statements)
+    return '\n'.join(lines)
+
+
+def jpeg_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (4, 4), 'white').save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+class Dataset:
+    """
+    One user of each role, plus rows added by ``grow``. Each call to
+    ``grow`` returns fresh targets, so the calls that change or delete
+    them can be repeated.
+    """
+    STATUSES = ('pending', 'approved', 'rejected', 'price_proposed', 'in_progress', 'completed')
+
+    def __init__(self):
+        self.serial = itertools.count()
+        self.users = {'anonymous': None}
+        for role in SIGNED_IN:
+            email = f'{role}@example.com'
+            self.users[role] = CustomUser.objects.create_user(
+                email=email, username=email, password='password', role=role
+            )
+        self.contractor = Contractor.objects.create(
+            user=self.users['contractor'], specialization='General', experience_years=5, license_number='L-0'
+        )
+
+    def create_users(self, count, role):
+        serial = next(self.serial)
+        return CustomUser.objects.bulk_create([
+            CustomUser(email=f'{role}-{serial}-{index}@example.com', username=f'{role}-{serial}-{index}',
+                       first_name='Test', last_name=f'User {index}', role=role)
+            for index in range(count)
+        ])
+
+    def grow(self, size, role):
+        """
+        Add ``size`` users, contractors and properties of each status. The
+        properties returned as targets have ``size`` images, offers and
+        completion images each.
+        """
+        users = self.create_users(size, 'user')
+        contractors = Contractor.objects.bulk_create([
+            Contractor(user=user, specialization='General', experience_years=index, license_number=f'L-{user.pk}')
+            for index, user in enumerate(self.create_users(size, 'contractor'))
+        ])
+        properties = Property.objects.bulk_create([
+            Property(
+                homeowner=self.users['user'],
+                title=f'{status} property {index}',
+                description='Test property',
+                address='King Fahd Road',
+                city='Riyadh',
+                latitude=Decimal('24.713600'),
+                longitude=Decimal('46.675300'),
+                plot_number='1',
+                property_type='house',
+                size=Decimal('250.00'),
+                condition='FAIR',
+                status=status,
+                work_areas=['kitchen', 'plumbing'],
+                assigned_contractor=self.contractor if status not in ('pending', 'approved') else None,
+                completion_note='Done' if status == 'completed' else '',
+            )
+            for status in self.STATUSES
+            for index in range(size)
+        ])
+        PropertyImage.objects.bulk_create([
+            PropertyImage(property=property_obj, image='properties/test.jpg', is_thumbnail=index == 0, order=index)
+            for property_obj in properties
+            for index in range(size)
+        ])
+        CompletionImage.objects.bulk_create([
+            CompletionImage(property=property_obj, image='completion_images/test.jpg')
+            for property_obj in properties if property_obj.status == 'completed'
+            for index in range(size)
+        ])
+        offers = PriceOffer.objects.bulk_create([
+            PriceOffer(property=property_obj, contractor=contractor, amount=Decimal('1000'))
+            for property_obj in properties
+            for contractor in [self.contractor] + contractors[1:]
+        ])
+        evaluations = EvaluationRequest.objects.bulk_create([
+            EvaluationRequest(property=property_obj, contractor=self.contractor)
+            for property_obj in properties
+        ])
+
+        targets = {'serial': next(self.serial), 'user': users[0].pk, 'contractor': contractors[0].pk}
+        for status in self.STATUSES:
+            targets[status] = next(p.pk for p in properties if p.status == status)
+        targets['offer'] = next(
+            offer.pk for offer in offers
+            if offer.property_id == targets['price_proposed'] and offer.contractor_id == self.contractor.pk
+        )
+        targets['evaluation'] = evaluations[0].pk
+
+        caller = self.users[role]
+        if caller is not None:
+            targets['email'] = caller.email
+            targets.update(issue_tokens(caller))
+            targets['upload'] = self.create_upload(caller, b'').pk
+            targets['committed_upload'] = self.create_upload(caller, jpeg_bytes(), status='committed').pk
+        else:
+            targets['email'] = self.users['user'].email
+            targets['upload'] = targets['committed_upload'] = uuid.uuid4()
+            targets['refresh'] = ''
+        return targets
+
+    def create_upload(self, owner, content, status='open'):
+        session = UploadSession.objects.create(
+            owner=owner, filename='photo.jpg', size=len(content) or 4, received=len(content), status=status
+        )
+        os.makedirs(settings.UPLOAD_SESSION_ROOT, exist_ok=True)
+        with open(session.path, 'wb') as part:
+            part.write(content)
+        return session
+
+    def call(self, urlconf, route, role, size):
+        """Grow the dataset, make the call and return the response and the queries it ran"""
+        targets = self.grow(size, role)
+        client = APIClient()
+        if 'token' in targets:
+            client.credentials(HTTP_AUTHORIZATION=f"Token {targets['token']}")
+        data = route.data(targets) if callable(route.data) else route.data
+        options = dict(route.options or {})
+        if isinstance(data, dict) and 'format' not in options:
+            options['format'] = 'json'
+        # Measure the uncached path of cached endpoints. The token issued
+        # above stays cached as not revoked, as it is after a login.
+        invalidate_showcase()
+        invalidate_facets()
+        with capture_queries() as queries:
+            response = getattr(client, route.method)(route_path(urlconf, route, targets), data, **options)
+        return response, queries
+
+
+@pytest.fixture
+def dataset(db, settings, tmp_path):
+    settings.PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+    settings.MEDIA_ROOT = str(tmp_path / 'media')
+    settings.UPLOAD_SESSION_ROOT = str(tmp_path / 'upload_sessions')
+    settings.METRICS_DIR = str(tmp_path / 'metrics')
+    settings.SLOW_QUERY_LOG_DIR = str(tmp_path / 'slow_queries')
+    return Dataset()
+
+
+@pytest.mark.parametrize('urlconf, route, role', CASES)
+def test_query_count_is_constant_and_within_budget(urlconf, route, role, dataset, settings):
+    settings.ROOT_URLCONF = urlconf
+    small, small_queries = dataset.call(urlconf, route, role, SMALL)
+    large, large_queries = dataset.call(urlconf, route, role, LARGE)
+
+    if role in route.succeeds_for:
+        for response in (small, large):
+            assert response.status_code < 400, (
+                f'{route.method.upper()} {route.path} as {role} failed with '
+                f'{response.status_code}: {response.content[:500]!r}'
+            )
+
+    small_sites = Counter(site for site, sql in small_queries)
+    large_sites = Counter(site for site, sql in large_queries)
+    grown = {site for site in large_sites if large_sites[site] != small_sites[site]}
+    assert len(large_queries) == len(small_queries), (
+        f'{route.method.upper()} {route.path} as {role} ran {len(small_queries)} queries with '
+        f'{SMALL} rows and {len(large_queries)} with {LARGE}. Call sites that changed:\n'
+        + '\n'.join(f'  {site}: {small_sites[site]} -> {large_sites[site]}' for site in grown)
+        + f'\nStatements with {LARGE} rows:\n' + format_queries(large_queries, grown)
+    )
+    assert len(large_queries) <= route.budget, (
+        f'{route.method.upper()} {route.path} as {role} ran {len(large_queries)} queries, '
+        f'over its budget of {route.budget}:\n' + format_queries(large_queries)
+    )
+
+
+@pytest.mark.parametrize('urlconf', URLCONFS)
+def test_every_route_has_a_budget(urlconf):
+    covered = {resolved_route(urlconf, route) for route in ROUTES}
+    missing = [
+        pattern for pattern in iter_patterns(urlconf)
+        if pattern not in covered and pattern not in SHADOWED[urlconf]
+    ]
+    assert not missing, f'Routes of {urlconf} without a query budget: {missing}'
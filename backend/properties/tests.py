@@ -1,3 +1,1747 @@
-from django.test import TestCase
+import base64
+import datetime
+import hashlib
+import io
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from decimal import Decimal
+from importlib import import_module
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import DatabaseError, OperationalError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import search
+from backend.urls import router_views
+
+from .authentication import is_revoked, issue_tokens
+from .caching import invalidate_facets, invalidate_showcase
+from .db_routers import PrimaryReplicaRouter, replica_reads
+from .images import build_srcset, generate_variants, schedule_image_variants
+from .identity import Identity
+from .management.commands import loadtest
+from .metrics import MetricsFile, collect
+from .logs import BackgroundHandler, JsonFormatter, WorkerFileHandler, worker_log_path
+from .middleware import IdentityMiddleware
+from .models import (
+    CustomUser, Property, Contractor, PriceOffer, PropertyImage, CompletionImage, PropertyWorkArea, UploadSession
+)
+from .permissions import IsContractor
+from .storage import image_storage, store_blobs
+from .transactions import write_transaction
+from .uploads import UploadError, claim_uploads, write_chunk
+from .views import PropertyViewSet, PriceOfferViewSet
+
+
+FULL_SCAN_RE = re.compile(r'^SCAN (?!CONSTANT ROW)')
+
+
+def create_user(email, role='user'):
+    return CustomUser.objects.create_user(email=email, username=email, password='password', role=role)
+
+
+def create_property(homeowner, **fields):
+    values = {
+        'title': 'Villa', 'description': 'Test property', 'address': 'King Fahd Road', 'city': 'Riyadh',
+        'latitude': Decimal('24.713600'), 'longitude': Decimal('46.675300'), 'plot_number': '1',
+        'property_type': 'house', 'size': Decimal('250.00'), 'condition': 'FAIR', 'status': 'pending',
+    }
+    values.update(fields)
+    return Property.objects.create(homeowner=homeowner, **values)
+
+
+def auth(user):
+    return {'HTTP_AUTHORIZATION': f"Token {issue_tokens(user)['token']}"}
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite specific')
+class QueryPlanTests(TestCase):
+    """
+    Run EXPLAIN QUERY PLAN on every statement issued while evaluating the
+    querysets built by the viewsets, and fail on any full table scan.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.homeowner = create_user('owner@example.com', 'user')
+        cls.admin = create_user('admin@example.com', 'admin')
+        contractor_user = create_user('contractor@example.com', 'contractor')
+        cls.contractor = Contractor.objects.create(
+            user=contractor_user, specialization='General', experience_years=5, license_number='L-1'
+        )
+
+        for status in ['pending', 'approved', 'price_proposed', 'in_progress', 'completed']:
+            property_obj = Property.objects.create(
+                homeowner=cls.homeowner,
+                title=f'{status} property',
+                description='Test property',
+                address='King Fahd Road',
+                city='Riyadh',
+                latitude=Decimal('24.713600'),
+                longitude=Decimal('46.675300'),
+                plot_number='1',
+                property_type='house',
+                size=Decimal('250.00'),
+                condition='FAIR',
+                status=status,
+                assigned_contractor=cls.contractor if status != 'pending' else None,
+            )
+            PropertyImage.objects.create(property=property_obj, image='properties/test.jpg', is_thumbnail=True)
+            PriceOffer.objects.create(property=property_obj, contractor=cls.contractor, amount=Decimal('1000'))
+            if status == 'completed':
+                CompletionImage.objects.create(property=property_obj, image='completion_images/test.jpg')
+
+    def build_queryset(self, viewset_class, user=None, params=None):
+        request = APIRequestFactory().get('/', params or {})
+        if user is not None:
+            force_authenticate(request, user=user)
+        view = viewset_class(action_map={'get': 'list'})
+        view.args, view.kwargs, view.format_kwarg = (), {}, None
+        IdentityMiddleware(lambda request: None)(request)
+        view.request = view.initialize_request(request)
+        view.perform_authentication(view.request)
+        return view.get_queryset()
+
+    def explain(self, queryset):
+        """Evaluate the queryset and return the plan of every statement it ran"""
+        statements = []
+
+        def capture(execute, sql, params, many, context):
+            statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(capture):
+            list(queryset)
+
+        plans = []
+        with connection.cursor() as cursor:
+            for sql, params in statements:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plans.append((sql, [row[3] for row in cursor.fetchall()]))
+        return plans
+
+    def assertNoFullScan(self, queryset):
+        for sql, plan in self.explain(queryset):
+            scans = [step for step in plan if FULL_SCAN_RE.match(step)]
+            self.assertFalse(scans, f'Full table scan in:\n{sql}\nPlan: {plan}')
+
+    def test_property_querysets_use_indexes(self):
+        # The unfiltered admin list is intentionally a whole-table read
+        cases = [
+            (None, {'status': 'completed'}),
+            (self.homeowner, {}),
+            (self.homeowner, {'view': 'compact'}),
+            (self.contractor.user, {}),
+            (self.contractor.user, {'status': 'approved'}),
+            (self.admin, {'status': 'pending'}),
+            (self.admin, {'status': 'completed'}),
+        ]
+        for user, params in cases:
+            with self.subTest(user=user, params=params):
+                self.assertNoFullScan(self.build_queryset(PropertyViewSet, user, params))
+
+    def test_price_offer_querysets_use_indexes(self):
+        for user in [self.homeowner, self.contractor.user]:
+            with self.subTest(user=user):
+                self.assertNoFullScan(self.build_queryset(PriceOfferViewSet, user))
+
+
+class PropertyQuerysetTests(TestCase):
+    """PropertyViewSet.get_base_queryset loads everything the serializers read"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.homeowner = create_user('owner@example.com')
+        cls.admin = create_user('admin@example.com', 'admin')
+        cls.contractor = Contractor.objects.create(
+            user=create_user('contractor@example.com', 'contractor'),
+            specialization='General', experience_years=5, license_number='L-1'
+        )
+
+    def add_properties(self, count):
+        for _ in range(count):
+            for status in ('pending', 'completed'):
+                property_obj = create_property(
+                    self.homeowner, status=status, completion_date=timezone.now(),
+                    assigned_contractor=self.contractor if status == 'completed' else None,
+                )
+                PropertyImage.objects.create(property=property_obj, image='properties/test.jpg', is_thumbnail=True)
+                CompletionImage.objects.create(property=property_obj, image='completion_images/test.jpg')
+                PriceOffer.objects.create(property=property_obj, contractor=self.contractor, amount=Decimal('1000'))
+
+    def count_queries(self, path):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, **auth(self.admin))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        paths = [
+            '/api/properties/',
+            '/api/properties/?status=completed',
+            '/api/properties/completed/',
+            '/api/properties/admin_requests/',
+            '/api/properties/?view=compact',
+        ]
+        self.add_properties(1)
+        few = {path: self.count_queries(path) for path in paths}
+        self.add_properties(4)
+        many = {path: self.count_queries(path) for path in paths}
+        self.assertEqual(many, few)
+        # The properties, then their images, completion images and pending offers
+        self.assertEqual(few['/api/properties/completed/'], 4)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.homeowner = create_user('owner@example.com')
+        cls.admin = create_user('admin@example.com', 'admin')
+        now = timezone.now()
+        cls.properties = [create_property(cls.homeowner, title=f'Property {index}') for index in range(5)]
+        # Two completed on the same day and two never dated, which sort last
+        cls.completed = [
+            create_property(cls.homeowner, status='completed', completion_date=completion_date)
+            for completion_date in (now - datetime.timedelta(days=2), None, now, now, None)
+        ]
+
+    def collect(self, path, user):
+        """Follow the next links from ``path``, returning the ids of every page"""
+        pages = []
+        while path:
+            response = self.client.get(path, **auth(user))
+            self.assertEqual(response.status_code, 200)
+            pages.append([row['id'] for row in response.json()['results']])
+            path = response.json()['next']
+        return pages
+
+    def test_pages_cover_the_list_once_in_order(self):
+        pages = self.collect('/api/properties/?page_size=2', self.homeowner)
+        everything = sorted((obj.pk for obj in self.properties + self.completed), reverse=True)
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 2, 2])
+        self.assertEqual(sum(pages, []), everything)
+
+    def test_null_keys_sort_last(self):
+        pages = self.collect('/api/properties/completed/?page_size=2', self.admin)
+        dated = sorted(
+            (obj for obj in self.completed if obj.completion_date),
+            key=lambda obj: (obj.completion_date, obj.pk), reverse=True
+        )
+        undated = sorted((obj.pk for obj in self.completed if not obj.completion_date), reverse=True)
+        self.assertEqual(sum(pages, []), [obj.pk for obj in dated] + undated)
+
+    def test_invalid_cursors_are_not_found(self):
+        def encode(value):
+            return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip('=')
+
+        cursors = ['not base64!', encode({'a': 1}), encode([{'a': 1}]), encode(['abc']), encode([1, 2])]
+        for path, cursors in (
+            ('/api/properties/', cursors),
+            ('/api/properties/completed/', [encode(['yesterday', 1]), encode([[1], 1]), encode([None, 'x'])]),
+        ):
+            for cursor in cursors:
+                with self.subTest(path=path, cursor=cursor):
+                    response = self.client.get(path, {'cursor': cursor}, **auth(self.admin))
+                    self.assertEqual(response.status_code, 404)
+                    self.assertEqual(response.json(), {'detail': 'Invalid cursor'})
+
+
+class ShowcaseCacheTests(TestCase):
+    path = '/api/properties/completed-list/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.homeowner = create_user('owner@example.com')
+        cls.completed = create_property(
+            cls.homeowner, title='Finished villa', status='completed', completion_date=timezone.now()
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def titles(self):
+        response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 200)
+        return [row['title'] for row in response.json()]
+
+    def test_unchanged_showcase_is_not_modified(self):
+        response = self.client.get(self.path)
+        etag = response['ETag']
+        self.assertEqual(response['Cache-Control'], 'public, no-cache')
+
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_property(self.homeowner, status='completed', completion_date=timezone.now())
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_showcase_is_cached_until_completed_properties_change(self):
+        self.assertEqual(self.titles(), ['Finished villa'])
+        # update() sends no signals, so the cached copy is still served
+        Property.objects.filter(pk=self.completed.pk).update(title='Renamed')
+        self.assertEqual(self.titles(), ['Finished villa'])
+        # Reviewing a pending property leaves the showcase alone
+        pending = create_property(self.homeowner)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            pending.status = 'approved'
+            pending.save()
+        self.assertNotIn(invalidate_showcase, callbacks)
+        self.assertEqual(self.titles(), ['Finished villa'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.completed.refresh_from_db()
+            self.completed.save()
+        self.assertEqual(self.titles(), ['Renamed'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            pending.status = 'completed'
+            pending.completion_date = timezone.now() - datetime.timedelta(days=1)
+            pending.save()
+        self.assertEqual(self.titles(), ['Renamed', 'Villa'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            CompletionImage.objects.create(property=pending, image='completion_images/test.jpg')
+        self.assertEqual(
+            self.client.get(self.path).json()[1]['completion_images_count'], 1
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.completed.delete()
+        self.assertEqual(self.titles(), ['Villa'])
+
+    def test_showcase_is_invalidated_only_when_the_change_commits(self):
+        self.assertEqual(self.titles(), ['Finished villa'])
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.completed.title = 'Renamed'
+            self.completed.save()
+            # Until the change commits other readers see the old rows, keep the old version
+            self.assertEqual(self.titles(), ['Finished villa'])
+        self.assertEqual(self.titles(), ['Finished villa'])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.titles(), ['Renamed'])
+
+
+class SparseFieldsetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('admin@example.com', 'admin')
+        homeowner = create_user('owner@example.com')
+        for _ in range(3):
+            property_obj = create_property(homeowner, description='A very long description')
+            PropertyImage.objects.create(property=property_obj, image='properties/a.jpg', is_thumbnail=True)
+            PropertyImage.objects.create(property=property_obj, image='properties/b.jpg', order=1)
+
+    def get(self, params):
+        """The rows of both list paths and the statements each of them ran"""
+        results = []
+        for path in ('/api/properties/', '/api/properties/admin_requests/'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(path, params, **auth(self.admin))
+            self.assertEqual(response.status_code, 200)
+            results.append((response.json(), [query['sql'] for query in queries]))
+        return results
+
+    def test_compact_view_loads_only_the_thumbnail(self):
+        for rows, queries in self.get({'view': 'compact'}):
+            self.assertEqual(len(queries), 2)
+            self.assertNotIn('"description"', queries[0])
+            self.assertNotIn('homeowner', rows[0])
+            self.assertNotIn('images', rows[0])
+            self.assertEqual(rows[0]['thumbnail']['image'].rsplit('/', 1)[-1], 'a.jpg')
+
+    def test_fields_skip_the_relations_they_leave_out(self):
+        for rows, queries in self.get({'fields': 'id,title'}):
+            self.assertEqual(len(queries), 1)
+            self.assertEqual(set(rows[0]), {'id', 'title'})
+
+    def test_expand_loads_the_requested_relations(self):
+        for rows, queries in self.get({'fields': 'id', 'expand': 'homeowner,images'}):
+            # The homeowner is joined in, the images take one more query
+            self.assertEqual(len(queries), 2)
+            self.assertEqual(set(rows[0]), {'id', 'homeowner', 'images'})
+            self.assertEqual(rows[0]['homeowner']['email'], 'owner@example.com')
+            self.assertEqual(len(rows[0]['images']), 2)
+
+
+class GeoFilterTests(TestCase):
+    origin = (24.7136, 46.6753)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('admin@example.com', 'admin')
+        homeowner = create_user('owner@example.com')
+        lat, lng = cls.origin
+        # Offsets in degrees; one degree of latitude is about 111.2 km
+        cls.places = {
+            name: create_property(
+                homeowner, title=name,
+                latitude=Decimal(f'{lat + dlat:.6f}'), longitude=Decimal(f'{lng + dlng:.6f}'),
+            )
+            for name, dlat, dlng in [
+                ('here', 0, 0),
+                ('5km north', 0.045, 0),
+                ('9km south', -0.081, 0),
+                # Inside the 10 km bounding box but 10.9 km away
+                ('box corner', 0.07, 0.075),
+                ('15km north', 0.135, 0),
+            ]
+        }
+
+    def titles(self, params):
+        response = self.client.get('/api/properties/', params, **auth(self.admin))
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row['title'] for row in response.json()]
+
+    def test_near_orders_by_distance_within_the_radius(self):
+        near = '%s,%s' % self.origin
+        self.assertEqual(self.titles({'near': near}), ['here', '5km north', '9km south'])
+        self.assertEqual(
+            self.titles({'near': near, 'radius_km': 20}),
+            ['here', '5km north', '9km south', 'box corner', '15km north']
+        )
+        self.assertEqual(self.titles({'near': near, 'radius_km': 1}), ['here'])
+
+    def test_near_pages_follow_the_distance(self):
+        path = '/api/properties/?near=%s,%s&radius_km=20&page_size=2' % self.origin
+        titles = []
+        while path:
+            page = self.client.get(path, **auth(self.admin)).json()
+            titles += [row['title'] for row in page['results']]
+            path = page['next']
+        self.assertEqual(titles, ['here', '5km north', '9km south', 'box corner', '15km north'])
+
+    def test_bbox(self):
+        lat, lng = self.origin
+        bbox = f'{lng - 0.01},{lat - 0.1},{lng + 0.01},{lat + 0.05}'
+        self.assertEqual(sorted(self.titles({'bbox': bbox})), ['5km north', '9km south', 'here'])
+
+    def test_invalid_locations_are_rejected(self):
+        for params in ({'near': '24.7'}, {'near': '95,46'}, {'near': '24.7,46.6', 'radius_km': 0},
+                       {'near': '24.7,46.6', 'radius_km': 'far'}, {'bbox': '1,2,3'}, {'bbox': '47,25,46,24'}):
+            with self.subTest(params=params):
+                response = self.client.get('/api/properties/', params, **auth(self.admin))
+                self.assertEqual(response.status_code, 400)
+
+    def test_non_finite_and_out_of_range_boxes_are_rejected(self):
+        # Anonymous clients can list properties, and the filter runs before scoping
+        for bbox in ('nan,nan,nan,nan', '0,0,1,inf', '-inf,0,1,1', '0,-1e9,1,1e9', '0,-91,1,1', '-181,0,1,1',
+                     '0,0,181,1', '0,0,1,90.5'):
+            with self.subTest(bbox=bbox):
+                response = self.client.get('/api/properties/', {'bbox': bbox})
+                self.assertEqual(response.status_code, 400)
+        for near in ('nan,46.6', '24.7,inf', '24.7,-181'):
+            with self.subTest(near=near):
+                response = self.client.get('/api/properties/', {'near': near})
+                self.assertEqual(response.status_code, 400)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'The full-text index is SQLite specific')
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('admin@example.com', 'admin')
+        cls.homeowner = create_user('owner@example.com')
+        cls.school = create_property(cls.homeowner, title='مَدْرَسَة الأمل', district='النخيل')
+        cls.villas = [create_property(cls.homeowner, title=f'Villa {index}') for index in range(3)]
+        cls.villa_in_text = create_property(cls.homeowner, title='Flat', description='Next to a villa')
+
+    def search(self, query, **params):
+        response = self.client.get('/api/properties/', {'q': query, **params}, **auth(self.admin))
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def indexed_ids(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT rowid FROM {search.FTS_TABLE}')
+            return {row[0] for row in cursor.fetchall()}
+
+    def test_normalize_arabic(self):
+        self.assertEqual(search.normalize_arabic('مَدْرَسَة'), 'مدرسه')
+        self.assertEqual(search.normalize_arabic('أحمد إبراهيم آمنة ٱلله'), 'احمد ابراهيم امنه الله')
+        self.assertEqual(search.normalize_arabic('مستشفى'), 'مستشفي')
+        self.assertEqual(search.normalize_arabic('جمـــيل'), 'جميل')
+        self.assertEqual(search.normalize_arabic('VILLA'), 'villa')
+        self.assertEqual(search.normalize_arabic(None), '')
+
+    def test_spelling_variants_match(self):
+        for query in ('مدرسة', 'مدرسه', 'مَدرَسة', 'الامل', 'الأمل', 'النخيل'):
+            with self.subTest(query=query):
+                self.assertEqual([row['id'] for row in self.search(query)], [self.school.pk])
+
+    def test_title_matches_rank_first(self):
+        ids = [row['id'] for row in self.search('vil')]
+        self.assertEqual(ids, sorted(obj.pk for obj in self.villas) + [self.villa_in_text.pk])
+
+    def test_search_joins_the_index_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.search('villa')
+        sql = next(query['sql'] for query in queries if ' MATCH ' in query['sql'])
+        self.assertEqual(sql.count(' MATCH '), 1)
+        self.assertIn(f'INNER JOIN "{search.FTS_TABLE}"', sql)
+        self.assertNotIn('(SELECT', sql)
+
+    def test_pages_follow_the_rank(self):
+        path, ids = f'/api/properties/?q=villa&page_size=2', []
+        while path:
+            page = self.client.get(path, **auth(self.admin)).json()
+            ids += [row['id'] for row in page['results']]
+            path = page['next']
+        self.assertEqual(ids, [row['id'] for row in self.search('villa')])
+        self.assertEqual(len(ids), 4)
+
+    def test_index_follows_saves_and_deletes(self):
+        villa = self.villas[0]
+        villa.title = 'Palace'
+        villa.save()
+        self.assertEqual([row['id'] for row in self.search('palace')], [villa.pk])
+        self.assertNotIn(villa.pk, [row['id'] for row in self.search('villa')])
+
+        villa.delete()
+        self.assertEqual(self.search('palace'), [])
+        self.assertNotIn(villa.pk, self.indexed_ids())
+
+
+class WorkAreaFilterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('admin@example.com', 'admin')
+        homeowner = create_user('owner@example.com')
+        cls.both = create_property(homeowner, title='both', work_areas=['plumbing', 'roof'])
+        cls.plumbing = create_property(homeowner, title='plumbing', work_areas=['plumbing', 'kitchen'])
+        cls.roof = create_property(homeowner, title='roof', work_areas=['roof'])
+        cls.neither = create_property(homeowner, title='neither', work_areas=['kitchen'])
+
+    def titles(self, params):
+        response = self.client.get('/api/properties/', params, **auth(self.admin))
+        self.assertEqual(response.status_code, 200, response.content)
+        return sorted(row['title'] for row in response.json())
+
+    def test_any_and_all(self):
+        self.assertEqual(self.titles({'work_areas': 'plumbing,roof'}), ['both', 'plumbing', 'roof'])
+        self.assertEqual(
+            self.titles({'work_areas': 'plumbing,roof', 'work_areas_match': 'any'}), ['both', 'plumbing', 'roof']
+        )
+        self.assertEqual(self.titles({'work_areas': 'roof, plumbing,', 'work_areas_match': 'all'}), ['both'])
+        self.assertEqual(self.titles({'work_areas': 'roof', 'work_areas_match': 'all'}), ['both', 'roof'])
+
+    def test_invalid_parameters_are_rejected(self):
+        for params in ({'work_areas': 'roof,pool'}, {'work_areas': 'roof', 'work_areas_match': 'some'}):
+            with self.subTest(params=params):
+                response = self.client.get('/api/properties/', params, **auth(self.admin))
+                self.assertEqual(response.status_code, 400)
+
+    def test_entries_follow_saves(self):
+        self.roof.work_areas = ['plumbing', 'electrical']
+        self.roof.save()
+        self.assertEqual(
+            sorted(self.roof.work_area_entries.values_list('area', flat=True)), ['electrical', 'plumbing']
+        )
+        self.assertEqual(self.titles({'work_areas': 'roof'}), ['both'])
+        self.assertEqual(self.titles({'work_areas': 'electrical,plumbing', 'work_areas_match': 'all'}), ['roof'])
+
+    def test_data_migration_populates_entries(self):
+        populate_work_areas = import_module('properties.migrations.0012_propertyworkarea').populate_work_areas
+
+        PropertyWorkArea.objects.all().delete()
+        populate_work_areas(apps, None)
+        self.assertEqual(
+            sorted(PropertyWorkArea.objects.values_list('property__title', 'area')),
+            [('both', 'plumbing'), ('both', 'roof'), ('neither', 'kitchen'),
+             ('plumbing', 'kitchen'), ('plumbing', 'plumbing'), ('roof', 'roof')]
+        )
+
+
+class FacetTests(TestCase):
+    origin = (24.7136, 46.6753)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('admin@example.com', 'admin')
+        homeowner = create_user('owner@example.com')
+        lat, lng = cls.origin
+        create_property(homeowner, title='Villa', city='Riyadh', district='Olaya', work_areas=['roof'])
+        create_property(
+            homeowner, title='Villa', city='Riyadh', district='Malqa', property_type='apartment',
+            work_areas=['roof', 'plumbing'], latitude=Decimal(f'{lat + 0.135:.6f}'),
+        )
+        create_property(
+            homeowner, title='Flat', city='Jeddah', condition='GOOD', work_areas=['kitchen'],
+            latitude=Decimal('21.485800'), longitude=Decimal('39.192500'),
+        )
+
+    def facets(self, params=None):
+        response = self.client.get('/api/properties/facets/', params or {}, **auth(self.admin))
+        self.assertEqual(response.status_code, 200, response.content)
+        return {
+            name: {entry['value']: entry['count'] for entry in entries}
+            for name, entries in response.json().items()
+        }
+
+    def test_counts(self):
+        facets = self.facets()
+        self.assertEqual(facets['city'], {'Riyadh': 2, 'Jeddah': 1})
+        self.assertEqual(facets['district'], {'Olaya': 1, 'Malqa': 1})
+        self.assertEqual(facets['property_type'], {'house': 2, 'apartment': 1})
+        self.assertEqual(facets['condition'], {'FAIR': 2, 'GOOD': 1})
+        self.assertEqual(facets['status'], {'pending': 3})
+        self.assertEqual(facets['work_areas'], {'roof': 2, 'plumbing': 1, 'kitchen': 1})
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'The full-text index is SQLite specific')
+    def test_counts_follow_the_search(self):
+        facets = self.facets({'q': 'villa'})
+        self.assertEqual(facets['city'], {'Riyadh': 2})
+        self.assertEqual(facets['property_type'], {'house': 1, 'apartment': 1})
+        self.assertEqual(facets['work_areas'], {'roof': 2, 'plumbing': 1})
+
+    def test_counts_follow_the_location(self):
+        facets = self.facets({'near': '%s,%s' % self.origin})
+        self.assertEqual(facets['district'], {'Olaya': 1})
+        self.assertEqual(facets['work_areas'], {'roof': 1})
+        facets = self.facets({'near': '%s,%s' % self.origin, 'radius_km': 20, 'q': 'villa'})
+        self.assertEqual(facets['district'], {'Olaya': 1, 'Malqa': 1})
+        self.assertEqual(facets['work_areas'], {'roof': 2, 'plumbing': 1})
+
+    def test_counts_are_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.facets({'q': 'villa', 'near': '%s,%s' % self.origin})
+        self.assertEqual(len([query for query in queries if 'UNION ALL' in query['sql']]), 1)
+
+    def test_counts_are_invalidated_when_the_change_commits(self):
+        cache.clear()
+        self.assertEqual(self.facets()['city'], {'Riyadh': 2, 'Jeddah': 1})
+        with self.captureOnCommitCallbacks() as callbacks:
+            create_property(create_user('other@example.com'), city='Dammam')
+            # Other readers do not see the new row yet, the cached counts stay
+            self.assertEqual(self.facets()['city'], {'Riyadh': 2, 'Jeddah': 1})
+        self.assertIn(invalidate_facets, callbacks)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.facets()['city'], {'Riyadh': 2, 'Jeddah': 1, 'Dammam': 1})
+
+
+class ImageVariantTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('admin@example.com', 'admin')
+        cls.property = create_property(create_user('owner@example.com'))
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media.name, IMAGE_VARIANT_WIDTHS=(320, 640, 1280))
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def upload(self, width, height, orientation=None):
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera maker'
+        if orientation is not None:
+            exif[0x0112] = orientation
+        buffer = io.BytesIO()
+        Image.new('RGB', (width, height), 'red').save(buffer, 'JPEG', exif=exif)
+        image = PropertyImage(property=self.property)
+        image.image.save('photo.jpg', ContentFile(buffer.getvalue()))
+        return image
+
+    def open_variant(self, path):
+        with default_storage.open(path, 'rb') as variant_file:
+            variant = Image.open(variant_file)
+            variant.load()
+        return variant
+
+    def test_variants_are_resized_without_exif(self):
+        # Orientation 6 is stored sideways: the photo is 400 wide once turned
+        image = self.upload(800, 400, orientation=6)
+        generate_variants(PropertyImage, image.pk)
+        image.refresh_from_db()
+
+        self.assertEqual(set(image.variants), {'webp', 'jpeg'})
+        for name, widths in image.variants.items():
+            self.assertEqual(list(widths), ['320'])
+            variant = self.open_variant(widths['320'])
+            self.assertEqual(variant.format, name.upper())
+            self.assertEqual(variant.size, (320, 640))
+            self.assertEqual(dict(variant.getexif()), {})
+
+    def test_small_images_keep_their_width(self):
+        image = self.upload(200, 100)
+        generate_variants(PropertyImage, image.pk)
+        image.refresh_from_db()
+        self.assertEqual({name: list(widths) for name, widths in image.variants.items()},
+                         {'webp': ['200'], 'jpeg': ['200']})
+
+    def test_srcset_falls_back_to_the_original(self):
+        image = self.upload(800, 600)
+        self.assertEqual(build_srcset(image), {'original': image.image.url})
+
+        generate_variants(PropertyImage, image.pk)
+        image.refresh_from_db()
+        srcset = build_srcset(image)
+        self.assertEqual({name: list(widths) for name, widths in srcset.items()},
+                         {'webp': ['320', '640'], 'jpeg': ['320', '640']})
+        self.assertTrue(srcset['webp']['640'].endswith('-640w.webp'))
+
+        response = self.client.get(f'/api/properties/{self.property.pk}/', **auth(self.admin))
+        self.assertEqual(response.json()['images'][0]['srcset']['jpeg']['320'],
+                         'http://testserver' + srcset['jpeg']['320'])
+
+    @override_settings(IMAGE_VARIANTS_ASYNC=False)
+    def test_variants_are_generated_after_commit(self):
+        image = self.upload(800, 600)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            schedule_image_variants([image])
+            image.refresh_from_db()
+            self.assertEqual(image.variants, {})
+        self.assertEqual(len(callbacks), 1)
+        image.refresh_from_db()
+        self.assertEqual(set(image.variants), {'webp', 'jpeg'})
+
+
+class ContentAddressedStorageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.property = create_property(create_user('owner@example.com'))
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def image(self, data, name='photo.JPG', save=True):
+        image = PropertyImage(property=self.property)
+        image.image.save(name, ContentFile(data), save=save)
+        return image
+
+    def test_blobs_are_named_after_their_content(self):
+        image = self.image(b'first image')
+        digest = hashlib.sha256(b'first image').hexdigest()
+        self.assertEqual(image.image.name, f'blobs/{digest[:2]}/{digest[2:4]}/{digest}.jpg')
+        self.assertTrue(image_storage.exists(image.image.name))
+        self.assertEqual(os.listdir(image_storage.path('blobs/tmp')), [])
+
+    def test_identical_uploads_share_a_blob(self):
+        first, second = self.image(b'same bytes', 'a.jpg'), self.image(b'same bytes', 'b.jpg')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, self.image(b'other bytes', 'c.jpg').image.name)
+        directory = os.path.dirname(image_storage.path(first.image.name))
+        self.assertEqual(len(os.listdir(directory)), 1)
+
+    def test_blob_is_deleted_with_its_last_reference(self):
+        first, second = self.image(b'shared'), self.image(b'shared')
+        name = first.image.name
+        default_storage.save('variants/shared-320w.webp', ContentFile(b'variant'))
+        second.variants = {'webp': {'320': 'variants/shared-320w.webp'}}
+        second.save()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(image_storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(image_storage.exists(name))
+        self.assertFalse(default_storage.exists('variants/shared-320w.webp'))
+
+    def test_blob_released_before_its_new_row_is_saved_comes_back(self):
+        save = image_storage._save
+
+        def save_then_release(name, content):
+            # The upload finds the blob, then the release of the last row
+            # using it runs before the new row is written
+            blob_name = save(name, content)
+            while released:
+                released.pop()()
+                self.assertFalse(image_storage.exists(blob_name))
+            return blob_name
+
+        for create in (
+            lambda image: image.save(),
+            lambda image: PropertyImage.objects.bulk_create([image]),
+        ):
+            first = self.image(b'shared')
+            with self.captureOnCommitCallbacks() as released:
+                first.delete()
+            image = PropertyImage(property=self.property, image=ContentFile(b'shared', name='photo.jpg'))
+            with mock.patch.object(image_storage, '_save', save_then_release):
+                create(image)
+            with image_storage.open(image.image.name) as blob:
+                self.assertEqual(blob.read(), b'shared')
+            image.delete()
+
+
+class UploadSessionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.homeowner = create_user('owner@example.com')
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        upload_settings = override_settings(
+            MEDIA_ROOT=os.path.join(root.name, 'media'),
+            UPLOAD_SESSION_ROOT=os.path.join(root.name, 'upload_sessions'),
+        )
+        upload_settings.enable()
+        self.addCleanup(upload_settings.disable)
+        buffer = io.BytesIO()
+        Image.new('RGB', (40, 30), 'blue').save(buffer, 'PNG')
+        self.photo = buffer.getvalue()
+
+    def open_upload(self, size=None):
+        data = {'filename': 'photo.png'} if size is None else {'filename': 'photo.png', 'size': size}
+        response = self.client.post('/api/uploads/', data, **auth(self.homeowner))
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()['id']
+
+    def put(self, upload_id, data, offset):
+        return self.client.put(
+            f'/api/uploads/{upload_id}/', data, content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {offset}-{offset + len(data) - 1}/*', **auth(self.homeowner)
+        )
+
+    def part(self, upload_id):
+        with open(UploadSession.objects.get(pk=upload_id).path, 'rb') as part:
+            return part.read()
+
+    def test_chunks_at_the_wrong_offset_are_rejected_untouched(self):
+        upload_id = self.open_upload()
+        self.assertEqual(self.put(upload_id, b'abcd', 0).json()['received'], 4)
+
+        for offset in (0, 2, 6):
+            with self.subTest(offset=offset):
+                response = self.put(upload_id, b'WXYZ', offset)
+                self.assertEqual(response.status_code, 409)
+                self.assertEqual(response.json()['received'], 4)
+                self.assertEqual(self.part(upload_id), b'abcd')
+
+    def test_a_concurrent_writer_does_not_touch_the_file(self):
+        upload_id = self.open_upload()
+        # Loaded by a request that then waits while another one writes
+        stale = UploadSession.objects.get(pk=upload_id)
+        self.put(upload_id, b'abcd', 0)
+        with self.assertRaises(UploadError):
+            write_chunk(stale, io.BytesIO(b'WX'), 0, 2)
+        self.assertEqual(self.part(upload_id), b'abcd')
+        self.assertEqual(stale.received, 4)
+
+    def test_resume_after_a_partial_write(self):
+        upload_id = self.open_upload(len(self.photo))
+        session = UploadSession.objects.get(pk=upload_id)
+        # The connection drops after 10 of the announced bytes
+        write_chunk(session, io.BytesIO(self.photo[:10]), 0, len(self.photo))
+        self.assertEqual(session.received, 10)
+
+        response = self.client.get(f'/api/uploads/{upload_id}/', **auth(self.homeowner))
+        self.assertEqual(response.json()['received'], 10)
+        response = self.put(upload_id, self.photo[10:], 10)
+        self.assertEqual(response.json()['received'], len(self.photo))
+        self.assertEqual(self.part(upload_id), self.photo)
+
+    def test_writing_a_chunk_keeps_the_session_alive(self):
+        upload_id = self.open_upload(len(self.photo))
+        expiry = datetime.timedelta(hours=settings.UPLOAD_SESSION_EXPIRY_HOURS)
+        # Opened long ago, but the client is still sending chunks
+        UploadSession.objects.filter(pk=upload_id).update(updated_at=timezone.now() - expiry * 2)
+        self.put(upload_id, self.photo[:10], 0)
+        call_command('clear_upload_sessions', stdout=io.StringIO())
+        self.assertTrue(UploadSession.objects.filter(pk=upload_id).exists())
+
+    def test_a_chunk_needs_a_content_length(self):
+        upload_id = self.open_upload()
+        response = self.client.generic(
+            'PUT', f'/api/uploads/{upload_id}/', content_type='application/octet-stream', **auth(self.homeowner)
+        )
+        self.assertEqual(response.status_code, 411)
+        response = self.client.generic(
+            'PUT', f'/api/uploads/{upload_id}/', b'abcd', content_type='application/octet-stream',
+            CONTENT_LENGTH='-4', **auth(self.homeowner)
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(UploadSession.objects.get(pk=upload_id).received, 0)
+
+    @override_settings(UPLOAD_SESSIONS_PER_USER=2)
+    def test_sessions_per_user_are_capped(self):
+        first = self.open_upload()
+        self.open_upload()
+        response = self.client.post('/api/uploads/', {'filename': 'photo.png'}, **auth(self.homeowner))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(UploadSession.objects.filter(owner=self.homeowner).count(), 2)
+
+        self.client.delete(f'/api/uploads/{first}/', **auth(self.homeowner))
+        self.open_upload()
+
+    def test_commit_and_claim(self):
+        upload_id = self.open_upload(len(self.photo))
+        self.put(upload_id, self.photo[:20], 0)
+        response = self.client.post(f'/api/uploads/{upload_id}/commit/', **auth(self.homeowner))
+        self.assertEqual(response.status_code, 400)
+
+        self.put(upload_id, self.photo[20:], 20)
+        response = self.client.post(f'/api/uploads/{upload_id}/commit/', **auth(self.homeowner))
+        self.assertEqual(response.json()['status'], 'committed')
+        self.assertEqual(self.put(upload_id, b'more', len(self.photo)).status_code, 409)
+
+        path = UploadSession.objects.get(pk=upload_id).path
+        opened = []
+        with mock.patch('properties.uploads.File', side_effect=lambda *args, **kwargs: opened.append(
+            File(*args, **kwargs)) or opened[-1]
+        ):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/properties/', {
+                    'title': 'Villa', 'description': 'Uploaded', 'address': 'King Fahd Road', 'city': 'Riyadh',
+                    'latitude': '24.713600', 'longitude': '46.675300', 'plot_number': '1',
+                    'property_type': 'house', 'size': '250.00', 'condition': 'FAIR', 'upload_ids': [upload_id],
+                }, **auth(self.homeowner))
+        self.assertEqual(response.status_code, 201, response.content)
+        image = PropertyImage.objects.get(property_id=response.json()['id'])
+        with image.image.open() as blob:
+            self.assertEqual(blob.read(), self.photo)
+        self.assertTrue(opened[0].closed)
+        self.assertFalse(UploadSession.objects.filter(pk=upload_id).exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_claim_closes_what_it_opened_when_it_fails(self):
+        sessions = [
+            UploadSession.objects.create(owner=self.homeowner, filename='photo.png', status='committed')
+            for _ in range(2)
+        ]
+        os.makedirs(settings.UPLOAD_SESSION_ROOT)
+        with open(sessions[0].path, 'wb') as part:
+            part.write(self.photo)
+        opened = []
+        with mock.patch('properties.uploads.File', side_effect=lambda *args, **kwargs: opened.append(
+            File(*args, **kwargs)) or opened[-1]
+        ):
+            with self.assertRaises(FileNotFoundError):
+                claim_uploads(self.homeowner, [session.pk for session in sessions])
+        self.assertEqual(len(opened), 1)
+        self.assertTrue(opened[0].closed)
+
+
+@unittest.skipUnless(settings.AUTH_TOKEN_MODE == 'jwt', 'Signed tokens are used in AUTH_TOKEN_MODE jwt')
+class JWTAuthenticationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.homeowner = create_user('owner@example.com')
+        cls.other = create_user('other@example.com')
+        contractor_user = create_user('contractor@example.com', 'contractor')
+        cls.contractor = Contractor.objects.create(
+            user=contractor_user, specialization='Roofing', experience_years=5, license_number='L-1'
+        )
+        cls.offers = [
+            PriceOffer.objects.create(
+                property=create_property(owner, status='approved'), contractor=cls.contractor, amount=Decimal('100')
+            )
+            for owner in (cls.homeowner, cls.homeowner, cls.other)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def login(self, email):
+        response = self.client.post('/api/login/', {'email': email, 'password': 'password'})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def bearer(self, token):
+        return {'HTTP_AUTHORIZATION': f'Token {token}'}
+
+    def test_owner_accepts_and_rejects_offers_with_a_login_token(self):
+        tokens = self.login('owner@example.com')
+        # simplejwt writes the user id claim as a string
+        self.assertEqual(AccessToken(tokens['token'])['user_id'], str(self.homeowner.pk))
+
+        accepted, rejected, foreign = self.offers
+        response = self.client.post(f'/api/price-offers/{accepted.pk}/accept/', **self.bearer(tokens['token']))
+        self.assertEqual(response.status_code, 200, response.content)
+        response = self.client.post(f'/api/price-offers/{rejected.pk}/reject/', **self.bearer(tokens['token']))
+        self.assertEqual(response.status_code, 200, response.content)
+        response = self.client.post(f'/api/price-offers/{foreign.pk}/accept/', **self.bearer(tokens['token']))
+        self.assertEqual(response.status_code, 403)
+
+        statuses = dict(PriceOffer.objects.values_list('pk', 'status'))
+        self.assertEqual(
+            [statuses[offer.pk] for offer in self.offers], ['accepted', 'rejected', 'pending']
+        )
+
+    def test_logout_revokes_the_access_and_refresh_tokens(self):
+        tokens = self.login('owner@example.com')
+        response = self.client.post('/api/logout/', {'refresh': tokens['refresh']}, **self.bearer(tokens['token']))
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get('/api/properties/', **self.bearer(tokens['token']))
+        self.assertEqual(response.status_code, 401)
+        response = self.client.post('/api/token/refresh/', {'refresh': tokens['refresh']})
+        self.assertEqual(response.status_code, 401)
+        # The refresh token is also checked against the table, not only the cache
+        cache.clear()
+        response = self.client.post('/api/token/refresh/', {'refresh': tokens['refresh']})
+        self.assertEqual(response.status_code, 401)
+
+    def test_an_access_token_is_checked_against_the_table_when_the_cache_has_no_answer(self):
+        tokens = self.login('owner@example.com')
+        # A new token is cached as not revoked, authenticating it takes no query
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/price-offers/', **self.bearer(tokens['token']))
+        self.assertFalse([query for query in queries if 'properties_revokedtoken' in query['sql']])
+
+        self.client.post('/api/logout/', **self.bearer(tokens['token']))
+        # As on a worker whose cache never saw the logout, or after an eviction
+        cache.clear()
+        response = self.client.get('/api/price-offers/', **self.bearer(tokens['token']))
+        self.assertEqual(response.status_code, 401)
+        # The answer read from the table is cached again
+        with self.assertNumQueries(0):
+            self.assertTrue(is_revoked(AccessToken(tokens['token'])))
+
+    def test_refresh(self):
+        tokens = self.login('owner@example.com')
+        response = self.client.post('/api/token/refresh/', {'refresh': tokens['refresh']})
+        self.assertEqual(response.status_code, 200)
+        access = response.json()['token']
+        self.assertEqual(self.client.get('/api/properties/', **self.bearer(access)).status_code, 200)
+
+        for refresh in ('', 'garbage', tokens['token']):
+            with self.subTest(refresh=refresh):
+                response = self.client.post('/api/token/refresh/', {'refresh': refresh})
+                self.assertIn(response.status_code, (400, 401))
+
+    def test_refresh_reads_the_claims_again(self):
+        user = create_user('new-contractor@example.com', 'contractor')
+        tokens = self.login('new-contractor@example.com')
+        self.assertIsNone(AccessToken(tokens['token'])['contractor_id'])
+
+        contractor = Contractor.objects.create(
+            user=user, specialization='Plumbing', experience_years=2, license_number='L-2'
+        )
+        access = AccessToken(self.client.post('/api/token/refresh/', {'refresh': tokens['refresh']}).json()['token'])
+        self.assertEqual(access['contractor_id'], contractor.pk)
+
+        CustomUser.objects.filter(pk=user.pk).update(is_active=False)
+        response = self.client.post('/api/token/refresh/', {'refresh': tokens['refresh']})
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(WRITE_TRANSACTION_RETRIES=2, WRITE_TRANSACTION_BACKOFF=0)
+class WriteTransactionTests(TransactionTestCase):
+    def failing(self, *errors):
+        """A function raising ``errors`` in turn, then returning the number of calls"""
+        calls = []
+
+        def func():
+            calls.append(None)
+            if len(calls) <= len(errors):
+                raise errors[len(calls) - 1]
+            return len(calls)
+        return func
+
+    def test_lock_errors_are_retried(self):
+        func = write_transaction(self.failing(
+            OperationalError('database is locked'), OperationalError('database table is locked')
+        ))
+        self.assertEqual(func(), 3)
+
+    def test_retries_run_out(self):
+        locked = OperationalError('database is locked')
+        with self.assertRaises(OperationalError):
+            write_transaction(self.failing(locked, locked, locked))()
+
+    def test_other_errors_and_nested_calls_are_not_retried(self):
+        with self.assertRaisesMessage(OperationalError, 'no such table'):
+            write_transaction(self.failing(OperationalError('no such table: x')))()
+        with transaction.atomic(), self.assertRaises(OperationalError):
+            write_transaction(self.failing(OperationalError('database is locked')))()
+
+    def test_views_let_lock_errors_reach_the_retry(self):
+        admin = create_user('admin@example.com', 'admin')
+        properties = [create_property(create_user('owner@example.com')), create_property(admin)]
+        save = Property.save
+        failures = []
+
+        def locked_once(instance, *args, **kwargs):
+            if not failures:
+                failures.append(instance.pk)
+                raise OperationalError('database is locked')
+            return save(instance, *args, **kwargs)
+
+        for path, property_obj in zip(('/api/properties/{}/approve/', '/api/properties/{}/admin_review/'), properties):
+            failures.clear()
+            with self.subTest(path=path), mock.patch.object(Property, 'save', locked_once):
+                response = self.client.post(path.format(property_obj.pk), {'action': 'approve'}, **auth(admin))
+                self.assertEqual(response.status_code, 200, response.content)
+                self.assertEqual(failures, [property_obj.pk])
+                property_obj.refresh_from_db()
+                self.assertEqual(property_obj.status, 'approved')
+
+
+@mock.patch('properties.db_routers.replica_alias', return_value='replica')
+class ReplicaRouterTests(TestCase):
+    router = PrimaryReplicaRouter()
+
+    def read_alias(self):
+        return self.router.db_for_read(Property)
+
+    def test_reads_use_the_replica_only_in_replica_blocks(self, replica_alias):
+        self.assertEqual(self.read_alias(), 'default')
+        # TestCase wraps each test in a transaction, reads in one stay on the primary
+        with mock.patch.object(connection, 'in_atomic_block', False):
+            with replica_reads():
+                self.assertEqual(self.read_alias(), 'replica')
+            self.assertEqual(self.read_alias(), 'default')
+        with replica_reads():
+            self.assertEqual(self.read_alias(), 'default')
+
+    def test_reads_stick_to_the_primary_after_a_write(self, replica_alias):
+        with mock.patch.object(connection, 'in_atomic_block', False):
+            with replica_reads():
+                self.assertEqual(self.read_alias(), 'replica')
+                self.assertEqual(self.router.db_for_write(Property), 'default')
+                self.assertEqual(self.read_alias(), 'default')
+                self.assertEqual(self.router.db_for_read(PriceOffer), 'default')
+            # The next request starts on the replica again
+            with replica_reads():
+                self.assertEqual(self.read_alias(), 'replica')
+
+    def test_stickiness_is_per_request(self, replica_alias):
+        reads = {}
+        written, read = threading.Event(), threading.Event()
+
+        def writer():
+            with replica_reads():
+                self.router.db_for_write(Property)
+                written.set()
+                read.wait(5)
+
+        def reader():
+            with replica_reads():
+                written.wait(5)
+                reads['other request'] = self.read_alias()
+                read.set()
+
+        with mock.patch.object(connection, 'in_atomic_block', False):
+            threads = [threading.Thread(target=writer), threading.Thread(target=reader)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(5)
+        self.assertEqual(reads, {'other request': 'replica'})
+
+    def test_no_replica_configured(self, replica_alias):
+        replica_alias.return_value = None
+        with mock.patch.object(connection, 'in_atomic_block', False), replica_reads():
+            self.assertEqual(self.read_alias(), 'default')
+
+
+class AsyncViewTests(TestCase):
+    """The async GET views answer exactly as the router's viewset views do"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('admin@example.com', 'admin')
+        cls.homeowner = create_user('owner@example.com')
+        contractor_user = create_user('contractor@example.com', 'contractor')
+        cls.contractor = Contractor.objects.create(
+            user=contractor_user, specialization='Roofing', experience_years=5, license_number='L-1'
+        )
+        cls.properties = []
+        for index, status in enumerate(['approved', 'approved', 'approved', 'pending', 'completed']):
+            property_obj = create_property(
+                cls.homeowner, title=f'Property {index}', status=status,
+                completion_date=timezone.now() if status == 'completed' else None,
+            )
+            PropertyImage.objects.create(property=property_obj, image=f'properties/{index}.jpg', is_thumbnail=True)
+            PriceOffer.objects.create(property=property_obj, contractor=cls.contractor, amount=Decimal('1000'))
+            cls.properties.append(property_obj)
+
+    def sync_get(self, name, path, user, params, **kwargs):
+        headers = auth(user) if user is not None else {}
+        request = APIRequestFactory().get(path, params, **headers)
+        response = IdentityMiddleware(lambda request: router_views[name](request, **kwargs))(request)
+        if hasattr(response, 'render'):
+            response.render()
+        return response.status_code, json.loads(response.content)
+
+    def assert_same(self, name, path, user, params=None, **kwargs):
+        response = self.client.get(path, params or {}, **(auth(user) if user is not None else {}))
+        self.assertEqual(
+            (response.status_code, response.json()), self.sync_get(name, path, user, params or {}, **kwargs)
+        )
+        return response
+
+    def test_property_list(self):
+        contractor = self.contractor.user
+        response = self.assert_same('property-list', '/api/properties/', contractor, {'status': 'approved'})
+        self.assertEqual(len(response.json()), 3)
+        self.assert_same('property-list', '/api/properties/', contractor, {'status': 'approved', 'page_size': 2})
+        # Served by the viewset through the fallback
+        self.assert_same('property-list', '/api/properties/', self.homeowner)
+        self.assert_same('property-list', '/api/properties/', self.admin, {'status': 'pending'})
+        self.assert_same('property-list', '/api/properties/', None)
+
+    def test_property_detail(self):
+        pk = self.properties[0].pk
+        for user in (self.homeowner, self.contractor.user, self.admin, None):
+            with self.subTest(user=user):
+                self.assert_same('property-detail', f'/api/properties/{pk}/', user, pk=pk)
+        self.assert_same('property-detail', '/api/properties/999999/', self.admin, pk=999999)
+
+    def test_completed_list(self):
+        for user in (None, self.homeowner):
+            with self.subTest(user=user):
+                self.assert_same('property-completed-list', '/api/properties/completed-list/', user)
+
+    def test_price_offers(self):
+        response = self.assert_same('priceoffer-list', '/api/price-offers/', self.homeowner)
+        self.assertEqual(len(response.json()), 5)
+        self.assert_same('priceoffer-list', '/api/price-offers/', self.contractor.user)
+        self.assert_same('priceoffer-list', '/api/price-offers/', self.admin)
+
+    def test_other_methods_go_to_the_viewset(self):
+        pk = self.properties[3].pk
+        response = self.client.patch(
+            f'/api/properties/{pk}/', {'title': 'Renamed'}, content_type='application/json', **auth(self.homeowner)
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['title'], 'Renamed')
+        response = self.client.post('/api/price-offers/', {}, **auth(self.homeowner))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('amount', response.json())
+        response = self.client.delete(f'/api/properties/{pk}/')
+        self.assertEqual(response.status_code, 401)
+
+
+class GenerateDatasetTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def generate(self, seed):
+        call_command(
+            'generate_dataset', homeowners=3, contractors=3, admins=1, properties=12, images=1, offers=3,
+            evaluations=0.5, seed=seed, clear=True, stdout=io.StringIO(),
+        )
+        # Primary keys and timestamps differ between runs, the generated values do not
+        users = CustomUser.objects.filter(username__startswith='load-').order_by('username')
+        properties = Property.objects.filter(homeowner__username__startswith='load-').order_by('pk')
+        return {
+            'users': list(users.values_list('username', 'first_name', 'last_name', 'phone', 'role')),
+            'properties': [
+                (
+                    property_obj.homeowner.username, property_obj.title, property_obj.city, property_obj.status,
+                    property_obj.latitude, property_obj.longitude, property_obj.size, property_obj.work_areas,
+                    property_obj.assigned_contractor.user.username if property_obj.assigned_contractor else None,
+                    sorted(
+                        (offer.contractor.user.username, offer.amount, offer.status)
+                        for offer in property_obj.price_offers.all()
+                    ),
+                    [image.image.name for image in property_obj.images.all()],
+                    property_obj.evaluationrequest_set.count(),
+                )
+                for property_obj in properties.select_related('homeowner', 'assigned_contractor__user')
+                .prefetch_related('price_offers__contractor__user', 'images')
+            ],
+        }
+
+    def test_the_same_seed_generates_the_same_data(self):
+        first = self.generate(seed=7)
+        self.assertEqual(len(first['properties']), 12)
+        self.assertEqual(self.generate(seed=7), first)
+        self.assertNotEqual(self.generate(seed=8), first)
+
+
+class ImageWriteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.homeowner = create_user('owner@example.com')
+        contractor_user = create_user('contractor@example.com', 'contractor')
+        cls.contractor = Contractor.objects.create(
+            user=contractor_user, specialization='Roofing', experience_years=5, license_number='L-1'
+        )
+        cls.property = create_property(cls.homeowner, status='in_progress', assigned_contractor=cls.contractor)
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media.name, IMAGE_VARIANTS_ASYNC=False)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def photos(self, count):
+        photos = []
+        for index in range(count):
+            buffer = io.BytesIO()
+            Image.new('RGB', (8, 8), (index, 0, 0)).save(buffer, 'PNG')
+            photos.append(ContentFile(buffer.getvalue(), name=f'photo-{index}.png'))
+        return photos
+
+    def blobs(self):
+        blob_dir = image_storage.path('blobs')
+        return [
+            name for directory, subdirectories, names in os.walk(blob_dir)
+            if os.path.relpath(directory, blob_dir) != 'tmp'
+            for name in names
+        ]
+
+    def create(self, photos):
+        return self.client.post('/api/properties/', {
+            'title': 'Villa', 'description': 'Photos', 'address': 'King Fahd Road', 'city': 'Riyadh',
+            'latitude': '24.713600', 'longitude': '46.675300', 'plot_number': '1',
+            'property_type': 'house', 'size': '250.00', 'condition': 'FAIR', 'uploaded_images': photos,
+        }, **auth(self.homeowner))
+
+    def complete(self, photos):
+        return self.client.post(
+            f'/api/properties/{self.property.pk}/mark_completed/',
+            {'completion_note': 'Done', 'images': photos}, **auth(self.contractor.user)
+        )
+
+    def create_queries(self, count):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.create(self.photos(count))
+        self.assertEqual(response.status_code, 201, response.content)
+        # The transaction is a savepoint in a TestCase, and BEGIN/COMMIT are not captured
+        return [query['sql'] for query in queries if 'SAVEPOINT' not in query['sql']]
+
+    def test_create_with_twenty_photos_runs_twelve_queries_at_most(self):
+        one, twenty = self.create_queries(1), self.create_queries(20)
+        self.assertEqual(len(twenty), len(one))
+        self.assertLessEqual(len(twenty), 12, twenty)
+        self.assertEqual(len([sql for sql in twenty if sql.startswith('INSERT INTO "properties_propertyimage"')]), 1)
+        self.assertEqual(len(self.blobs()), 20)
+
+    def test_a_failed_image_leaves_no_property_and_no_blobs(self):
+        # Fails once the image rows are inserted
+        with mock.patch(
+            'properties.serializers.schedule_image_variants', side_effect=DatabaseError('disk I/O error')
+        ), self.assertRaises(DatabaseError):
+            self.create(self.photos(3))
+        self.assertFalse(Property.objects.filter(description='Photos').exists())
+        self.assertEqual(self.blobs(), [])
+
+    def test_completion_that_fails_leaves_the_property_and_no_blobs(self):
+        with mock.patch.object(
+            CompletionImage.objects, 'bulk_create', side_effect=DatabaseError('disk I/O error')
+        ), self.assertLogs('properties.views', 'ERROR'):
+            response = self.complete(self.photos(2))
+        self.assertEqual(response.status_code, 500)
+        self.property.refresh_from_db()
+        self.assertEqual(self.property.status, 'in_progress')
+        self.assertFalse(CompletionImage.objects.exists())
+        self.assertEqual(self.blobs(), [])
+
+    def test_completion_that_lost_a_race_releases_its_blobs(self):
+        def store_and_complete(images):
+            names = store_blobs(images)
+            # Another request completes the property while the files are stored
+            Property.objects.filter(pk=self.property.pk).update(status='completed')
+            return names
+
+        with mock.patch('properties.views.store_blobs', side_effect=store_and_complete):
+            response = self.complete(self.photos(2))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CompletionImage.objects.exists())
+        self.assertEqual(self.blobs(), [])
+
+
+class IdentityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.homeowner = create_user('owner@example.com')
+        cls.contractor = Contractor.objects.create(
+            user=create_user('contractor@example.com', 'contractor'),
+            specialization='Roofing', experience_years=5, license_number='L-1'
+        )
+        cls.in_progress = create_property(cls.homeowner, status='in_progress', assigned_contractor=cls.contractor)
+        cls.approved = create_property(cls.homeowner, status='approved')
+        PriceOffer.objects.create(property=cls.in_progress, contractor=cls.contractor, amount=Decimal('100'))
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media.name, IMAGE_VARIANTS_ASYNC=False)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def contractor_queries(self, method, path, data=None, **extra):
+        """The statements a contractor's request ran on the contractor table"""
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(path, data, **extra, **auth(self.contractor.user))
+        self.assertLess(response.status_code, 400, response.content)
+        return [query['sql'] for query in queries if 'FROM "properties_contractor"' in query['sql']]
+
+    def test_mark_completed_takes_the_profile_id_from_the_token(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8), 'green').save(buffer, 'PNG')
+        queries = self.contractor_queries(
+            'post', f'/api/properties/{self.in_progress.pk}/mark_completed/',
+            {'completion_note': 'Done', 'images': [ContentFile(buffer.getvalue(), name='done.png')]},
+        )
+        self.assertEqual(queries, [])
+
+    def test_price_offer_create_loads_the_profile_once(self):
+        queries = self.contractor_queries(
+            'post', '/api/price-offers/', {'property': self.approved.pk, 'amount': '250.00', 'description': 'Roof'},
+        )
+        # By the id in the token, with its user, for the offer and the property
+        self.assertEqual(len(queries), 1, queries)
+        self.assertIn(f'WHERE "properties_contractor"."id" = {self.contractor.pk}', queries[0])
+        self.assertIn('INNER JOIN "properties_customuser"', queries[0])
+
+    def test_price_offer_list_takes_the_profile_id_from_the_token(self):
+        queries = self.contractor_queries('get', '/api/price-offers/')
+        self.assertEqual(queries, [])
+
+    def test_the_profile_is_looked_up_once_without_token_claims(self):
+        # As for a session-authenticated request
+        identity = Identity(CustomUser.objects.get(pk=self.contractor.user_id))
+        with self.assertNumQueries(1):
+            self.assertEqual(identity.get_contractor(), self.contractor)
+            self.assertEqual(identity.contractor_id, self.contractor.pk)
+            self.assertIs(identity.get_contractor().user, identity.user)
+
+        request = APIRequestFactory().get('/api/price-offers/')
+        request.identity = identity
+        with self.assertNumQueries(0):
+            self.assertTrue(IsContractor().has_permission(request, None))
+            view = PriceOfferViewSet(request=request, format_kwarg=None)
+            view.scope_queryset(PriceOffer.objects.all())
+
+
+class LoadTestOfferTests(TestCase):
+    def test_each_property_awaiting_an_answer_is_handed_out_once(self):
+        homeowner, other = create_user('owner@example.com'), create_user('other@example.com')
+        contractors = [
+            Contractor.objects.create(
+                user=create_user(f'contractor-{index}@example.com', 'contractor'),
+                specialization='Roofing', experience_years=5, license_number=f'L-{index}'
+            )
+            for index in range(2)
+        ]
+        awaiting = [create_property(owner, status='price_proposed') for owner in (homeowner, homeowner, other)]
+        for property_obj in awaiting:
+            for contractor in contractors:
+                PriceOffer.objects.create(property=property_obj, contractor=contractor, amount=Decimal('100'))
+        # Settled offers are never replayed
+        PriceOffer.objects.create(
+            property=create_property(homeowner, status='in_progress'), contractor=contractors[0],
+            amount=Decimal('100'), status='accepted'
+        )
+
+        sessions, offers = loadtest.Command().build_sessions(10)
+        self.assertEqual(len(sessions['user']), 2)
+        rng = random.Random(1)
+        taken = [offers.take(rng) for _ in range(len(awaiting))]
+        self.assertIsNone(offers.take(rng))
+        self.assertEqual(offers.used, len(awaiting))
+
+        taken_offers = PriceOffer.objects.in_bulk([offer_id for offer_id, headers in taken])
+        self.assertEqual(sorted(offer.property_id for offer in taken_offers.values()),
+                         sorted(property_obj.pk for property_obj in awaiting))
+        # Sent with the owner's headers; the homeowners' sessions are in id order
+        owner_headers = dict(zip((homeowner.pk, other.pk), sessions['user']))
+        for offer_id, headers in taken:
+            self.assertIs(headers, owner_headers[taken_offers[offer_id].property.homeowner_id])
+
+
+class BulkReviewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('admin@example.com', 'admin')
+        cls.homeowner = create_user('owner@example.com')
+        cls.properties = {
+            name: create_property(cls.homeowner, title=name, status=status)
+            for name, status in [('first', 'pending'), ('second', 'pending'), ('approved', 'approved')]
+        }
+
+    def post(self, user, reviews):
+        return self.client.post(
+            '/api/properties/bulk_review/', {'reviews': reviews}, content_type='application/json', **auth(user)
+        )
+
+    def test_only_pending_properties_are_reviewed(self):
+        first, second, approved = (self.properties[name].pk for name in ('first', 'second', 'approved'))
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.post(self.admin, [
+                {'id': first, 'action': 'approve'},
+                {'id': second, 'action': 'reject'},
+                {'id': approved, 'action': 'reject'},
+                {'id': 999999, 'action': 'approve'},
+            ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'approved': 1,
+            'rejected': 1,
+            'results': [
+                {'id': first, 'action': 'approve', 'outcome': 'approved'},
+                {'id': second, 'action': 'reject', 'outcome': 'rejected'},
+                {'id': approved, 'action': 'reject', 'outcome': 'not_pending', 'status': 'approved'},
+                {'id': 999999, 'action': 'approve', 'outcome': 'not_found'},
+            ],
+        })
+        statuses = dict(Property.objects.values_list('pk', 'status'))
+        self.assertEqual([statuses[first], statuses[second], statuses[approved]], ['approved', 'rejected', 'approved'])
+        self.assertEqual(Property.objects.get(pk=first).admin_approver, self.admin)
+        # One cache invalidation for the whole batch
+        self.assertEqual(len(callbacks), 1)
+
+    def test_requests_are_validated(self):
+        pending = self.properties['first'].pk
+        self.assertEqual(self.post(self.homeowner, [{'id': pending, 'action': 'approve'}]).status_code, 403)
+        for reviews in ([], [{'id': pending, 'action': 'approve'}, {'id': pending, 'action': 'reject'}],
+                        [{'id': pending, 'action': 'delete'}]):
+            self.assertEqual(self.post(self.admin, reviews).status_code, 400)
+        self.assertEqual(Property.objects.get(pk=pending).status, 'pending')
+
+
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('admin@example.com', 'admin')
+
+    def setUp(self):
+        metrics_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(metrics_dir.cleanup)
+        settings_override = override_settings(METRICS_DIR=metrics_dir.name, METRICS_TOKEN='scrape-secret')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def get_metrics(self, authorization):
+        return self.client.get('/api/_metrics', HTTP_AUTHORIZATION=authorization)
+
+    def test_requests_are_recorded_by_route_name(self):
+        for _ in range(2):
+            self.client.get('/api/properties/completed-list/')
+        self.client.get('/api/does-not-exist/')
+
+        response = self.get_metrics(f"Token {issue_tokens(self.admin)['token']}")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        labels = 'route="property-completed-list-async",method="GET"'
+        self.assertIn(f'http_requests_total{{{labels},status="200"}} 2', body)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2', body)
+        self.assertIn(f'http_request_duration_seconds_count{{{labels}}} 2', body)
+        self.assertIn(f'http_request_db_queries_total{{{labels}}} ', body)
+        self.assertIn('http_requests_total{route="<unmatched>",method="GET",status="404"} 1', body)
+
+    def test_metrics_are_protected(self):
+        self.assertEqual(self.get_metrics('').status_code, 401)
+        self.assertEqual(self.get_metrics('Bearer wrong-secret').status_code, 401)
+        self.assertEqual(self.get_metrics('Bearer scrape-secret').status_code, 200)
+
+    def test_files_of_exited_workers_are_merged(self):
+        def exited_worker(requests):
+            process = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                                     capture_output=True, text=True, check=True)
+            path = os.path.join(settings.METRICS_DIR, f'worker-{process.stdout.strip()}.metrics')
+            metrics_file = MetricsFile(path, 16)
+            for status in requests:
+                metrics_file.record('property-list', 'GET', status, 0.02, 3, 0.001, 100)
+
+        exited_worker([200, 200])
+        exited_worker([200, 404])
+        series = collect()[('GET', 'property-list')]
+        self.assertEqual(series['status'], {200: 3, 404: 1})
+        self.assertEqual(series['queries'], 12)
+        self.assertEqual(sorted(os.listdir(settings.METRICS_DIR)), ['exited.metrics', 'merge.lock'])
+
+        exited_worker([500])
+        series = collect()[('GET', 'property-list')]
+        self.assertEqual(series['status'], {200: 3, 404: 1, 500: 1})
+        self.assertEqual(series['response_bytes'], 500)
+        self.assertEqual(sum(series['buckets']), 5)
+        self.assertEqual(collect()[('GET', 'property-list')], series)
+
+
+class ProfilingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('admin@example.com', 'admin')
+        cls.homeowner = create_user('owner@example.com')
+
+    def setUp(self):
+        profiles = tempfile.TemporaryDirectory()
+        self.addCleanup(profiles.cleanup)
+        self.profiles = profiles.name
+        settings_override = override_settings(PROFILING_DIR=self.profiles, PROFILING_MAX_PROFILES=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def get_profiled(self, user):
+        return self.client.get('/api/properties/', HTTP_X_PROFILE='1', **auth(user))
+
+    def test_admin_requests_are_profiled(self):
+        response = self.get_profiled(self.admin)
+        profile_id = response['X-Profile-Id']
+        with open(os.path.join(self.profiles, f'{profile_id}.json')) as summary_file:
+            summary = json.load(summary_file)
+        self.assertEqual(summary['route'], 'property-list-async')
+        self.assertEqual(summary['status'], 200)
+        self.assertGreater(summary['sql']['count'], 0)
+        self.assertTrue(all(query['origin'] for query in summary['sql']['queries']))
+        self.assertFalse(any('observe_query' in query['origin'][0] for query in summary['sql']['queries']))
+        self.assertTrue(os.path.exists(os.path.join(self.profiles, f'{profile_id}.folded')))
+
+    def test_other_users_are_not_profiled(self):
+        response = self.get_profiled(self.homeowner)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(os.listdir(self.profiles), [])
+
+    def test_only_the_newest_profiles_are_kept(self):
+        profile_ids = [self.get_profiled(self.admin)['X-Profile-Id'] for _ in range(3)]
+        self.assertEqual(
+            sorted(os.listdir(self.profiles)),
+            sorted(f'{profile_id}{extension}' for profile_id in profile_ids[1:] for extension in ('.folded', '.json'))
+        )
+
+
+class SlowQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('admin@example.com', 'admin')
+        cls.homeowner = create_user('owner@example.com')
+
+    def get(self, user, path):
+        return self.client.get(path, **auth(user))
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0)
+    def test_slow_statements_are_logged_with_their_plan(self):
+        with self.assertLogs('properties.slow_queries', 'WARNING') as logs:
+            self.get(self.admin, '/api/properties/?status=approved')
+        entry = next(record for record in logs.records if '"properties_property"' in record.sql)
+        self.assertEqual(entry.route, 'property-list-async')
+        self.assertEqual(entry.method, 'GET')
+        self.assertTrue(entry.call_site)
+        self.assertTrue(entry.plan)
+        # String parameters are replaced by their length
+        self.assertIn('<str: 8>', entry.params)
+        self.assertNotIn('approved', entry.params)
+
+    def test_top_offenders_are_ranked_by_total_time(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Two workers, one of which has rotated its file
+            for name, sql, duration in (
+                ('worker-1.log', 'SELECT 1', 300), ('worker-1.log.1', 'SELECT 2', 200), ('worker-2.log', 'SELECT 2', 200)
+            ):
+                with open(os.path.join(directory, name), 'w') as log_file:
+                    log_file.write(json.dumps({
+                        'time': '2024-01-01T00:00:00+00:00', 'duration_ms': duration, 'route': 'property-list',
+                        'call_site': 'PropertyViewSet.list', 'sql': sql, 'params': [], 'plan': ['SCAN t'],
+                    }) + '\n')
+            with override_settings(SLOW_QUERY_LOG_DIR=directory):
+                response = self.get(self.admin, '/api/_slow_queries')
+                forbidden = self.get(self.homeowner, '/api/_slow_queries')
+
+        self.assertEqual(response.status_code, 200)
+        offenders = response.json()['offenders']
+        self.assertEqual([(offender['sql'], offender['count'], offender['total_ms']) for offender in offenders],
+                         [('SELECT 2', 2, 400.0), ('SELECT 1', 1, 300.0)])
+        self.assertEqual(offenders[0]['routes'], {'property-list': 2})
+        self.assertEqual(forbidden.status_code, 403)
+
+
+class LoggingTests(TestCase):
+    def test_each_process_writes_a_file_of_its_own(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        handler = WorkerFileHandler(directory.name, max_bytes=1000, backup_count=1)
+        self.addCleanup(handler.close)
+        record = logging.LogRecord('properties.tests', logging.WARNING, __file__, 0, 'slow query', (), None)
+
+        handler.emit(record)
+        # As in a worker forked after logging was configured
+        with mock.patch('os.getpid', return_value=123456):
+            handler.emit(record)
+            handler.emit(record)
+        handler.close()
+
+        own_file = os.path.basename(worker_log_path(directory.name))
+        self.assertEqual(sorted(os.listdir(directory.name)), sorted([own_file, 'worker-123456.log']))
+        with open(os.path.join(directory.name, own_file)) as log_file:
+            self.assertEqual(log_file.read(), 'slow query\n')
+        with open(os.path.join(directory.name, 'worker-123456.log')) as log_file:
+            self.assertEqual(log_file.read(), 'slow query\n' * 2)
+
+    def test_files_beyond_the_cap_are_deleted_oldest_first(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for index, name in enumerate(['worker-1.log', 'worker-1.log.1', 'worker-2.log', 'worker-3.log']):
+            path = os.path.join(directory.name, name)
+            with open(path, 'w') as log_file:
+                log_file.write('slow query\n')
+            os.utime(path, (1000 + index, 1000 + index))
+        handler = WorkerFileHandler(directory.name, max_bytes=20, backup_count=1, max_files=3)
+        self.addCleanup(handler.close)
+        record = logging.LogRecord('properties.tests', logging.WARNING, __file__, 0, 'slow query', (), None)
+
+        handler.emit(record)
+        own_file = os.path.basename(worker_log_path(directory.name))
+        self.assertEqual(sorted(os.listdir(directory.name)), sorted([own_file, 'worker-2.log', 'worker-3.log']))
+
+        # Rotating adds a backup of its own
+        handler.emit(record)
+        self.assertEqual(sorted(os.listdir(directory.name)), sorted([own_file, own_file + '.1', 'worker-3.log']))
+
+    def test_records_are_written_as_capped_json_by_a_background_thread(self):
+        output = io.StringIO()
+        target = logging.StreamHandler(output)
+        target.setFormatter(JsonFormatter())
+        target.name = 'test-output'
+        handler = BackgroundHandler(['test-output'])
+        self.addCleanup(target.close)
+        logger = logging.getLogger('properties.tests.background')
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        self.addCleanup(logger.removeHandler, handler)
+
+        with override_settings(LOG_MAX_FIELD_CHARS=10):
+            logger.info('payload', extra={'body': 'x' * 25, 'fields': ['a', 'b']})
+            thread_id = handler.listener._thread.ident
+            handler.close()
+
+        self.assertNotEqual(thread_id, threading.get_ident())
+        entry = json.loads(output.getvalue())
+        self.assertEqual(entry['message'], 'payload')
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['body'], 'xxxxxxxxxx... (15 more)')
+        self.assertEqual(entry['fields'], ['a', 'b'])
+        self.assertIn('request_id', entry)
+
+    def test_requests_carry_an_id(self):
+        response = self.client.get('/api/properties/completed-list/', HTTP_X_REQUEST_ID='abc-123')
+        self.assertEqual(response['X-Request-ID'], 'abc-123')
+        # Ids that could forge log lines are replaced
+        response = self.client.get('/api/properties/completed-list/', HTTP_X_REQUEST_ID='a b\n')
+        self.assertRegex(response['X-Request-ID'], r'^[0-9a-f]{32}$')
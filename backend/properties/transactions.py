@@ -0,0 +1,54 @@
+import functools
+import random
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+
+def is_lock_error(error):
+    return 'database is locked' in str(error) or 'database table is locked' in str(error)
+
+
+def write_transaction(func=None, using=None):
+    """
+    Run ``func`` in an atomic block that takes SQLite's write lock up front
+    (BEGIN IMMEDIATE) instead of on its first write, so concurrent writers
+    queue on the busy timeout rather than failing with "database is locked"
+    when a read lock cannot be upgraded.
+
+    If the lock still cannot be taken the call is retried with exponential
+    backoff, WRITE_TRANSACTION_RETRIES times. Nested calls join the outer
+    transaction and are not retried on their own. On other databases this
+    is a plain transaction.atomic.
+    """
+    if func is None:
+        return functools.partial(write_transaction, using=using)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        connection = connections[using or DEFAULT_DB_ALIAS]
+        if connection.in_atomic_block:
+            with transaction.atomic(using=using):
+                return func(*args, **kwargs)
+
+        retries = getattr(settings, 'WRITE_TRANSACTION_RETRIES', 5)
+        backoff = getattr(settings, 'WRITE_TRANSACTION_BACKOFF', 0.05)
+        attempt = 0
+        while True:
+            try:
+                if hasattr(connection, 'next_transaction_mode'):
+                    connection.next_transaction_mode = 'IMMEDIATE'
+                with transaction.atomic(using=using):
+                    return func(*args, **kwargs)
+            except OperationalError as e:
+                if not is_lock_error(e) or attempt >= retries:
+                    raise
+                attempt += 1
+                # Jitter so that retrying writers do not collide again
+                time.sleep(backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            finally:
+                if hasattr(connection, 'next_transaction_mode'):
+                    connection.next_transaction_mode = None
+
+    return wrapper
@@ -0,0 +1,162 @@
+import fcntl
+import os
+import re
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+from rest_framework import serializers
+
+from .models import UploadSession
+from .transactions import write_transaction
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+READ_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, detail, status_code=400):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+@write_transaction
+def open_session(owner, filename, size=None):
+    if size is not None and size > settings.UPLOAD_SESSION_MAX_SIZE:
+        raise UploadError('File is too large')
+    # Every session holds a file until it is used or expires, open or committed
+    if UploadSession.objects.filter(owner=owner).count() >= settings.UPLOAD_SESSIONS_PER_USER:
+        raise UploadError('Too many unfinished uploads, use or delete some first', 429)
+    os.makedirs(settings.UPLOAD_SESSION_ROOT, exist_ok=True)
+    session = UploadSession.objects.create(owner=owner, filename=os.path.basename(filename), size=size)
+    open(session.path, 'wb').close()
+    return session
+
+
+def parse_chunk_offset(request):
+    """Offset of a chunk, from a Content-Range header or an ?offset= parameter"""
+    content_range = request.headers.get('Content-Range')
+    if content_range:
+        match = CONTENT_RANGE_RE.match(content_range.strip())
+        if not match:
+            raise UploadError('Invalid Content-Range header')
+        return int(match.group(1))
+    try:
+        return int(request.query_params.get('offset', 0))
+    except ValueError:
+        raise UploadError('Invalid offset')
+
+
+def write_chunk(session, stream, offset, length):
+    """
+    Append ``length`` bytes read from ``stream`` at ``offset``. The body is
+    copied to the session file in small reads, so memory use is bounded by
+    READ_SIZE whatever the chunk size.
+
+    Writers of a session take turns on a lock on its file, and each checks
+    the offset, as last saved, before touching the file.
+    """
+    if length > settings.UPLOAD_CHUNK_MAX_SIZE:
+        raise UploadError('Chunk is too large', 413)
+
+    with open(session.path, 'r+b') as part:
+        fcntl.flock(part, fcntl.LOCK_EX)
+        session.refresh_from_db(fields=['received', 'status'])
+        if session.status != 'open':
+            raise UploadError('Upload is already committed', 409)
+        if offset != session.received:
+            raise UploadError(f'Expected offset {session.received}', 409)
+        limit = session.size if session.size is not None else settings.UPLOAD_SESSION_MAX_SIZE
+        if offset + length > limit:
+            raise UploadError('Chunk goes past the end of the file', 413)
+
+        written = 0
+        part.seek(offset)
+        while written < length:
+            data = stream.read(min(READ_SIZE, length - written))
+            if not data:
+                break
+            part.write(data)
+            written += len(data)
+        part.truncate(offset + written)
+        part.flush()
+
+        # update() skips auto_now, and clear_upload_sessions expires by updated_at
+        UploadSession.objects.filter(pk=session.pk).update(received=offset + written, updated_at=timezone.now())
+        session.received = offset + written
+    return session
+
+
+def commit_session(session):
+    if session.status == 'committed':
+        return session
+    if session.size is not None and session.received != session.size:
+        raise UploadError(f'Upload is incomplete: {session.received} of {session.size} bytes')
+    if not session.received:
+        raise UploadError('Upload is empty')
+    try:
+        with Image.open(session.path) as image:
+            image.verify()
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        raise UploadError('Upload is not a valid image')
+    session.status = 'committed'
+    session.save(update_fields=['status', 'updated_at'])
+    return session
+
+
+def discard_session(session):
+    if os.path.exists(session.path):
+        os.remove(session.path)
+    session.delete()
+
+
+def claim_uploads(owner, upload_ids):
+    """
+    Return open File objects for the caller's committed uploads, in the
+    given order. Pass them to release_uploads once they have been saved,
+    and to close_uploads in any case.
+    """
+    if not upload_ids:
+        return []
+    sessions = {
+        str(session.pk): session
+        for session in UploadSession.objects.filter(owner=owner, status='committed', pk__in=upload_ids)
+    }
+    missing = [str(upload_id) for upload_id in upload_ids if str(upload_id) not in sessions]
+    if missing:
+        raise serializers.ValidationError({'upload_ids': f"Unknown or uncommitted uploads: {', '.join(missing)}"})
+
+    files = []
+    try:
+        for upload_id in upload_ids:
+            session = sessions[str(upload_id)]
+            file = File(open(session.path, 'rb'), name=session.filename)
+            file.upload_session = session
+            files.append(file)
+    except BaseException:
+        close_uploads(files)
+        raise
+    return files
+
+
+def close_uploads(files):
+    """Close claimed uploads, whether or not they were saved"""
+    for file in files:
+        if hasattr(file, 'upload_session'):
+            file.close()
+
+
+def release_uploads(files):
+    """Drop the sessions of saved uploads once the transaction commits"""
+    claimed = [file for file in files if hasattr(file, 'upload_session')]
+    if not claimed:
+        return
+
+    def cleanup():
+        for file in claimed:
+            discard_session(file.upload_session)
+
+    transaction.on_commit(cleanup)
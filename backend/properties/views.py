@@ -1,22 +1,51 @@
+import logging
+
 from django.shortcuts import render
-from rest_framework import viewsets, status
-from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework import viewsets, status, mixins, serializers
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.decorators import action, api_view, authentication_classes, permission_classes
 from rest_framework.response import Response
+from rest_framework_simplejwt.exceptions import InvalidToken
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from django.utils import timezone
-from rest_framework.authtoken.models import Token
 from django.contrib.auth import login
-from .models import CustomUser, Property, Contractor, EvaluationRequest, PropertyImage, PriceOffer, CompletionImage
+from .models import (
+    CustomUser, Property, Contractor, EvaluationRequest, PriceOffer, CompletionImage,
+    PropertyWorkArea, UploadSession
+)
 from .serializers import (
     SignupSerializer, LoginSerializer,
-    CustomUserSerializer, PropertySerializer,
+    CustomUserSerializer, PropertySerializer, PropertyListSerializer,
     ContractorSerializer, EvaluationRequestSerializer,
-    PriceOfferSerializer, PropertyCompletionSerializer
+    PriceOfferSerializer, PropertyCompletionSerializer, UploadSessionSerializer, BulkReviewSerializer
+)
+from .permissions import CanReadMetrics, IsAdmin, IsContractor
+from .authentication import (
+    MetricsTokenAuthentication, issue_tokens, jwt_mode, refresh_access_token, revoke_request_tokens
+)
+from .pagination import KeysetPagination
+from .db_routers import ReplicaReadMixin
+from .filters import GeoFilterBackend, SearchFilterBackend, WorkAreaFilterBackend
+from .caching import cached_facets, cached_showcase_response, invalidate_facets, invalidate_showcase
+from .facets import facet_counts
+from .images import schedule_image_variants
+from .storage import ensure_blob, release_blobs, store_blobs
+from .metrics import collect, render_prometheus
+from .slow_queries import top_offenders
+from .transactions import write_transaction
+from .uploads import (
+    UploadError, claim_uploads, commit_session, discard_session, open_session, parse_chunk_offset,
+    close_uploads, release_uploads, write_chunk
 )
-from .permissions import IsContractor
-from django.db.models import Q
+from django.db import OperationalError, transaction
+from django.db.models import Count, Q
 from rest_framework.parsers import MultiPartParser, FormParser
-from django.http import Http404
+from rest_framework.settings import api_settings
+from django.http import Http404, HttpResponse
+from django.conf import settings
+from django.views.static import serve
+
+logger = logging.getLogger(__name__)
 
 # Create your views here.
 
@@ -31,16 +60,23 @@ class CustomUserViewSet(viewsets.ModelViewSet):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class PropertyViewSet(viewsets.ModelViewSet):
+class PropertyViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Property.objects.all()
     serializer_class = PropertySerializer
+    pagination_class = KeysetPagination
+    filter_backends = [WorkAreaFilterBackend, SearchFilterBackend, GeoFilterBackend]
+    replica_actions = (
+        'list', 'retrieve', 'completed_properties', 'completed_list', 'work_area_counts', 'facets'
+    )
     
     def get_permissions(self):
         """
         Allow public access to list, retrieve, completed properties and completed-list.
         Require authentication for other actions.
         """
-        if self.action in ['list', 'retrieve', 'completed_properties', 'completed_list']:
+        if self.action in [
+            'list', 'retrieve', 'completed_properties', 'completed_list', 'work_area_counts', 'facets'
+        ]:
             return [AllowAny()]
         return [IsAuthenticated()]
 
@@ -50,11 +86,10 @@ class PropertyViewSet(viewsets.ModelViewSet):
         Endpoint for getting completed properties
         URL: /api/properties/completed/
         """
-        completed = Property.objects.filter(
+        completed = self.get_base_queryset().filter(
             status='completed'
         ).order_by('-completion_date')
-        serializer = self.get_serializer(completed, many=True)
-        return Response(serializer.data)
+        return self.paginated_response(completed)
 
     @action(
         detail=False, 
@@ -68,20 +103,130 @@ class PropertyViewSet(viewsets.ModelViewSet):
         Endpoint for getting completed properties
         URL: /api/properties/completed-list/
         """
-        completed_properties = Property.objects.filter(
+        completed_properties = self.get_base_queryset().filter(
             status='completed'
         ).order_by('-completion_date')
         
-        serializer = self.get_serializer(completed_properties, many=True)
+        return cached_showcase_response(
+            request,
+            lambda: self.paginated_response(completed_properties).data
+        )
+
+    @action(detail=False, methods=['get'], url_path='work-area-counts')
+    def work_area_counts(self, request):
+        """
+        Number of visible properties needing each work area, honouring the
+        same filters as the list endpoint
+        URL: /api/properties/work-area-counts/
+        """
+        properties = self.filter_queryset(self.scope_queryset(Property.objects.all()))
+        counts = dict(
+            PropertyWorkArea.objects.filter(property__in=properties.values('id'))
+            .values_list('area')
+            .annotate(count=Count('id'))
+        )
+        return Response([
+            {'area': area, 'label': label, 'count': counts.get(area, 0)}
+            for area, label in Property.WORK_AREA_CHOICES
+        ])
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """
+        Counts per city, district, property type, condition, status and work
+        area for the properties visible to the caller, honouring the same
+        filters as the list endpoint
+        URL: /api/properties/facets/
+        """
+        identity = request.identity
+        if not identity.is_authenticated:
+            scope = 'anonymous'
+        elif identity.is_admin:
+            scope = 'admin'
+        else:
+            scope = f'{identity.role}:{identity.user.pk}'
+
+        data = cached_facets(
+            request,
+            scope,
+            lambda: facet_counts(self.filter_queryset(self.scope_queryset(Property.objects.all())))
+        )
+        return Response(data)
+
+    def list(self, request, *args, **kwargs):
+        # Completed properties are public and identical for every user
+        if request.query_params.get('status') == 'completed':
+            return cached_showcase_response(
+                request,
+                lambda: super(PropertyViewSet, self).list(request, *args, **kwargs).data
+            )
+        return super().list(request, *args, **kwargs)
+
+    def get_cursor_ordering(self):
+        """Stable sort key used by KeysetPagination"""
+        if 'near' in self.request.query_params:
+            return ('distance', 'id')
+        if self.request.query_params.get('q', '').strip():
+            return ('search_rank', 'id')
+        if (self.action in ['completed_properties', 'completed_list']
+                or self.request.query_params.get('status') == 'completed'):
+            return ('-completion_date', '-id')
+        return ('-id',)
+
+    def paginated_response(self, queryset):
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
+    def get_serializer_class(self):
+        """
+        Use the compact representation on list endpoints when the client asks
+        for it with ?view=compact, ?fields= or ?expand=.
+        """
+        params = self.request.query_params
+        if self.action in ['list', 'completed_properties', 'completed_list', 'admin_requests'] and (
+            params.get('view') == 'compact' or 'fields' in params or 'expand' in params
+        ):
+            return PropertyListSerializer
+        return super().get_serializer_class()
+
+    def get_serializer_options(self):
+        """Extra keyword arguments for the serializer and its eager loading"""
+        if self.get_serializer_class() is not PropertyListSerializer:
+            return {}
+        params = self.request.query_params
+        return {
+            'fields': [name for name in params.get('fields', '').split(',') if name],
+            'expand': [name for name in params.get('expand', '').split(',') if name],
+        }
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.update(self.get_serializer_options())
+        return super().get_serializer(*args, **kwargs)
+
+    def get_base_queryset(self):
+        """
+        Shared queryset builder for every property endpoint, with the
+        relations read by the serializer eagerly loaded.
+        """
+        return self.get_serializer_class().setup_eager_loading(
+            Property.objects.all(), **self.get_serializer_options()
+        )
+
     def get_queryset(self):
-        queryset = Property.objects.all()
+        return self.scope_queryset(self.get_base_queryset())
+
+    def scope_queryset(self, queryset):
+        """Restrict a property queryset to what the current user may list"""
         status = self.request.query_params.get('status', None)
+        identity = self.request.identity
         
         # For non-authenticated users, show completed properties and allow property details
-        if not self.request.user.is_authenticated:
-            if self.action == 'list':
+        if not identity.is_authenticated:
+            if self.action in ['list', 'work_area_counts', 'facets']:
                 if status == 'completed':
                     return queryset.filter(status='completed').order_by('-completion_date')
                 return Property.objects.none()
@@ -93,23 +238,24 @@ class PropertyViewSet(viewsets.ModelViewSet):
         if status:
             if status == 'completed':
                 return queryset.filter(status='completed').order_by('-completion_date')
-            elif self.request.user.role == 'contractor':
+            elif identity.is_contractor:
                 if status == 'approved':
                     return queryset.filter(status=status)
-            elif self.request.user.role == 'user':
-                return queryset.filter(homeowner=self.request.user)
-            elif self.request.user.role == 'admin':
+            elif identity.is_homeowner:
+                return queryset.filter(homeowner=identity.user)
+            elif identity.is_admin:
                 return queryset.filter(status=status)
         
         # Default queryset based on user role
-        if self.request.user.role == 'user':
-            return queryset.filter(homeowner=self.request.user)
-        elif self.request.user.role == 'contractor':
+        if identity.is_homeowner:
+            return queryset.filter(homeowner=identity.user)
+        elif identity.is_contractor:
+            if identity.contractor_id is None:
+                return queryset.filter(status='approved')
             return queryset.filter(
-                Q(status='approved') |
-                Q(assigned_contractor__user=self.request.user)
+                Q(status='approved') | Q(assigned_contractor_id=identity.contractor_id)
             )
-        elif self.request.user.role == 'admin':
+        elif identity.is_admin:
             return queryset
         
         return queryset
@@ -130,40 +276,50 @@ class PropertyViewSet(viewsets.ModelViewSet):
             raise Http404("Property not found")
 
     def perform_create(self, serializer):
-        # Set the homeowner and initial status
+        # Set the homeowner and initial status; the serializer stores the
+        # images, then writes the rows in one write transaction
         serializer.save(
-            homeowner=self.request.user,
+            homeowner=self.request.identity.user,
             status='pending'
         )
 
+    def get_upload_ids(self, request):
+        if hasattr(request.data, 'getlist'):
+            upload_ids = request.data.getlist('upload_ids')
+        else:
+            upload_ids = request.data.get('upload_ids') or []
+        field = serializers.ListField(child=serializers.UUIDField())
+        try:
+            return field.run_validation(upload_ids)
+        except ValidationError as e:
+            raise ValidationError({'upload_ids': e.detail})
+
     def create(self, request, *args, **kwargs):
-        # Create a mutable copy of the request data
-        data = request.data.copy()
-        
-        # Create serializer with the data
-        serializer = self.get_serializer(data=data)
+        serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
-
-        # Handle image uploads
-        property_instance = serializer.instance
-        images = request.FILES.getlist('uploaded_images')
-        for image in images:
-            PropertyImage.objects.create(
-                property=property_instance,
-                image=image
+        # Images sent earlier through resumable upload sessions are added
+        # after the multipart ones, all written with the property
+        uploaded = claim_uploads(request.identity.user, self.get_upload_ids(request))
+        try:
+            serializer.validated_data['uploaded_images'] = (
+                serializer.validated_data.get('uploaded_images', []) + uploaded
             )
-        
+            self.perform_create(serializer)
+            release_uploads(uploaded)
+        finally:
+            close_uploads(uploaded)
+
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
     @action(detail=True, methods=['post'])
+    @write_transaction
     def admin_review(self, request, pk=None):
         """
         Action to handle admin review of properties
         URL: /api/properties/{id}/admin_review/
         """
-        if request.user.role != 'admin':
+        if not request.identity.is_admin:
             return Response(
                 {"detail": "Only admins can review properties"},
                 status=status.HTTP_403_FORBIDDEN
@@ -174,7 +330,7 @@ class PropertyViewSet(viewsets.ModelViewSet):
         
         if action == 'approve':
             property.status = 'approved'
-            property.admin_approver = request.user
+            property.admin_approver = request.identity.user
             property.save()
             return Response({"detail": "Property approved successfully"})
         elif action == 'reject':
@@ -188,6 +344,7 @@ class PropertyViewSet(viewsets.ModelViewSet):
             )
 
     @action(detail=True, methods=['post'], permission_classes=[IsContractor])
+    @write_transaction
     def contractor_review(self, request, pk=None):
         try:
             property = self.get_object()
@@ -219,8 +376,9 @@ class PropertyViewSet(viewsets.ModelViewSet):
             )
 
     @action(detail=True, methods=['post'])
+    @write_transaction
     def assign_contractor(self, request, pk=None):
-        if request.user.role != 'admin':
+        if not request.identity.is_admin:
             return Response({"error": "Only admins can assign contractors"},
                           status=status.HTTP_403_FORBIDDEN)
         
@@ -252,14 +410,20 @@ class PropertyViewSet(viewsets.ModelViewSet):
     def mark_completed(self, request, pk=None):
         try:
             property_obj = self.get_object()
-            contractor = Contractor.objects.get(user=request.user)
+            contractor_id = request.identity.get_contractor_id()
 
-            # Debug logs
-            print("Request data:", request.data)
-            print("Request FILES:", request.FILES)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('mark_completed request', extra={
+                    'property_id': property_obj.pk,
+                    'fields': sorted(request.data.keys()),
+                    'files': [
+                        {'field': field, 'name': upload.name, 'size': upload.size}
+                        for field, uploads in request.FILES.lists() for upload in uploads
+                    ],
+                })
 
             # Verify this contractor is assigned to the property
-            if property_obj.assigned_contractor != contractor:
+            if property_obj.assigned_contractor_id != contractor_id:
                 return Response(
                     {"detail": "You are not assigned to this property"},
                     status=status.HTTP_403_FORBIDDEN
@@ -282,30 +446,69 @@ class PropertyViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            # Update property status
-            property_obj.status = 'completed'
-            property_obj.completion_note = serializer.validated_data['completion_note']
-            property_obj.completion_date = timezone.now()
-            property_obj.save()
-
-            # Handle image uploads
-            images = request.FILES.getlist('images')
-            descriptions = request.data.getlist('image_descriptions', [])
-
-            if not images:
+            try:
+                uploaded = claim_uploads(request.identity.user, serializer.validated_data.get('upload_ids', []))
+            except ValidationError as e:
                 return Response(
-                    {"detail": "No images provided"},
+                    {
+                        "detail": "Invalid data provided",
+                        "errors": e.detail
+                    },
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            # Create completion images
-            for index, image in enumerate(images):
-                description = descriptions[index] if index < len(descriptions) else ""
-                CompletionImage.objects.create(
-                    property=property_obj,
-                    image=image,
-                    description=description
-                )
+            try:
+                images = serializer.validated_data.get('images', []) + uploaded
+                descriptions = serializer.validated_data.get('image_descriptions', [])
+
+                if not images:
+                    return Response(
+                        {"detail": "No images provided"},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+
+                # Hash and store the files before taking the write lock
+                blobs = store_blobs(images)
+
+                # The status and every image are written together, or not at all
+                @write_transaction
+                def complete():
+                    if not Property.objects.filter(pk=property_obj.pk, status='in_progress').exists():
+                        return False
+                    property_obj.status = 'completed'
+                    property_obj.completion_note = serializer.validated_data['completion_note']
+                    property_obj.completion_date = timezone.now()
+                    property_obj.save()
+
+                    completion_images = CompletionImage.objects.bulk_create([
+                        CompletionImage(
+                            property=property_obj,
+                            image=name,
+                            description=descriptions[index] if index < len(descriptions) else ""
+                        )
+                        for index, name in enumerate(blobs)
+                    ])
+                    for name, image in zip(blobs, images):
+                        ensure_blob(name, image)
+                    # bulk_create sends no post_save, so refresh the showcase here
+                    transaction.on_commit(invalidate_showcase)
+                    schedule_image_variants(completion_images)
+                    release_uploads(uploaded)
+                    return True
+
+                try:
+                    completed = complete()
+                except BaseException:
+                    release_blobs(blobs)
+                    raise
+                if not completed:
+                    release_blobs(blobs)
+                    return Response(
+                        {"detail": "This property is not in progress"},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+            finally:
+                close_uploads(uploaded)
 
             return Response({
                 "detail": "Property marked as completed with images",
@@ -317,8 +520,11 @@ class PropertyViewSet(viewsets.ModelViewSet):
                 {"detail": "Contractor profile not found"},
                 status=status.HTTP_404_NOT_FOUND
             )
+        except OperationalError:
+            # Raised once write_transaction has given up, or a database error
+            raise
         except Exception as e:
-            print("Error:", str(e))  # Debug log
+            logger.exception('mark_completed failed', extra={'property_id': pk})
             return Response(
                 {"detail": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -327,26 +533,101 @@ class PropertyViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def admin_requests(self, request):
         """Get properties pending admin review"""
-        if request.user.role != 'admin':
+        if not request.identity.is_admin:
             return Response(
                 {"detail": "Only admins can view pending requests"},
                 status=status.HTTP_403_FORBIDDEN
             )
         
         # Get properties pending admin review
-        properties = Property.objects.filter(status='pending')
+        properties = self.get_base_queryset().filter(status='pending')
         
-        serializer = self.get_serializer(properties, many=True)
-        return Response(serializer.data)
+        return self.paginated_response(properties)
 
-class ContractorViewSet(viewsets.ModelViewSet):
-    queryset = Contractor.objects.all()
+    @action(detail=False, methods=['post'])
+    @write_transaction
+    def bulk_review(self, request):
+        """
+        Approve or reject many pending properties at once, in one transaction.
+        Body: {"reviews": [{"id": 1, "action": "approve"}, {"id": 2, "action": "reject"}]}
+        Every id gets an outcome: "approved", "rejected", "not_found", or
+        "not_pending" with the status it has instead.
+        URL: /api/properties/bulk_review/
+        """
+        if not request.identity.is_admin:
+            return Response(
+                {"detail": "Only admins can review properties"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        serializer = BulkReviewSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {
+                    "detail": "Invalid data provided",
+                    "errors": serializer.errors
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        reviews = serializer.validated_data['reviews']
+
+        # Locked until the updates below on databases with row locks; SQLite
+        # holds its write lock from the start, see write_transaction
+        statuses = dict(
+            Property.objects.select_for_update()
+            .filter(pk__in=[review['id'] for review in reviews])
+            .values_list('pk', 'status')
+        )
+        to_review = {'approve': [], 'reject': []}
+        for review in reviews:
+            if statuses.get(review['id']) == 'pending':
+                to_review[review['action']].append(review['id'])
+
+        # Conditional updates: nothing that stopped being pending is overwritten
+        pending = Property.objects.filter(status='pending')
+        updated = set()
+        if to_review['approve']:
+            pending.filter(pk__in=to_review['approve']).update(
+                status='approved', admin_approver=request.identity.user
+            )
+            updated.update(to_review['approve'])
+        if to_review['reject']:
+            pending.filter(pk__in=to_review['reject']).update(status='rejected')
+            updated.update(to_review['reject'])
+        if updated:
+            # update() sends no post_save, and approving or rejecting never
+            # touches completed properties, so only the facets are stale
+            transaction.on_commit(invalidate_facets)
+
+        results = []
+        for review in reviews:
+            property_id = review['id']
+            if property_id in updated:
+                outcome = 'approved' if review['action'] == 'approve' else 'rejected'
+                results.append({"id": property_id, "action": review['action'], "outcome": outcome})
+            elif property_id in statuses:
+                results.append({
+                    "id": property_id, "action": review['action'], "outcome": 'not_pending',
+                    "status": statuses[property_id]
+                })
+            else:
+                results.append({"id": property_id, "action": review['action'], "outcome": 'not_found'})
+        return Response({
+            "approved": len(to_review['approve']),
+            "rejected": len(to_review['reject']),
+            "results": results,
+        })
+
+class ContractorViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
+    # ContractorSerializer nests the user
+    queryset = Contractor.objects.select_related('user')
     serializer_class = ContractorSerializer
     permission_classes = [IsAuthenticated]
 
     @action(detail=True, methods=['post'])
+    @write_transaction
     def submit_evaluation(self, request, pk=None):
-        if request.user.role != 'contractor':
+        if not request.identity.is_contractor:
             return Response({"error": "Only contractors can submit evaluations"},
                           status=status.HTTP_403_FORBIDDEN)
         
@@ -361,7 +642,7 @@ class ContractorViewSet(viewsets.ModelViewSet):
         try:
             property = Property.objects.get(
                 id=property_id,
-                assigned_contractor__user=request.user
+                assigned_contractor_id=request.identity.get_contractor_id()
             )
             
             property.evaluation_report = evaluation_report
@@ -373,55 +654,66 @@ class ContractorViewSet(viewsets.ModelViewSet):
             # Update evaluation request
             eval_request = EvaluationRequest.objects.get(
                 property=property,
-                contractor__user=request.user
+                contractor_id=request.identity.contractor_id
             )
             eval_request.completed = True
             eval_request.save()
             
             return Response(PropertySerializer(property).data)
-        except Property.DoesNotExist:
+        except (Property.DoesNotExist, Contractor.DoesNotExist):
             return Response({"error": "Property not found or not assigned to you"},
                           status=status.HTTP_404_NOT_FOUND)
 
-class EvaluationRequestViewSet(viewsets.ModelViewSet):
+class EvaluationRequestViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = EvaluationRequest.objects.all()
     serializer_class = EvaluationRequestSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        user = self.request.user
-        if user.role == 'admin':
+        identity = self.request.identity
+        if identity.is_admin:
             return EvaluationRequest.objects.all()
-        elif user.role == 'contractor':
-            return EvaluationRequest.objects.filter(contractor__user=user)
+        elif identity.is_contractor:
+            return EvaluationRequest.objects.filter(contractor_id=identity.contractor_id)
         return EvaluationRequest.objects.none()
 
-class PriceOfferViewSet(viewsets.ModelViewSet):
+class PriceOfferViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = PriceOffer.objects.all()
     serializer_class = PriceOfferSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def get_cursor_ordering(self):
+        """Stable sort key used by KeysetPagination"""
+        return ('-proposed_at', '-id')
     
     def get_queryset(self):
-        user = self.request.user
-        if user.role == 'contractor':
-            try:
-                # Contractors see their own offers
-                contractor = Contractor.objects.get(user=user)
-                return PriceOffer.objects.filter(contractor=contractor)
-            except Contractor.DoesNotExist:
+        return self.scope_queryset(PriceOfferSerializer.setup_eager_loading(PriceOffer.objects.all()))
+
+    def scope_queryset(self, queryset):
+        """Restrict a price offer queryset to what the current user may list"""
+        identity = self.request.identity
+        if identity.is_contractor:
+            # Contractors see their own offers
+            if identity.contractor_id is None:
                 # If no contractor profile exists, return empty queryset
-                return PriceOffer.objects.none()
-        elif user.role == 'user':
+                return queryset.none()
+            return queryset.filter(contractor_id=identity.contractor_id)
+        elif identity.is_homeowner:
             # Property owners see offers for their properties
-            return PriceOffer.objects.filter(property__homeowner=user)
-        elif user.role == 'admin':
+            return queryset.filter(property__homeowner=identity.user)
+        elif identity.is_admin:
             # Admins see all offers
-            return PriceOffer.objects.all()
-        return PriceOffer.objects.none()
+            return queryset
+        return queryset.none()
     
+    @write_transaction
     def perform_create(self, serializer):
+        if not self.request.identity.is_contractor:
+            raise PermissionDenied("Only contractors can make price offers")
+
         # Get the contractor profile for the current user
-        contractor = Contractor.objects.get(user=self.request.user)
+        contractor = self.request.identity.get_contractor()
         
         # Save the offer with the contractor
         offer = serializer.save(
@@ -435,22 +727,93 @@ class PriceOfferViewSet(viewsets.ModelViewSet):
         property_obj.assigned_contractor = contractor
         property_obj.save()
 
+class UploadSessionViewSet(mixins.CreateModelMixin,
+                           mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin,
+                           viewsets.GenericViewSet):
+    """
+    Resumable uploads for property and completion photos.
+
+    POST   /api/uploads/               {"filename": ..., "size": ...} opens a session
+    PUT    /api/uploads/{id}/          raw bytes, with "Content-Range: bytes start-end/total"
+                                       or ?offset=; returns the new offset
+    GET    /api/uploads/{id}/          current offset, to resume after a failure
+    POST   /api/uploads/{id}/commit/   validates the file; its id can then be sent
+                                       as upload_ids to property create or mark_completed
+    DELETE /api/uploads/{id}/          abandons the upload
+    """
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(owner=self.request.identity.user)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            session = open_session(
+                request.identity.user,
+                serializer.validated_data['filename'],
+                serializer.validated_data.get('size')
+            )
+        except UploadError as e:
+            return Response({"detail": e.detail}, status=e.status_code)
+        return Response(self.get_serializer(session).data, status=status.HTTP_201_CREATED)
+
+    def update(self, request, *args, **kwargs):
+        session = self.get_object()
+        if not request.headers.get('Content-Length'):
+            return Response({"detail": "Content-Length is required"}, status=status.HTTP_411_LENGTH_REQUIRED)
+        try:
+            length = int(request.headers['Content-Length'])
+            if length < 0:
+                raise ValueError(length)
+            # Stream the raw body to disk, request.data is never parsed
+            write_chunk(session, request.stream, parse_chunk_offset(request), length)
+        except ValueError:
+            return Response({"detail": "Invalid Content-Length"}, status=status.HTTP_400_BAD_REQUEST)
+        except UploadError as e:
+            session.refresh_from_db()
+            return Response(
+                {"detail": e.detail, "received": session.received},
+                status=e.status_code
+            )
+        return Response(self.get_serializer(session).data)
+
+    @action(detail=True, methods=['post'])
+    def commit(self, request, pk=None):
+        session = self.get_object()
+        try:
+            commit_session(session)
+        except UploadError as e:
+            return Response({"detail": e.detail}, status=e.status_code)
+        return Response(self.get_serializer(session).data)
+
+    def perform_destroy(self, instance):
+        discard_session(instance)
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@write_transaction
 def accept_price_offer(request, offer_id):
-    user = request.user
-    if user.role != 'user':
+    user = request.identity.user
+    if not request.identity.is_homeowner:
         return Response(
             {"detail": "Only property owners can accept offers"},
             status=status.HTTP_403_FORBIDDEN
         )
     
     try:
-        offer = PriceOffer.objects.get(id=offer_id)
+        # The property is serialized in the response
+        offer = PriceOffer.objects.select_related(
+            'property__homeowner', 'property__assigned_contractor__user'
+        ).get(id=offer_id)
         property_obj = offer.property
         
         # Verify the user owns this property
-        if property_obj.homeowner != user:
+        if property_obj.homeowner_id != user.pk:
             return Response(
                 {"detail": "You don't own this property"},
                 status=status.HTTP_403_FORBIDDEN
@@ -482,9 +845,10 @@ def accept_price_offer(request, offer_id):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@write_transaction
 def reject_price_offer(request, offer_id):
-    user = request.user
-    if user.role != 'user':
+    user = request.identity.user
+    if not request.identity.is_homeowner:
         return Response(
             {"detail": "Only property owners can reject offers"},
             status=status.HTTP_403_FORBIDDEN
@@ -495,7 +859,7 @@ def reject_price_offer(request, offer_id):
         property_obj = offer.property
         
         # Verify the user owns this property
-        if property_obj.homeowner != user:
+        if property_obj.homeowner_id != user.pk:
             return Response(
                 {"detail": "You don't own this property"},
                 status=status.HTTP_403_FORBIDDEN
@@ -522,9 +886,9 @@ def reject_price_offer(request, offer_id):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@write_transaction
 def complete_property_work(request, property_id):
-    user = request.user
-    if user.role != 'contractor':
+    if not request.identity.is_contractor:
         return Response(
             {"detail": "Only contractors can mark work as completed"},
             status=status.HTTP_403_FORBIDDEN
@@ -532,10 +896,10 @@ def complete_property_work(request, property_id):
     
     try:
         property_obj = Property.objects.get(id=property_id)
-        contractor = Contractor.objects.get(user=user)
+        contractor_id = request.identity.get_contractor_id()
         
         # Verify this contractor is assigned to the property
-        if property_obj.assigned_contractor != contractor:
+        if property_obj.assigned_contractor_id != contractor_id:
             return Response(
                 {"detail": "You are not assigned to this property"},
                 status=status.HTTP_403_FORBIDDEN
@@ -556,6 +920,11 @@ def complete_property_work(request, property_id):
             {"detail": "Property work marked as completed"},
             status=status.HTTP_200_OK
         )
+    except Contractor.DoesNotExist:
+        return Response(
+            {"detail": "Contractor profile not found"},
+            status=status.HTTP_404_NOT_FOUND
+        )
     except Property.DoesNotExist:
         return Response(
             {"detail": "Property not found"},
@@ -568,9 +937,8 @@ def signup_view(request):
     serializer = SignupSerializer(data=request.data)
     if serializer.is_valid():
         user = serializer.save()
-        token, created = Token.objects.get_or_create(user=user)
         return Response({
-            'token': token.key,
+            **issue_tokens(user),
             'user': CustomUserSerializer(user).data
         }, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -581,25 +949,38 @@ def login_view(request):
     serializer = LoginSerializer(data=request.data)
     if serializer.is_valid():
         user = serializer.validated_data
-        login(request, user)
-        token, created = Token.objects.get_or_create(user=user)
+        if not jwt_mode():
+            login(request, user)
         return Response({
-            'token': token.key,
+            **issue_tokens(user),
             'user': CustomUserSerializer(user).data
         })
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['POST'])
+@permission_classes([AllowAny])
+@authentication_classes([])
+def refresh_token_view(request):
+    """Exchange a refresh token for a new access token"""
+    raw_refresh = request.data.get('refresh')
+    if not raw_refresh:
+        return Response({"detail": "A refresh token is required"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        return Response({'token': refresh_access_token(raw_refresh)})
+    except InvalidToken as e:
+        return Response(e.detail, status=status.HTTP_401_UNAUTHORIZED)
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def logout_view(request):
-    request.user.auth_token.delete()
+    revoke_request_tokens(request)
     return Response(status=status.HTTP_200_OK)
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@write_transaction
 def mark_property_completed(request, property_id):
-    user = request.user
-    if user.role != 'contractor':
+    if not request.identity.is_contractor:
         return Response(
             {"detail": "Only contractors can mark properties as completed"},
             status=status.HTTP_403_FORBIDDEN
@@ -607,13 +988,13 @@ def mark_property_completed(request, property_id):
     
     try:
         # Get the contractor profile
-        contractor = Contractor.objects.get(user=user)
+        contractor_id = request.identity.get_contractor_id()
         
         # Get the property
         property_obj = Property.objects.get(id=property_id)
         
         # Check if this contractor is assigned to the property
-        if property_obj.assigned_contractor != contractor:
+        if property_obj.assigned_contractor_id != contractor_id:
             return Response(
                 {"detail": "You are not assigned to this property"},
                 status=status.HTTP_403_FORBIDDEN
@@ -648,9 +1029,10 @@ def mark_property_completed(request, property_id):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@write_transaction
 def admin_review_standalone(request, property_id):
     """Standalone view for admin review"""
-    if request.user.role != 'admin':
+    if not request.identity.is_admin:
         return Response(
             {"detail": "Only admins can review properties"},
             status=status.HTTP_403_FORBIDDEN
@@ -681,7 +1063,7 @@ def admin_review_standalone(request, property_id):
         
         if action == 'approve':
             property_obj.status = 'approved'
-            property_obj.admin_approver = request.user
+            property_obj.admin_approver = request.identity.user
             property_obj.save()
             return Response({"detail": "Property approved successfully"})
         elif action == 'reject':
@@ -699,6 +1081,9 @@ def admin_review_standalone(request, property_id):
             {"detail": "Property not found"},
             status=status.HTTP_404_NOT_FOUND
         )
+    except OperationalError:
+        # Left to write_transaction, which retries when the database is locked
+        raise
     except Exception as e:
         return Response(
             {"detail": f"Error: {str(e)}"},
@@ -707,6 +1092,7 @@ def admin_review_standalone(request, property_id):
 
 @api_view(['POST'])
 @permission_classes([IsAdminUser])
+@write_transaction
 def admin_review_property(request, pk):
     try:
         property = Property.objects.get(pk=pk)
@@ -722,7 +1108,7 @@ def admin_review_property(request, pk):
         
         # Update property
         property.status = status
-        property.admin_approver = request.user
+        property.admin_approver = request.identity.user
         
         # If there's a rejection reason
         if status == 'rejected' and 'rejection_reason' in request.data:
@@ -740,6 +1126,8 @@ def admin_review_property(request, pk):
             {"error": "Property not found"}, 
             status=status.HTTP_404_NOT_FOUND
         )
+    except OperationalError:
+        raise
     except Exception as e:
         return Response(
             {"error": str(e)},
@@ -748,9 +1136,10 @@ def admin_review_property(request, pk):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@write_transaction
 def approve_property(request, property_id):
     """Alternative endpoint for admin approval"""
-    if request.user.role != 'admin':
+    if not request.identity.is_admin:
         return Response(
             {"detail": "Only admins can approve properties"},
             status=status.HTTP_403_FORBIDDEN
@@ -764,7 +1153,7 @@ def approve_property(request, property_id):
         
         if action == 'approve':
             property_obj.status = 'approved'
-            property_obj.admin_approver = request.user
+            property_obj.admin_approver = request.identity.user
             property_obj.save()
             return Response({"detail": "Property approved successfully"})
         elif action == 'reject':
@@ -782,8 +1171,51 @@ def approve_property(request, property_id):
             {"detail": "Property not found"},
             status=status.HTTP_404_NOT_FOUND
         )
+    except OperationalError:
+        raise
     except Exception as e:
         return Response(
             {"detail": f"Error: {str(e)}"},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+def serve_media_blob(request, path):
+    """
+    Serve content-addressed media (see storage.ContentAddressedStorage) with
+    far-future cache headers. Blob URLs change whenever their content does.
+    """
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@api_view(['GET'])
+@authentication_classes([MetricsTokenAuthentication, *api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+@permission_classes([CanReadMetrics])
+def metrics_view(request):
+    """
+    Per-route request metrics of every worker, in the Prometheus text format.
+    Readable by admins and by scrapers sending settings.METRICS_TOKEN.
+    URL: /api/_metrics
+    """
+    return HttpResponse(
+        render_prometheus(collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsAdmin])
+def slow_queries_view(request):
+    """
+    The statements in the slow query log of every worker that took the most
+    time in total, with their call site and plan.
+    Query params: limit (default 20, at most 100)
+    URL: /api/_slow_queries
+    """
+    try:
+        limit = min(int(request.query_params.get('limit', 20)), 100)
+    except ValueError:
+        raise ValidationError({'limit': 'Must be a whole number'})
+    return Response({
+        'threshold_ms': settings.SLOW_QUERY_THRESHOLD_MS,
+        'offenders': top_offenders(max(limit, 1)),
+    })
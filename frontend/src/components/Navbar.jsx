@@ -10,8 +10,9 @@ function Navbar() {
 
   const logoutMutation = useMutation({
     mutationFn: async () => {
-      await api.post("/logout/");
+      await api.post("/logout/", { refresh: localStorage.getItem("refresh") });
       localStorage.removeItem("token");
+      localStorage.removeItem("refresh");
       localStorage.removeItem("userRole");
       navigate("/login");
     },
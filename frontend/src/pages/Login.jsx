@@ -19,6 +19,7 @@ function Login() {
     },
     onSuccess: (data) => {
       localStorage.setItem("token", data.token);
+      if (data.refresh) localStorage.setItem("refresh", data.refresh);
       localStorage.setItem("userRole", data.user.role);
       navigate("/");
     },
@@ -29,6 +29,7 @@ function Signup() {
     },
     onSuccess: (data) => {
       localStorage.setItem("token", data.token);
+      if (data.refresh) localStorage.setItem("refresh", data.refresh);
       navigate("/");
     },
   });
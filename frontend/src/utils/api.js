@@ -13,4 +13,36 @@ api.interceptors.request.use((config) => {
   return config
 })
 
-export default api 
\ No newline at end of file
+// Access tokens are short lived: on a 401 get a new one with the refresh
+// token and retry the request once
+let refreshing = null
+
+api.interceptors.response.use(
+  (response) => response,
+  async (error) => {
+    const { config, response } = error
+    const refresh = localStorage.getItem('refresh')
+    if (!response || response.status !== 401 || !refresh || config._retried) {
+      return Promise.reject(error)
+    }
+    config._retried = true
+    try {
+      if (!refreshing) {
+        refreshing = axios
+          .post(`${api.defaults.baseURL}/token/refresh/`, { refresh })
+          .finally(() => {
+            refreshing = null
+          })
+      }
+      const { data } = await refreshing
+      localStorage.setItem('token', data.token)
+      return api(config)
+    } catch (refreshError) {
+      localStorage.removeItem('token')
+      localStorage.removeItem('refresh')
+      return Promise.reject(error)
+    }
+  }
+)
+
+export default api